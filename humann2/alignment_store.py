@@ -0,0 +1,368 @@
+"""
+HUMAnN2: alignment_store module
+Store all of the candidate alignments so the gene families and pathways can be
+computed again with new alignment thresholds
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+The store has the nucleotide alignments (identity and alignment length) and the
+translated alignments (identity, alignment length, e-value, query and subject
+coordinates, and query length) before any of the filters are applied, along with
+the reads unaligned by the nucleotide search and the number of reads each query
+represents. The file is compressed and has a header with the settings of the run,
+the query and reference names (each stored once), and a column of values for 
+each field (little endian).
+
+The filters are applied to the columns as masks. As in a full run the translated
+alignments are only used for the reads unaligned after the nucleotide filters. 
+Reads which no longer pass the nucleotide filters with new thresholds have no 
+translated alignments (they were not included in the translated search) so they are
+counted as unaligned.
+"""
+
+import gzip
+import json
+import struct
+import array
+import itertools
+import logging
+from collections import defaultdict
+
+from . import config
+from . import columnar_tables
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+MAGIC=b"HUMAnN2A"
+VERSION=1
+FILE_EXTENSION=config.alignment_store_extension
+COMPRESS_LEVEL=1
+
+# magic, version, and the size of the metadata (json)
+HEADER_FORMAT="<8sII"
+SECTION_SIZE_FORMAT="<Q"
+
+QUERY_COLUMNS=[("weight","I"),("unmapped","B")]
+NUCLEOTIDE_COLUMNS=[("query","I"),("reference","I"),("identity","d"),("alignment_length","d")]
+TRANSLATED_COLUMNS=[("query","I"),("reference","I"),("identity","d"),("alignment_length","d"),
+    ("evalue","d"),("query_start","i"),("query_end","i"),("query_length","i"),
+    ("subject_start","i"),("subject_end","i")]
+NUCLEOTIDE_NAMES=[name for name, typecode in NUCLEOTIDE_COLUMNS]
+TRANSLATED_NAMES=[name for name, typecode in TRANSLATED_COLUMNS]
+
+# the settings of the run stored in the metadata
+METADATA_SETTINGS=["search_mode","identity_threshold","evalue_threshold",
+    "translated_query_coverage_threshold","translated_subject_coverage_threshold",
+    "translated_alignment_selected"]
+
+def is_alignment_store(file):
+    """
+    Check if the file is an alignment store
+    """
+    
+    try:
+        with gzip.open(file, "rb") as file_handle:
+            return file_handle.read(len(MAGIC)) == MAGIC
+    except (EnvironmentError, EOFError):
+        return False
+
+class AlignmentStore(object):
+    """
+    Holds all of the candidate alignments before the filters are applied
+    """
+    
+    def __init__(self, nucleotide_stage=True):
+        """
+        The nucleotide stage is not run for blastm8 input files so all of 
+        the translated alignments are used
+        """
+        
+        self.nucleotide_stage=nucleotide_stage
+        self.metadata={}
+        self.queries=[]
+        self.references=[]
+        self.__query_index={}
+        self.__reference_index={}
+        self.query_columns=dict((name, array.array(typecode)) for name, typecode in QUERY_COLUMNS)
+        self.nucleotide=dict((name, array.array(typecode)) for name, typecode in NUCLEOTIDE_COLUMNS)
+        self.translated=dict((name, array.array(typecode)) for name, typecode in TRANSLATED_COLUMNS)
+        
+    def _query(self, query, weight):
+        """
+        Return the index of the query, add if not already stored
+        """
+        
+        index=self.__query_index.get(query)
+        if index is None:
+            index=len(self.queries)
+            self.__query_index[query]=index
+            self.queries.append(query)
+            self.query_columns["weight"].append(weight)
+            self.query_columns["unmapped"].append(0)
+        return index
+    
+    def _reference(self, reference):
+        """
+        Return the index of the reference, add if not already stored
+        """
+        
+        index=self.__reference_index.get(reference)
+        if index is None:
+            index=len(self.references)
+            self.__reference_index[reference]=index
+            self.references.append(reference)
+        return index
+        
+    def add_unmapped(self, query, weight=1):
+        """
+        Add a read which is not aligned in the nucleotide search
+        The weight is the number of reads the query represents
+        """
+        
+        self.query_columns["unmapped"][self._query(query, weight)]=1
+        
+    def add_nucleotide(self, query, reference, identity, alignment_length, weight=1):
+        """
+        Add a nucleotide alignment
+        """
+        
+        values=[self._query(query, weight), self._reference(reference), identity, alignment_length]
+        for name, value in zip(NUCLEOTIDE_NAMES, values):
+            self.nucleotide[name].append(value)
+            
+    def add_translated(self, query, reference, identity, alignment_length, evalue, query_start,
+        query_end, query_length, subject_start, subject_end, weight=1):
+        """
+        Add a translated alignment (the e-value is not logged)
+        """
+        
+        values=[self._query(query, weight), self._reference(reference), identity, alignment_length,
+            evalue, query_start, query_end, query_length, subject_start, subject_end]
+        for name, value in zip(TRANSLATED_NAMES, values):
+            self.translated[name].append(value)
+            
+    def count_nucleotide(self):
+        """ Return the total number of nucleotide alignments """
+        
+        return len(self.nucleotide["query"])
+    
+    def count_translated(self):
+        """ Return the total number of translated alignments """
+        
+        return len(self.translated["query"])
+    
+    def _sections(self):
+        """
+        Yield the data for each section of the file
+        """
+        
+        yield "\n".join(self.queries).encode("utf-8")
+        yield "\n".join(self.references).encode("utf-8")
+        for columns, names in [(self.query_columns, QUERY_COLUMNS), (self.nucleotide, NUCLEOTIDE_COLUMNS),
+            (self.translated, TRANSLATED_COLUMNS)]:
+            for name, typecode in names:
+                yield columnar_tables._to_bytes(columns[name])
+        
+    def write(self, file):
+        """
+        Write the store to the file with the current settings in the metadata
+        """
+        
+        metadata=dict((name, getattr(config, name)) for name in METADATA_SETTINGS)
+        metadata["nucleotide_stage"]=self.nucleotide_stage
+        metadata=json.dumps(metadata, sort_keys=True).encode("utf-8")
+        
+        file_handle=gzip.GzipFile(file, mode="wb", compresslevel=COMPRESS_LEVEL)
+        file_handle.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(metadata))+metadata)
+        for data in self._sections():
+            file_handle.write(struct.pack(SECTION_SIZE_FORMAT, len(data)))
+            file_handle.write(data)
+        file_handle.close()
+        
+    @classmethod
+    def read(cls, file, metadata_only=False):
+        """
+        Read the store from the file
+        """
+        
+        def read_bytes(file_handle, size):
+            data=file_handle.read(size)
+            if len(data) != size:
+                raise ValueError("Incomplete alignment store: " + file)
+            return data
+        
+        try:
+            file_handle=gzip.open(file, "rb")
+            magic, version, metadata_size=struct.unpack(HEADER_FORMAT, 
+                read_bytes(file_handle, struct.calcsize(HEADER_FORMAT)))
+        except (EnvironmentError, EOFError, struct.error, ValueError):
+            raise ValueError("Not an alignment store: " + file)
+            
+        if magic != MAGIC:
+            file_handle.close()
+            raise ValueError("Not an alignment store: " + file)
+        if version > VERSION:
+            file_handle.close()
+            raise ValueError("Unsupported alignment store version: " + str(version))
+        
+        metadata=json.loads(read_bytes(file_handle, metadata_size).decode("utf-8"))
+        alignment_store=cls(nucleotide_stage=metadata.pop("nucleotide_stage"))
+        alignment_store.metadata=metadata
+        if metadata_only:
+            file_handle.close()
+            return alignment_store
+        
+        def read_section():
+            size=struct.unpack(SECTION_SIZE_FORMAT, read_bytes(file_handle, 
+                struct.calcsize(SECTION_SIZE_FORMAT)))[0]
+            return read_bytes(file_handle, size)
+        
+        try:
+            for name in ["queries","references"]:
+                strings=read_section().decode("utf-8")
+                setattr(alignment_store, name, strings.split("\n") if strings else [])
+            for columns, names in [(alignment_store.query_columns, QUERY_COLUMNS), 
+                (alignment_store.nucleotide, NUCLEOTIDE_COLUMNS), (alignment_store.translated, TRANSLATED_COLUMNS)]:
+                for name, typecode in names:
+                    columns[name]=columnar_tables._from_bytes(typecode, read_section())
+        except (EnvironmentError, EOFError, struct.error):
+            raise ValueError("Incomplete alignment store: " + file)
+        finally:
+            file_handle.close()
+            
+        return alignment_store
+    
+    def nucleotide_mask(self):
+        """
+        Return the mask of the nucleotide alignments which pass the filters
+        """
+        
+        identity_threshold=config.identity_threshold
+        return [identity > identity_threshold for identity in self.nucleotide["identity"]]
+    
+    def translated_mask(self):
+        """
+        Return the mask of the translated alignments which pass the filters
+        (identity, e-value, and query coverage)
+        """
+        
+        identity_threshold=config.identity_threshold
+        evalue_threshold=config.evalue_threshold
+        query_coverage_threshold=config.translated_query_coverage_threshold
+        
+        columns=self.translated
+        mask=[]
+        for identity, evalue, query_start, query_end, query_length in zip(columns["identity"], 
+            columns["evalue"], columns["query_start"], columns["query_end"], columns["query_length"]):
+            # if the query length is not provided, the query coverage is not checked
+            mask.append(identity >= identity_threshold and evalue <= evalue_threshold and 
+                (query_length <= 1 or 
+                 (query_end - query_start + 1) / float(query_length) * 100.0 >= query_coverage_threshold))
+        return mask
+    
+    def allowed_proteins(self, selected, annotations):
+        """
+        Return the proteins with subject coverage of the selected alignments greater than the threshold
+        """
+        
+        protein_lengths={}
+        protein_hits=defaultdict(set)
+        columns=self.translated
+        for index in selected:
+            protein_name, gene_length, bug=annotations[columns["reference"][index]]
+            protein_lengths[protein_name]=gene_length / 3
+            # as for the blastx coverage, alignments without a range are not included
+            protein_range=range(columns["subject_start"][index], columns["subject_end"][index])
+            if protein_range:
+                protein_hits[protein_name].update(protein_range)
+            
+        allowed=set()
+        for protein_name, hit_positions in protein_hits.items():
+            try:
+                coverage=len(hit_positions) / float(protein_lengths[protein_name]) * 100
+            except ZeroDivisionError:
+                coverage=0
+            if coverage >= config.translated_subject_coverage_threshold:
+                allowed.add(protein_name)
+                
+        return allowed
+        
+    def quantify(self, alignments, unaligned_reads_store):
+        """
+        Add the alignments which pass the filters (with the current thresholds)
+        to the alignments store and the reads which are unaligned to the unaligned reads store
+        """
+        
+        weights=self.query_columns["weight"]
+        
+        # add the nucleotide alignments, reads are unaligned if not mapped or if filtered
+        columns=self.nucleotide
+        mask=self.nucleotide_mask()
+        unaligned=set(itertools.compress(range(len(self.queries)), self.query_columns["unmapped"]))
+        unaligned.update(itertools.compress(columns["query"], [not passed for passed in mask]))
+        for query, reference, identity, alignment_length in itertools.compress(zip(columns["query"], 
+            columns["reference"], columns["identity"], columns["alignment_length"]), mask):
+            alignments.add_annotated(self.queries[query], identity/100.0*alignment_length, 
+                self.references[reference], alignment_length, weights[query])
+        
+        logger.info("Nucleotide alignments which pass the filters: " + str(sum(mask)) + 
+            " of " + str(len(mask)))
+        
+        # select the translated alignments for the reads searched 
+        columns=self.translated
+        searched=range(self.count_translated())
+        if self.nucleotide_stage:
+            searched=[index for index, query in enumerate(columns["query"]) if query in unaligned]
+        mask=self.translated_mask()
+        
+        # process the annotations for each reference once
+        annotations={}
+        for reference in set(columns["reference"][index] for index in searched):
+            annotations[reference]=alignments.process_reference_annotation(self.references[reference])
+        
+        allowed=self.allowed_proteins([index for index in searched if mask[index]], annotations)
+        
+        # reads with alignments that are filtered are not included in the unaligned reads
+        # as in the post-processing of the translated search
+        total_added=0
+        for index in searched:
+            query=columns["query"][index]
+            if not mask[index]:
+                unaligned.discard(query)
+                continue
+            protein_name, gene_length, bug=annotations[columns["reference"][index]]
+            if protein_name in allowed:
+                alignment_length=columns["alignment_length"][index]
+                alignments.add(protein_name, gene_length, self.queries[query],
+                    columns["identity"][index]/100.0*alignment_length, bug, alignment_length, weights[query])
+                unaligned.discard(query)
+                total_added+=1
+                
+        logger.info("Translated alignments which pass the filters: " + str(total_added) + 
+            " of " + str(len(searched)))
+        
+        # store the unaligned reads with the number of reads each represents
+        unaligned_reads_store.set_read_counts(dict((self.queries[query], weights[query]) 
+            for query in unaligned if weights[query] > 1))
+        for query in sorted(unaligned):
+            unaligned_reads_store.add(self.queries[query], "")
+        unaligned_reads_store.set_initial_read_count(sum(weights))
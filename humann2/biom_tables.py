@@ -0,0 +1,145 @@
+"""
+HUMAnN2: biom_tables module
+Write and read biom (hdf5) tables in process
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import os
+import sys
+import logging
+
+from . import config
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+# the biom, h5py, numpy, and scipy packages are optional, they are imported
+# when first needed as they are slow to import
+biom=None
+h5py=None
+numpy=None
+sparse=None
+modules_imported=False
+
+# the signature at the start of all hdf5 (biom version 2) files
+HDF5_SIGNATURE=b"\x89HDF\r\n\x1a\n"
+
+def import_modules():
+    """
+    Import the packages required to write and read biom tables if not already imported
+    """
+    
+    global biom, h5py, numpy, sparse, modules_imported
+    if not modules_imported:
+        modules_imported=True
+        try:
+            import biom
+            import h5py
+            import numpy
+            from scipy import sparse
+        except ImportError:
+            biom=None
+
+def biom_installed():
+    """
+    Return True if the packages required to write and read biom tables are installed
+    """
+    
+    import_modules()
+    return not biom is None
+
+def is_biom_table(file):
+    """
+    Return True if the file is a biom table (hdf5 or with the biom extension)
+    """
+    
+    if file.endswith(".biom"):
+        return True
+    
+    try:
+        with open(file, "rb") as file_handle:
+            signature=file_handle.read(len(HDF5_SIGNATURE))
+    except EnvironmentError:
+        return False
+    return signature == HDF5_SIGNATURE
+
+def observation_id(name, bug):
+    """
+    Return the observation id for the name and bug (None if not stratified)
+    """
+    
+    if bug is None:
+        return name
+    return name+config.output_file_category_delimiter+bug
+
+def write_table(file, rows, sample_id, table_type):
+    """
+    Write a biom table with one sample from the rows (name, bug, value)
+    The bug is None for the rows which are not stratified
+    The name and bug are stored in the observation metadata
+    """
+    
+    import_modules()
+    ids=[]
+    values=[]
+    metadata=[]
+    for name, bug, value in rows:
+        ids.append(observation_id(name, bug))
+        values.append(value)
+        metadata.append({"feature": name, "stratum": "all" if bug is None else bug})
+        
+    data=sparse.coo_matrix((numpy.array(values, dtype=float), 
+        (numpy.arange(len(values)), numpy.zeros(len(values), dtype=int))), shape=(len(values), 1))
+    table=biom.Table(data, ids, [sample_id], observation_metadata=metadata or None, 
+        type=table_type+" table")
+    
+    # Remove output file if already exists
+    if os.path.isfile(file):
+        os.remove(file)
+    
+    try:
+        with h5py.File(file, "w") as file_handle:
+            table.to_hdf5(file_handle, "HUMAnN2")
+    except EnvironmentError:
+        message="CRITICAL ERROR: Unable to write biom file: " + file
+        logger.critical(message)
+        sys.exit(message)
+        
+def read_table(file):
+    """
+    Return the rows [observation id, value] for the first sample in the biom table
+    """
+    
+    import_modules()
+    try:
+        table=biom.load_table(file)
+    except (EnvironmentError, TypeError, ValueError, KeyError):
+        message="CRITICAL ERROR: Unable to read biom file: " + file
+        logger.critical(message)
+        sys.exit(message)
+        
+    rows=[]
+    if len(table.ids()):
+        for values, id, metadata in table.iter(axis="observation", dense=True):
+            rows.append([id, values[0]])
+            
+    return rows
@@ -0,0 +1,307 @@
+"""
+HUMAnN2: checkpoint module
+Save and load the stores at the end of each stage so a run can be resumed
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+A checkpoint is written at the end of the nucleotide alignment post-processing,
+the translated alignment post-processing, and the gene families computation.
+Each checkpoint is the pickled (and compressed) stores for the stage. The manifest
+lists the checkpoints saved with their checksums, a fingerprint of the config
+settings, and the size and modification time of the input files (the inputs can
+be very large so they are not read to compute checksums). All of the files are
+written to a temp file which is then renamed so a checkpoint is either complete
+or missing.
+"""
+
+import os
+import json
+import gzip
+import hashlib
+import logging
+import tempfile
+import contextlib
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from . import config
+from . import utilities
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+MANIFEST_VERSION=2
+MANIFEST_NAME="manifest.json"
+CHECKPOINT_EXTENSION=".checkpoint"
+CHECKPOINT_COMPRESS_LEVEL=1
+
+# the stages in the order they are run
+STAGES=["nucleotide","translated","gene_families"]
+STAGE_DESCRIPTIONS={"nucleotide":"nucleotide alignment post-processing",
+    "translated":"translated alignment post-processing",
+    "gene_families":"computing gene families"}
+
+# the config settings which change the stores or the gene families output
+FINGERPRINT_SETTINGS=["nucleotide_database","protein_database","bypass_prescreen",
+    "bypass_nucleotide_index","bypass_nucleotide_search","bypass_translated_search",
+    "translated_alignment_selected","pick_frames_toggle","dedup_reads_toggle","memory_use",
+    "evalue_threshold","prescreen_threshold","identity_threshold",
+    "translated_subject_coverage_threshold","translated_query_coverage_threshold",
+    "search_mode","gene_family_name_mapping_file","output_max_decimals",
+    "remove_stratified_output","remove_column_description_output","output_format",
+    "output_compression","columnar_value_type","file_basename","alignment_store_toggle"]
+
+def file_checksum(file):
+    """
+    Return the sha1 checksum of the file
+    """
+    
+    sha1=hashlib.sha1()
+    with open(file,"rb") as file_handle:
+        for block in iter(lambda: file_handle.read(config.file_cache_read_size), b""):
+            sha1.update(block)
+    
+    return sha1.hexdigest()
+
+def file_signature(file):
+    """
+    Return the size and modification time of the file
+    """
+    
+    stats=os.stat(file)
+    return [stats.st_size, stats.st_mtime]
+
+def config_fingerprint(*settings):
+    """
+    Return the fingerprint of the config settings (plus any other settings provided)
+    """
+    
+    values=[[name, str(getattr(config, name, ""))] for name in FINGERPRINT_SETTINGS]
+    values+=[str(setting) for setting in settings]
+    
+    return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+def checkpoint_folder():
+    """
+    Return the folder for the checkpoints in the temp directory
+    """
+    
+    return os.path.join(config.temp_dir, "checkpoints")
+
+@contextlib.contextmanager
+def atomic_write(file):
+    """
+    Open a temp file (binary) in the same folder which is renamed to the file when closed
+    The temp file is removed if an error occurs while writing
+    """
+    
+    folder=os.path.dirname(os.path.abspath(file))
+    file_descriptor, temp_file=tempfile.mkstemp(dir=folder, prefix="."+os.path.basename(file)+".")
+    try:
+        with os.fdopen(file_descriptor, "wb") as file_handle:
+            yield file_handle
+            file_handle.flush()
+            os.fsync(file_handle.fileno())
+        getattr(os, "replace", os.rename)(temp_file, file)
+    except:
+        if os.path.isfile(temp_file):
+            os.unlink(temp_file)
+        raise
+
+class Checkpoints(object):
+    """
+    Saves and loads the stores at the end of each stage of a run
+    """
+    
+    def __init__(self, folder, inputs=None, fingerprint="", enabled=True):
+        self.__folder=folder
+        self.__inputs=[os.path.abspath(file) for file in (inputs or []) if file]
+        self.__fingerprint=fingerprint
+        self.__enabled=enabled
+        self.__input_signatures=None
+        self.__stage=None
+        
+    def manifest_file(self):
+        """
+        Return the path to the manifest
+        """
+        
+        return os.path.join(self.__folder, MANIFEST_NAME)
+    
+    def checkpoint_file(self, stage):
+        """
+        Return the path to the checkpoint for the stage
+        """
+        
+        return os.path.join(self.__folder, stage+CHECKPOINT_EXTENSION)
+        
+    def input_signatures(self):
+        """
+        Return the signatures of the input files (computed once)
+        """
+        
+        if self.__input_signatures is None:
+            self.__input_signatures=dict((file, file_signature(file)) for file in self.__inputs 
+                if os.path.isfile(file))
+            
+        return self.__input_signatures
+        
+    def read_manifest(self):
+        """
+        Return the manifest or None if it does not exist or can not be read
+        """
+        
+        try:
+            with open(self.manifest_file()) as file_handle:
+                manifest=json.load(file_handle)
+        except (EnvironmentError, ValueError):
+            return None
+        
+        if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+            return None
+        
+        return manifest
+    
+    def write_manifest(self, manifest):
+        """
+        Write the manifest (atomic)
+        """
+        
+        with atomic_write(self.manifest_file()) as file_handle:
+            file_handle.write(json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+            
+    def clear(self):
+        """
+        Remove the manifest and all of the checkpoints (including the files saved with them)
+        """
+        
+        saved_files=[]
+        manifest=self.read_manifest()
+        if manifest:
+            for entry in manifest.get("stages",{}).values():
+                saved_files+=[file for file in entry.get("files",[]) 
+                    if os.path.dirname(file) == os.path.abspath(self.__folder)]
+        
+        for file in [self.manifest_file()]+[self.checkpoint_file(stage) for stage in STAGES]+saved_files:
+            if os.path.isfile(file):
+                utilities.remove_file(file)
+        
+    def completed(self, stage):
+        """
+        Check if the stage was completed in the run resumed
+        """
+        
+        return self.__stage is not None and STAGES.index(self.__stage) >= STAGES.index(stage)
+    
+    def load(self, manifest, stage):
+        """
+        Return the stores saved for the stage or None if the checkpoint is not valid
+        """
+        
+        entry=manifest["stages"][stage]
+        file=self.checkpoint_file(stage)
+        for required_file in [file]+entry.get("files",[]):
+            if not os.path.isfile(required_file):
+                logger.debug("Checkpoint file missing: " + required_file)
+                return None
+        
+        if file_checksum(file) != entry.get("checksum"):
+            logger.debug("Checkpoint checksum does not match: " + file)
+            return None
+        
+        try:
+            with gzip.open(file, "rb") as file_handle:
+                return pickle.load(file_handle)
+        except (EnvironmentError, EOFError, pickle.UnpicklingError):
+            logger.debug("Unable to read checkpoint: " + file)
+            return None
+        
+    def start(self, resume=False):
+        """
+        Start the run, if resuming return the stores from the last valid checkpoint
+        Otherwise remove any checkpoints from a prior run
+        """
+        
+        if not self.__enabled:
+            return {}
+        
+        manifest=self.read_manifest() if resume else None
+        if manifest and (manifest.get("fingerprint") != self.__fingerprint or
+            manifest.get("inputs") != self.input_signatures()):
+            message="The checkpoints do not match the config settings or the input files"
+            logger.info(message)
+            print(message)
+            manifest=None
+            
+        if manifest:
+            for stage in reversed(STAGES):
+                if stage in manifest.get("stages",{}):
+                    state=self.load(manifest, stage)
+                    if state is not None:
+                        self.__stage=stage
+                        message="Resume from checkpoint: " + STAGE_DESCRIPTIONS[stage]
+                        logger.info(message)
+                        print("\n"+message)
+                        return state
+        
+        self.clear()
+        return {}
+        
+    def save(self, stage, state, files=None):
+        """
+        Save the stores for the stage and add the checkpoint to the manifest
+        Files are those created by the stage which are required to resume
+        """
+        
+        if not self.__enabled:
+            return
+        
+        file=self.checkpoint_file(stage)
+        try:
+            if not os.path.isdir(self.__folder):
+                os.mkdir(self.__folder)
+            
+            # stores with data in temp files save a copy of the files with the checkpoint
+            files=list(files or [])
+            for name, value in state.items():
+                if hasattr(value, "save_checkpoint_files"):
+                    files+=value.save_checkpoint_files(os.path.join(self.__folder, stage+"_"+name))
+            
+            with atomic_write(file) as file_handle:
+                with gzip.GzipFile(fileobj=file_handle, mode="wb", 
+                    compresslevel=CHECKPOINT_COMPRESS_LEVEL) as compressed_file_handle:
+                    pickle.dump(state, compressed_file_handle, pickle.HIGHEST_PROTOCOL)
+                    
+            manifest=self.read_manifest()
+            if not manifest or manifest.get("fingerprint") != self.__fingerprint:
+                manifest={"version": MANIFEST_VERSION, "fingerprint": self.__fingerprint,
+                    "inputs": self.input_signatures(), "stages": {}}
+            manifest["stages"][stage]={"checksum": file_checksum(file),
+                "files": [os.path.abspath(required_file) for required_file in (files or [])]}
+            self.write_manifest(manifest)
+        except (EnvironmentError, pickle.PicklingError) as e:
+            logger.warning("Unable to write checkpoint for " + STAGE_DESCRIPTIONS[stage] + ": " + str(e))
+            return
+        
+        logger.info("Saved checkpoint for " + STAGE_DESCRIPTIONS[stage] + ": " + file)
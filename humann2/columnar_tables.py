@@ -0,0 +1,298 @@
+"""
+HUMAnN2: columnar_tables module
+Write and read tables in a compact binary columnar format
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+The file starts with a fixed size header followed by the dictionaries of the 
+strings (the first column name, the sample names, the features, and the strata),
+the feature id and stratum id of each row (uint32), and the values for each 
+sample (a column of float64 or float32 values). All numbers are little endian and 
+each section starts on an 8 byte boundary so the columns can be memory-mapped.
+
+Rows which are not stratified have the stratum id 0 (the empty string).
+"""
+
+import sys
+import struct
+import array
+import mmap
+import itertools
+
+from . import config
+
+MAGIC=b"HUMAnN2C"
+VERSION=1
+FILE_EXTENSION=config.columnar_table_extension
+
+# magic, version, value size, rows, columns, decimals (-1 if not rounded), features, strata,
+# and the offsets of the strings (with the size), feature ids, stratum ids, and values
+HEADER_FORMAT="<8sIIQIiQQQQQQQ"
+HEADER_SIZE=128
+
+VALUE_TYPES={"float64": "d", "float32": "f"}
+STRATUM_DELIMITER="|"
+COLUMN_DELIMITER="\t"
+
+def _align(offset):
+    """ Return the offset rounded up to a multiple of 8 bytes """
+    
+    return (offset+7)//8*8
+
+def _to_bytes(values):
+    """ Return the bytes of the array (little endian) """
+    
+    if sys.byteorder != "little":
+        values=array.array(values.typecode, values)
+        values.byteswap()
+    try:
+        return values.tobytes()
+    except AttributeError:
+        return values.tostring()
+    
+def _from_bytes(typecode, data):
+    """ Return an array from the bytes (little endian) """
+    
+    values=array.array(typecode)
+    try:
+        values.frombytes(data)
+    except AttributeError:
+        values.fromstring(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+def split_id(id):
+    """
+    Return the feature and stratum (None if not stratified) for the row id
+    """
+    
+    if STRATUM_DELIMITER in id:
+        feature, stratum=id.split(STRATUM_DELIMITER,1)
+        return feature, stratum
+    return id, None
+
+def write_table(file, anchor, columns, rows, decimals=None, value_type="float64"):
+    """
+    Write the rows (feature, stratum, list of values) to the columnar file
+    The stratum is None for the rows which are not stratified
+    The values are rounded to the number of decimals if set (as written to tsv files)
+    """
+    
+    typecode=VALUE_TYPES[value_type]
+    
+    features={}
+    strata={"": 0}
+    feature_ids=array.array("I")
+    stratum_ids=array.array("I")
+    values=[array.array(typecode) for column in columns]
+    
+    for feature, stratum, row_values in rows:
+        feature_ids.append(features.setdefault(feature, len(features)))
+        stratum_ids.append(strata.setdefault(stratum or "", len(strata)))
+        for column, value in zip(values, row_values):
+            if not decimals is None:
+                value=float("{:.{digits}f}".format(value, digits=decimals))
+            column.append(value)
+    
+    strings=[anchor]+list(columns)
+    strings+=sorted(features, key=features.get)
+    strings+=sorted(strata, key=strata.get)
+    strings="\n".join(strings).encode("utf-8")
+    
+    # compute the offsets of each section
+    total_rows=len(feature_ids)
+    strings_offset=HEADER_SIZE
+    feature_ids_offset=_align(strings_offset+len(strings))
+    stratum_ids_offset=_align(feature_ids_offset+4*total_rows)
+    values_offset=_align(stratum_ids_offset+4*total_rows)
+    
+    header=struct.pack(HEADER_FORMAT, MAGIC, VERSION, array.array(typecode).itemsize, 
+        total_rows, len(columns), -1 if decimals is None else decimals, len(features), len(strata), 
+        strings_offset, len(strings), feature_ids_offset, stratum_ids_offset, values_offset)
+    
+    file_handle=open(file, "wb")
+    file_handle.write(header+b"\0"*(HEADER_SIZE-len(header)))
+    for offset, data in [(strings_offset, strings), (feature_ids_offset, _to_bytes(feature_ids)),
+        (stratum_ids_offset, _to_bytes(stratum_ids))]+[(None, _to_bytes(column)) for column in values]:
+        # pad to the start of the section
+        position=file_handle.tell()
+        file_handle.write(b"\0"*((offset if not offset is None else _align(position))-position))
+        file_handle.write(data)
+    file_handle.close()
+    
+class ColumnarTable(object):
+    """
+    Reads a columnar table (the file is memory-mapped)
+    """
+    
+    def __init__(self, file):
+        """
+        Read the header and the strings from the file
+        """
+        
+        self.file=file
+        file_handle=open(file, "rb")
+        try:
+            self._map=mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            file_handle.close()
+            raise ValueError("Not a columnar table: " + file)
+        file_handle.close()
+        
+        if len(self._map) < HEADER_SIZE or self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("Not a columnar table: " + file)
+        
+        (magic, version, value_size, self.total_rows, total_columns, self.decimals, total_features,
+            total_strata, strings_offset, strings_size, self._feature_ids_offset, 
+            self._stratum_ids_offset, self._values_offset)=struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        
+        if version > VERSION:
+            self.close()
+            raise ValueError("Unsupported columnar table version: " + str(version))
+        
+        self.typecode="d" if value_size == 8 else "f"
+        self.value_size=value_size
+        
+        strings=self._map[strings_offset:strings_offset+strings_size].decode("utf-8").split("\n")
+        self.anchor=strings[0]
+        self.columns=strings[1:1+total_columns]
+        self.features=strings[1+total_columns:1+total_columns+total_features]
+        self.strata=strings[1+total_columns+total_features:]
+        
+    def close(self):
+        """ Close the memory-mapped file """
+        
+        self._map.close()
+        
+    def feature_ids(self):
+        """ Return the feature id for each row """
+        
+        return _from_bytes("I", self._map[self._feature_ids_offset:self._feature_ids_offset+4*self.total_rows])
+    
+    def stratum_ids(self):
+        """ Return the stratum id for each row """
+        
+        return _from_bytes("I", self._map[self._stratum_ids_offset:self._stratum_ids_offset+4*self.total_rows])
+        
+    def column(self, index):
+        """ Return the values for the column """
+        
+        start=self._values_offset
+        for i in range(index):
+            start=_align(start+self.value_size*self.total_rows)
+        return _from_bytes(self.typecode, self._map[start:start+self.value_size*self.total_rows])
+    
+    def rows(self):
+        """ Yield the rows (feature, stratum, list of values) with None for rows not stratified """
+        
+        columns=[self.column(index) for index in range(len(self.columns))]
+        for row, (feature_id, stratum_id) in enumerate(zip(self.feature_ids(), self.stratum_ids())):
+            yield (self.features[feature_id], self.strata[stratum_id] if stratum_id else None, 
+                [column[row] for column in columns])
+            
+    def format_value(self, value):
+        """ Return the value formatted as written to tsv files """
+        
+        if self.decimals >= 0:
+            return "{:.{digits}f}".format(value, digits=self.decimals)
+        if self.typecode == "f":
+            return "{:.9g}".format(value)
+        return repr(value)
+            
+    def lines(self):
+        """ Yield the lines of the table in tsv format (the header first) """
+        
+        yield COLUMN_DELIMITER.join([self.anchor]+self.columns)
+        for feature, stratum, values in self.rows():
+            if not stratum is None:
+                feature+=STRATUM_DELIMITER+stratum
+            yield COLUMN_DELIMITER.join([feature]+[self.format_value(value) for value in values])
+            
+def is_columnar_table(file):
+    """ Return True if the file is a columnar table """
+    
+    try:
+        file_handle=open(file, "rb")
+        magic=file_handle.read(len(MAGIC))
+        file_handle.close()
+    except EnvironmentError:
+        return False
+    return magic == MAGIC
+            
+def tsv_rows(first_line, lines):
+    """
+    Yield the rows (feature, stratum, list of values) from the lines of a tsv table
+    """
+    
+    if first_line:
+        lines=itertools.chain([first_line], lines)
+    for line in lines:
+        line=line.rstrip("\r\n")
+        if line:
+            data=line.split(COLUMN_DELIMITER)
+            feature, stratum=split_id(data[0])
+            yield (feature, stratum, [float(value) for value in data[1:]])
+            
+def read_tsv_table(lines):
+    """
+    Return the header (a list of the first column name and the sample names) and 
+    the rows (feature, stratum, list of values) from the lines of a tsv table
+    The header is the last comment line before the first row
+    """
+    
+    header=None
+    first_line=None
+    for line in lines:
+        line=line.rstrip("\r\n")
+        if line.startswith("#"):
+            header=line.split(COLUMN_DELIMITER)
+        elif line:
+            first_line=line
+            break
+        
+    if header is None:
+        header=["# Feature"]+["Sample"+str(i+1) for i in range(len(first_line.split(COLUMN_DELIMITER))-1)] \
+            if first_line else ["# Feature"]
+        
+    return header, tsv_rows(first_line, lines)
+        
+def tsv_to_columnar(tsv_file, columnar_file, decimals=None, value_type="float64"):
+    """
+    Convert a tsv table to a columnar table
+    """
+    
+    file_handle=open(tsv_file, "rt")
+    header, rows=read_tsv_table(file_handle)
+    write_table(columnar_file, header[0], header[1:], rows, decimals, value_type)
+    file_handle.close()
+    
+def columnar_to_tsv(columnar_file, tsv_file):
+    """
+    Convert a columnar table to a tsv table
+    """
+    
+    table=ColumnarTable(columnar_file)
+    file_handle=open(tsv_file, "w")
+    file_handle.write("\n".join(table.lines()))
+    file_handle.close()
+    table.close()
@@ -43,6 +43,7 @@ def log_settings():
     Write to the log file the config settings for the run
     """
     
+    load_user_edit_settings()
     lines=[]    
     lines.append("DATABASE SETTINGS")
     lines.append("nucleotide database folder = " + nucleotide_database)
@@ -53,6 +54,9 @@ def log_settings():
     else:
         lines.append("pathways database file = " + pathways_database_part2)
     lines.append("utility mapping database folder = " + utility_mapping_database)
+    lines.append("cache directory = " + cache_directory)
+    lines.append("database cache = " + database_cache_toggle)
+    lines.append("tool version cache = " + tool_version_cache_toggle)
     lines.append("")
     
     lines.append("RUN MODES")
@@ -64,7 +68,15 @@ def log_settings():
     lines.append("bypass translated search = " + str(bypass_translated_search))
     lines.append("translated search = " + translated_alignment_selected)
     lines.append("pick frames = " + pick_frames_toggle)
+    lines.append("dedup reads = " + dedup_reads_toggle)
+    lines.append("checkpoints = " + checkpoints_toggle)
+    lines.append("alignment store = " + alignment_store_toggle)
+    lines.append("metrics = " + metrics_toggle)
+    lines.append("resource sampler = " + resource_sampler_toggle)
+    lines.append("profile stages = " + ",".join(profile_stages))
+    lines.append("trace memory = " + str(trace_memory))
     lines.append("threads = " + str(threads))
+    lines.append("max memory = " + str(max_memory))
     lines.append("")
     
     lines.append("SEARCH MODE")
@@ -81,13 +93,19 @@ def log_settings():
     
     lines.append("PATHWAYS SETTINGS")
     lines.append("minpath = " + minpath_toggle)
+    lines.append("minpath engine = " + minpath_engine)
+    lines.append("minpath cache = " + minpath_cache_toggle)
     lines.append("xipe = " + xipe_toggle)
+    lines.append("xipe engine = " + xipe_engine)
+    lines.append("taxon pathways = " + taxon_pathways)
     lines.append("gap fill = " + gap_fill_toggle)
     lines.append("")    
     
     lines.append("INPUT AND OUTPUT FORMATS")
     lines.append("input file format = " + input_format)
     lines.append("output file format = " + output_format)
+    lines.append("output file compression = " + output_compression)
+    lines.append("columnar value type = " + columnar_value_type)
     lines.append("output max decimals = " + str(output_max_decimals))
     lines.append("remove stratified output = " + str(remove_stratified_output))
     lines.append("remove column description output = " + str(remove_column_description_output))
@@ -215,51 +233,58 @@ def get_item(config_items, section, name, type=None):
         
     return value
 
-# get the base settings from the user edit config file
-config_items=read_user_edit_config_file()
-
-# set those items that are included in the user edit config file
-
-# database folders
-nucleotide_database=get_item(config_items, "database_folders" , "nucleotide", "string")
-protein_database=get_item(config_items, "database_folders", "protein", "string")
-utility_mapping_database=get_item(config_items, "database_folders", "utility_mapping", "string")
-        
-# run modes
-resume=get_item(config_items, "run_modes", "resume", "bool")
-verbose=get_item(config_items, "run_modes", "verbose", "bool")
-bypass_prescreen=get_item(config_items, "run_modes", "bypass_prescreen", "bool")
-bypass_nucleotide_index=get_item(config_items, "run_modes", "bypass_nucleotide_index", "bool")
-bypass_nucleotide_search=get_item(config_items, "run_modes", "bypass_nucleotide_search", "bool")
-bypass_translated_search=get_item(config_items, "run_modes", "bypass_translated_search", "bool")
-    
-# number of threads
-threads=get_item(config_items, "run_modes", "threads", "int")
+# the settings from the user edit config file ( section, name, type )
+# these are read on first access to reduce the time to start
+user_edit_settings={
+    "nucleotide_database": ("database_folders", "nucleotide", "string"),
+    "protein_database": ("database_folders", "protein", "string"),
+    "utility_mapping_database": ("database_folders", "utility_mapping", "string"),
+    "resume": ("run_modes", "resume", "bool"),
+    "verbose": ("run_modes", "verbose", "bool"),
+    "bypass_prescreen": ("run_modes", "bypass_prescreen", "bool"),
+    "bypass_nucleotide_index": ("run_modes", "bypass_nucleotide_index", "bool"),
+    "bypass_nucleotide_search": ("run_modes", "bypass_nucleotide_search", "bool"),
+    "bypass_translated_search": ("run_modes", "bypass_translated_search", "bool"),
+    "threads": ("run_modes", "threads", "int"),
+    "evalue_threshold": ("alignment_settings", "evalue_threshold", "float"),
+    "prescreen_threshold": ("alignment_settings", "prescreen_threshold", "float"),
+    "translated_subject_coverage_threshold": ("alignment_settings", "translated_subject_coverage_threshold", "float"),
+    "translated_query_coverage_threshold": ("alignment_settings", "translated_query_coverage_threshold", "float"),
+    "output_max_decimals": ("output_format", "output_max_decimals", "int"),
+    "remove_stratified_output": ("output_format", "remove_stratified_output", "bool"),
+    "remove_column_description_output": ("output_format", "remove_column_description_output", "bool")
+}
+
+def load_user_edit_settings():
+    """
+    Set the settings from the user edit config file which have not already been set
+    """
     
-# evalue threshold
-evalue_threshold=get_item(config_items, "alignment_settings", "evalue_threshold", "float")
+    missing=[name for name in user_edit_settings if not name in globals()]
+    if missing:
+        config_items=read_user_edit_config_file()
+        for name in missing:
+            globals()[name]=get_item(config_items, *user_edit_settings[name])
+
+def __getattr__(name):
+    """
+    Read the user edit config file on the first access to one of its settings
+    """
     
-# prescreen threshold
-prescreen_threshold=get_item(config_items, "alignment_settings", "prescreen_threshold", "float")
+    if name in user_edit_settings:
+        load_user_edit_settings()
+        return globals()[name]
+    raise AttributeError("module " + __name__ + " has no attribute " + name)
+
+# a module __getattr__ is only used by python 3.7+ so read the settings now for prior versions
+if sys.version_info < (3,7):
+    load_user_edit_settings()
 
 # translated search identity threshold
 identity_threshold_uniref90_mode = 90.0
 identity_threshold_uniref50_mode = 50.0
 identity_threshold=identity_threshold_uniref50_mode
 
-# translated search coverage thresholds
-translated_subject_coverage_threshold=get_item(config_items, "alignment_settings", "translated_subject_coverage_threshold", "float")
-translated_query_coverage_threshold=get_item(config_items, "alignment_settings", "translated_query_coverage_threshold", "float")
-    
-# output file decimal places
-output_max_decimals=get_item(config_items, "output_format", "output_max_decimals", "int")
-    
-# stratified output flag
-remove_stratified_output=get_item(config_items, "output_format", "remove_stratified_output", "bool")
-
-# column description flag
-remove_column_description_output=get_item(config_items, "output_format", "remove_column_description_output", "bool")
-
 # pathways files
 humann2_install_directory=os.path.dirname(os.path.abspath(__file__))
 metacyc_gene_to_reactions=os.path.abspath(os.path.join(humann2_install_directory,"data","pathways","metacyc_reactions_level4ec_only.uniref.bz2"))
@@ -268,6 +293,14 @@ metacyc_reactions_to_pathways=os.path.abspath(os.path.join(humann2_install_direc
 unipathway_database_part1=os.path.abspath(os.path.join(humann2_install_directory,"data","pathways","unipathway_uniprots.uniref.bz2"))
 unipathway_database_part2=os.path.abspath(os.path.join(humann2_install_directory,"data","pathways","unipathway_pathways"))
 
+# the pathways known for each organism (used to restrict the pathways for each bug)
+metacyc_pathways_to_organisms=os.path.abspath(os.path.join(humann2_install_directory,"data","pathways","metacyc_pathways_to_organisms"))
+taxon_pathways_choices=["off","genus","species"]
+taxon_pathways=taxon_pathways_choices[0]
+taxon_pathways_file=metacyc_pathways_to_organisms
+taxon_pathways_organism_delimiter=","
+taxon_pathways_bug_delimiter="."
+
 # pathways and gene families name mapping files
 gene_family_name_mapping_file=os.path.abspath(os.path.join(humann2_install_directory,"data","misc","map_uniref50_name.txt.bz2"))
 pathway_name_mapping_file=os.path.abspath(os.path.join(humann2_install_directory,"data","misc","map_metacyc-pwy_name.txt.gz"))
@@ -298,6 +331,36 @@ query_length_annotation_delimiter="|"
 memory_use_options=["minimum","maximum"]
 memory_use=memory_use_options[0]
 
+# the max memory (in GB) for the tasks run at the same time, zero for no limit
+max_memory=0
+
+# the number of samples to process at the same time in batch mode
+batch_processes=1
+batch_log_file="humann2_batch.log"
+
+# server mode settings (the number of jobs run at the same time is batch_processes)
+server_log_file="humann2_server.log"
+server_warm_cache=False
+file_cache_read_size=1024*1024
+
+# the directory to store files reused across runs (ie compiled databases)
+cache_directory=os.path.join(os.environ.get("XDG_CACHE_HOME", 
+    os.path.join(os.path.expanduser("~"),".cache")),"humann2")
+
+# the compiled databases are rebuilt if the version does not match
+database_cache_toggle="on"
+database_cache_folder="databases"
+database_cache_version=2
+database_cache_extension=".pickle"
+
+# the version output of the alignment software is reused until the executable is changed
+tool_version_cache_toggle="on"
+tool_version_cache_file="tool_versions.json"
+
+# the number of ids to look up in the names index at once
+name_mapping_lookup_size=500
+name_mapping_index_extension=".sqlite"
+
 # log options
 log_level_choices=["DEBUG","INFO","WARNING","ERROR","CRITICAL"]
 log_level=log_level_choices[0]
@@ -308,11 +371,35 @@ xipe_toggle = "off"
 minpath_toggle = "on"
 pick_frames_toggle = "off"
 gap_fill_toggle = "off"
+dedup_reads_toggle = "off"
+checkpoints_toggle = "off"
+alignment_store_toggle = "off"
+metrics_toggle = "off"
+resource_sampler_toggle = "off"
+resource_sampler_interval = 1.0
+
+# profiling
+profile_stage_choices=["prescreen","custom_database_creation","duplicate_read_collapsing",
+    "database_index","nucleotide_alignment","nucleotide_alignment_post-processing",
+    "translated_alignment","translated_alignment_post-processing","alignment_post-processing",
+    "alignment_store_post-processing","computing_gene_families","processing_gene_table",
+    "computing_pathways"]
+profile_all_stages="all"
+profile_stages = []
+trace_memory = False
 
 # file format
-output_format_choices=["tsv", "biom"]
+output_format_choices=["tsv", "biom", "columnar"]
 output_format=output_format_choices[0]
-input_format_choices=["fastq","fastq.gz","fasta","fasta.gz","sam","bam","blastm8","genetable","biom"]
+columnar_value_type_choices=["float64","float32"]
+columnar_value_type=columnar_value_type_choices[0]
+output_compression_choices=["none","gzip"]
+output_compression=output_compression_choices[0]
+output_compression_extension={"none": "", "gzip": ".gz"}
+columnar_table_extension=".columnar"
+alignment_store_extension=".alignmentstore"
+output_write_buffer_size=1024*1024
+input_format_choices=["fastq","fastq.gz","fasta","fasta.gz","sam","bam","blastm8","genetable","biom","columnar","alignmentstore"]
 input_format=""
 
 # translated alignment options
@@ -332,6 +419,8 @@ chocophlan_custom_database_name="_custom_chocophlan_database.ffn"
 bowtie2_index_name="_bowtie2_index"
 chocophlan_alignment_name="_bowtie2_aligned.sam"
 
+dedup_reads_name_no_ext="_dedup_reads"
+
 nucleotide_unaligned_reads_name_no_ext="_bowtie2_unaligned"
 nucleotide_unaligned_reads_picked_frames_name_no_ext="_bowtie2_unaligned_picked_frames"
 nucleotide_aligned_reads_name_tsv="_bowtie2_aligned.tsv"
@@ -342,6 +431,9 @@ translated_unaligned_reads_name_no_ext="_unaligned"
 pathabundance_file="_pathabundance"
 pathcoverage_file="_pathcoverage"
 genefamilies_file="_genefamilies"
+alignment_store_file="_alignments"
+metrics_file="_metrics"
+resource_sampler_file="_resources"
 
 # metaphlan options
 metaphlan_opts=["-t","rel_ab"]
@@ -468,6 +560,20 @@ diamond_version={
 
 # MinPath
 minpath_script="MinPath12hmp.py"
+minpath_engine_choices=["internal","external"]
+minpath_engine=minpath_engine_choices[0]
+# add back the pathways with at least this fraction of reactions found
+minpath_populate_fraction=0.5
+# the max number of nodes to search for the minimum set of pathways
+minpath_max_nodes=1000000
+# the pathways identified are stored for each set of reactions
+# results are not used if the version does not match
+minpath_cache_toggle="on"
+minpath_cache_file="minpath_results.sqlite"
+minpath_cache_version=1
+minpath_cache_max_entries=100000
+# the seconds to wait for another process writing to the cache
+minpath_cache_timeout=60
 minpath_reaction_index=0
 minpath_pathway_index=7
 minpath_pathway_identifier="^path"
@@ -479,6 +585,13 @@ xipe_delimiter="\t"
 xipe_percent=str(0.1)
 xipe_probability=0.9
 xipe_bin=1
+xipe_engine_choices=["internal","external"]
+xipe_engine=xipe_engine_choices[0]
+xipe_sample_size=100
+xipe_repetitions=100
+xipe_paranoid=True
+# seed for the random numbers (if not set the results can differ for each run)
+xipe_seed=None
 
 # Alignment Score defaults
 default_reference_length=1000
@@ -52,14 +52,14 @@ import time
 import tempfile
 import re
 import logging  
+import copy
+import inspect
+import traceback
+import multiprocessing
 
 from . import config
 from . import store
 from . import utilities
-from .search import prescreen
-from .search import nucleotide
-from .search import translated
-from .quantify import families
 from .quantify import modules
 
 # name global logging instance
@@ -68,13 +68,36 @@ logger=logging.getLogger(__name__)
 VERSION="0.9.4"
 MAX_SIZE_DEMO_INPUT_FILE=10
 
+# the time the startup (loading the modules and reading the options) ended
+startup_end_time=None
+
+# the options with defaults from the user edit config file (with the config setting)
+# these default to None so the config file is only read if the option is not provided
+USER_EDIT_OPTIONS={"nucleotide_database": "nucleotide_database", 
+    "protein_database": "protein_database", "evalue": "evalue_threshold", "threads": "threads",
+    "prescreen_threshold": "prescreen_threshold",
+    "translated_subject_coverage_threshold": "translated_subject_coverage_threshold",
+    "translated_query_coverage_threshold": "translated_query_coverage_threshold",
+    "output_max_decimals": "output_max_decimals"}
+
+class HelpFormatter(argparse.RawTextHelpFormatter):
+    """
+    Show the defaults from the user edit config file in the help (only read if the help is printed)
+    """
+    
+    def _expand_help(self, action):
+        if action.default is None and action.dest in USER_EDIT_OPTIONS:
+            action=copy.copy(action)
+            action.default=getattr(config, USER_EDIT_OPTIONS[action.dest])
+        return super(HelpFormatter, self)._expand_help(action)
+
 def parse_arguments(args):
     """ 
     Parse the arguments from the user
     """
     parser = argparse.ArgumentParser(
         description= "HUMAnN2 : HMP Unified Metabolic Analysis Network 2\n",
-        formatter_class=argparse.RawTextHelpFormatter,
+        formatter_class=HelpFormatter,
         prog="humann2")
     parser.add_argument(
         "--version",
@@ -83,47 +106,59 @@ def parse_arguments(args):
     parser.add_argument(
         "-v","--verbose", 
         help="additional output is printed\n", 
-        action="store_true",
-        default=config.verbose)
+        action="store_true")
     parser.add_argument(
         "-r","--resume", 
-        help="bypass commands if the output files exist\n", 
-        action="store_true",
-        default=config.resume)
+        help="bypass commands if the output files exist and\nresume from the last checkpoint saved\n", 
+        action="store_true")
     parser.add_argument(
         "--bypass-prescreen", 
         help="bypass the prescreen step and run on the full ChocoPhlAn database\n", 
-        action="store_true",
-        default=config.bypass_prescreen)
+        action="store_true")
     parser.add_argument(
         "--bypass-nucleotide-index", 
         help="bypass the nucleotide index step and run on the indexed ChocoPhlAn database\n", 
-        action="store_true",
-        default=config.bypass_nucleotide_index)
+        action="store_true")
     parser.add_argument(
         "--bypass-translated-search", 
         help="bypass the translated search step\n", 
-        action="store_true",
-        default=config.bypass_translated_search)
+        action="store_true")
     parser.add_argument(
         "--bypass-nucleotide-search", 
         help="bypass the nucleotide search steps\n", 
-        action="store_true",
-        default=config.bypass_nucleotide_search)
-    parser.add_argument(
+        action="store_true")
+    input_group=parser.add_mutually_exclusive_group(required=True)
+    input_group.add_argument(
         "-i", "--input", 
         help="input file of type {" +",".join(config.input_format_choices)+ "} \n[REQUIRED]", 
-        metavar="<input.fastq>", 
-        required=True)
+        metavar="<input.fastq>")
+    input_group.add_argument(
+        "--input-list", 
+        help="file with one input file per line (or a directory of input files)\n" + 
+            "to process all samples with the databases loaded once", 
+        metavar="<samples.txt>")
+    input_group.add_argument(
+        "--serve", 
+        help="run as a server with the databases loaded once\n" + 
+            "and accept jobs on the socket provided", 
+        metavar="<humann2.sock>")
+    parser.add_argument(
+        "--submit", 
+        help="submit the job to the server running on the socket provided", 
+        metavar="<humann2.sock>")
+    parser.add_argument(
+        "--warm-cache", 
+        help="with --serve, read the nucleotide and protein databases\n" + 
+            "into the file system cache when the server starts\n", 
+        action="store_true",
+        default=config.server_warm_cache)
     parser.add_argument(
         "-o", "--output", 
         help="directory to write output files\n[REQUIRED]", 
-        metavar="<output>", 
-        required=True)
+        metavar="<output>")
     parser.add_argument(
         "--nucleotide-database",
-        help="directory containing the nucleotide database\n[DEFAULT: " 
-            + config.nucleotide_database + "]", 
+        help="directory containing the nucleotide database\n[DEFAULT: %(default)s]", 
         metavar="<nucleotide_database>")
     parser.add_argument(
         "--annotation-gene-index",
@@ -133,15 +168,13 @@ def parse_arguments(args):
         default=",".join(str(i) for i in config.chocophlan_gene_indexes))
     parser.add_argument(
         "--protein-database",
-        help="directory containing the protein database\n[DEFAULT: " 
-            + config.protein_database + "]", 
+        help="directory containing the protein database\n[DEFAULT: %(default)s]", 
         metavar="<protein_database>")
     parser.add_argument(
         "--evalue", 
-        help="the evalue threshold to use with the translated search\n[DEFAULT: " + str(config.evalue_threshold) + "]", 
-        metavar="<" + str(config.evalue_threshold) + ">", 
-        type=float,
-        default=config.evalue_threshold) 
+        help="the evalue threshold to use with the translated search\n[DEFAULT: %(default)s]", 
+        metavar="<evalue>", 
+        type=float) 
     parser.add_argument(
         "--search-mode",
         help="search for uniref50 or uniref90 gene families\n" + 
@@ -175,17 +208,28 @@ def parse_arguments(args):
         action="store_true")
     parser.add_argument(
         "--threads", 
-        help="number of threads/processes\n[DEFAULT: " + str(config.threads) + "]", 
-        metavar="<" + str(config.threads) + ">", 
+        help="number of threads/processes\n[DEFAULT: %(default)s]", 
+        metavar="<threads>", 
+        type=int) 
+    parser.add_argument(
+        "--batch-processes", 
+        help="number of samples (or server jobs) to process at the same time\n[DEFAULT: " + 
+            str(config.batch_processes) + "]", 
+        metavar="<" + str(config.batch_processes) + ">", 
         type=int,
-        default=config.threads) 
+        default=config.batch_processes) 
     parser.add_argument(
-        "--prescreen-threshold", 
-        help="minimum percentage of reads matching a species\n[DEFAULT: "
-            + str(config.prescreen_threshold) + "]", 
-        metavar="<" + str(config.prescreen_threshold) + ">", 
+        "--max-memory", 
+        help="max memory (in GB) for the tasks run at the same time\n[DEFAULT: " + 
+            str(config.max_memory) + " (no limit)]", 
+        metavar="<" + str(config.max_memory) + ">", 
         type=float,
-        default=config.prescreen_threshold) 
+        default=config.max_memory) 
+    parser.add_argument(
+        "--prescreen-threshold", 
+        help="minimum percentage of reads matching a species\n[DEFAULT: %(default)s]", 
+        metavar="<prescreen_threshold>", 
+        type=float) 
     parser.add_argument(
         "--identity-threshold", 
         help="identity threshold for alignments\n[DEFAULT: " 
@@ -195,18 +239,14 @@ def parse_arguments(args):
         default=config.identity_threshold) 
     parser.add_argument(
         "--translated-subject-coverage-threshold", 
-        help="subject coverage threshold for translated alignments\n[DEFAULT: " 
-            + str(config.translated_subject_coverage_threshold) + "]", 
-        metavar="<" + str(config.translated_subject_coverage_threshold) + ">", 
-        type=float,
-        default=config.translated_subject_coverage_threshold)
+        help="subject coverage threshold for translated alignments\n[DEFAULT: %(default)s]", 
+        metavar="<subject_coverage_threshold>", 
+        type=float)
     parser.add_argument(
         "--translated-query-coverage-threshold", 
-        help="query coverage threshold for translated alignments\n[DEFAULT: " 
-            + str(config.translated_query_coverage_threshold) + "]", 
-        metavar="<" + str(config.translated_query_coverage_threshold) + ">", 
-        type=float,
-        default=config.translated_query_coverage_threshold)
+        help="query coverage threshold for translated alignments\n[DEFAULT: %(default)s]", 
+        metavar="<query_coverage_threshold>", 
+        type=float)
     parser.add_argument(
         "--bowtie2",
         help="directory containing the bowtie2 executable\n[DEFAULT: $PATH]", 
@@ -243,18 +283,103 @@ def parse_arguments(args):
         config.xipe_toggle + "]",
         default=config.xipe_toggle,
         choices=config.toggle_choices)
+    parser.add_argument(
+        "--xipe-engine",
+        help="the xipe computation to run\n" +
+        "internal = in process\n" +
+        "external = the xipe script\n[DEFAULT: " +
+        config.xipe_engine + "]",
+        default=config.xipe_engine,
+        choices=config.xipe_engine_choices)
+    parser.add_argument(
+        "--taxon-pathways",
+        help="restrict the pathways for each bug to those known\n" +
+        "for the genus or species of the bug (MetaCyc organisms)\n[DEFAULT: " +
+        config.taxon_pathways + "]",
+        default=config.taxon_pathways,
+        choices=config.taxon_pathways_choices)
+    parser.add_argument(
+        "--xipe-seed",
+        help="the seed for the random numbers used by xipe\n[DEFAULT: none]",
+        metavar="<seed>",
+        type=int)
     parser.add_argument(
         "--minpath",
         help="turn on/off the minpath computation\n[DEFAULT: " + 
         config.minpath_toggle + "]",
         default=config.minpath_toggle,
         choices=config.toggle_choices)
+    parser.add_argument(
+        "--minpath-engine",
+        help="the minpath computation to run\n" +
+        "internal = in process with the bugs run in parallel\n" +
+        "external = the MinPath script with glpsol\n[DEFAULT: " +
+        config.minpath_engine + "]",
+        default=config.minpath_engine,
+        choices=config.minpath_engine_choices)
+    parser.add_argument(
+        "--minpath-cache",
+        help="store the minpath results for each set of reactions\nin the cache directory\n[DEFAULT: " +
+        config.minpath_cache_toggle + "]",
+        default=config.minpath_cache_toggle,
+        choices=config.toggle_choices)
     parser.add_argument(
         "--pick-frames",
         help="turn on/off the pick_frames computation\n[DEFAULT: " + 
         config.pick_frames_toggle + "]",
         default=config.pick_frames_toggle,
         choices=config.toggle_choices)
+    parser.add_argument(
+        "--dedup-reads",
+        help="turn on/off collapsing exact duplicate reads before alignment\n[DEFAULT: " + 
+        config.dedup_reads_toggle + "]",
+        default=config.dedup_reads_toggle,
+        choices=config.toggle_choices)
+    parser.add_argument(
+        "--checkpoints",
+        help="turn on/off saving checkpoints at the end of each stage to resume from\n[DEFAULT: " + 
+        config.checkpoints_toggle + "]",
+        default=config.checkpoints_toggle,
+        choices=config.toggle_choices)
+    parser.add_argument(
+        "--alignment-store",
+        help="turn on/off writing all of the alignments (before filtering) to an alignment store\n" +
+        "which can be used as input to compute the outputs with new thresholds\n[DEFAULT: " + 
+        config.alignment_store_toggle + "]",
+        default=config.alignment_store_toggle,
+        choices=config.toggle_choices)
+    parser.add_argument(
+        "--metrics",
+        help="turn on/off writing the performance metrics for each stage to a json file\n[DEFAULT: " + 
+        config.metrics_toggle + "]",
+        default=config.metrics_toggle,
+        choices=config.toggle_choices)
+    parser.add_argument(
+        "--resource-sampler",
+        help="turn on/off sampling the cpu, memory, and io of humann2 and the software it runs\n" +
+        "while in progress (written to the temp folder or with the outputs if it is removed)\n[DEFAULT: " + 
+        config.resource_sampler_toggle + "]",
+        default=config.resource_sampler_toggle,
+        choices=config.toggle_choices)
+    parser.add_argument(
+        "--resource-sampler-interval",
+        help="the seconds between the resource samples\n[DEFAULT: " + 
+        str(config.resource_sampler_interval) + "]",
+        metavar="<" + str(config.resource_sampler_interval) + ">",
+        type=float,
+        default=config.resource_sampler_interval)
+    parser.add_argument(
+        "--profile-stage",
+        help="profile the stage (or all stages) with cProfile writing the stats to the temp folder\n" +
+        "(can be provided multiple times)\n[choices: " + ", ".join(config.profile_stage_choices) + "]",
+        metavar="<name|" + config.profile_all_stages + ">",
+        action="append",
+        choices=config.profile_stage_choices+[config.profile_all_stages])
+    parser.add_argument(
+        "--trace-memory",
+        help="trace the memory allocations with tracemalloc and report the top allocation\n" +
+        "sites and the sizes of the stores at the end of each stage in the log",
+        action="store_true")
     parser.add_argument(
         "--gap-fill",
         help="turn on/off the gap fill computation\n[DEFAULT: " + 
@@ -267,13 +392,25 @@ def parse_arguments(args):
         config.output_format + "]",
         default=config.output_format,
         choices=config.output_format_choices)
+    parser.add_argument(
+        "--output-compression",
+        help="the compression of the tsv output files\n[DEFAULT: " +
+        config.output_compression + "]",
+        default=config.output_compression,
+        choices=config.output_compression_choices)
+    parser.add_argument(
+        "--columnar-value-type",
+        help="the type of the values in columnar output files\n" +
+        "(float32 halves the size but keeps only about 7 significant digits\n" +
+        "so values can differ from the tsv output at --output-max-decimals)\n[DEFAULT: " +
+        config.columnar_value_type + "]",
+        default=config.columnar_value_type,
+        choices=config.columnar_value_type_choices)
     parser.add_argument(
         "--output-max-decimals",
-        help="the number of decimals to output\n[DEFAULT: " +
-        str(config.output_max_decimals) + "]",
-        metavar="<" + str(config.output_max_decimals) + ">", 
-        type=int,
-        default=config.output_max_decimals)
+        help="the number of decimals to output\n[DEFAULT: %(default)s]",
+        metavar="<output_max_decimals>", 
+        type=int)
     parser.add_argument(
         "--output-basename",
         help="the basename for the output files\n[DEFAULT: " +
@@ -284,14 +421,12 @@ def parse_arguments(args):
         "--remove-stratified-output", 
         help="remove stratification from output\n" + 
             "[DEFAULT: output is stratified]", 
-        action="store_true",
-        default=config.remove_stratified_output)
+        action="store_true")
     parser.add_argument(
         "--remove-column-description-output", 
         help="remove the description in the output column\n" + 
             "[DEFAULT: output column includes description]", 
-        action="store_true",
-        default=config.remove_column_description_output)
+        action="store_true")
     parser.add_argument(
         "--input-format",
         help="the format of the input file\n[DEFAULT: format identified by software]",
@@ -308,6 +443,23 @@ def parse_arguments(args):
         config.pathways_database + "]",
         default=config.pathways_database,
         choices=config.pathways_database_choices)
+    parser.add_argument(
+        "--cache-directory",
+        help="directory to store files reused across runs\n[DEFAULT: " +
+        config.cache_directory + "]",
+        metavar="<cache_directory>")
+    parser.add_argument(
+        "--database-cache",
+        help="store the compiled pathways and reactions databases\nin the cache directory\n[DEFAULT: " +
+        config.database_cache_toggle + "]",
+        default=config.database_cache_toggle,
+        choices=config.toggle_choices)
+    parser.add_argument(
+        "--tool-version-cache",
+        help="store the versions of the alignment software\nin the cache directory\n[DEFAULT: " +
+        config.tool_version_cache_toggle + "]",
+        default=config.tool_version_cache_toggle,
+        choices=config.toggle_choices)
     parser.add_argument(
         "--memory-use",
         help="the amount of memory to use\n[DEFAULT: " +
@@ -315,16 +467,22 @@ def parse_arguments(args):
         default=config.memory_use,
         choices=config.memory_use_options)
 
-    return parser.parse_args()
+    args=parser.parse_args(args[1:])
+    
+    # The output directory is required except when running as a server
+    if not args.output and not args.serve:
+        parser.error("the following arguments are required: -o/--output")
+        
+    if args.submit and args.serve:
+        parser.error("argument --submit: not allowed with argument --serve")
+
+    return args
 	 
 def update_configuration(args):
     """
     Update the configuration settings based on the arguments
     """
     
-    # Use the full path to the input file
-    args.input=os.path.abspath(args.input)
-
     # If set, append paths executable locations
     if args.metaphlan:
         utilities.add_exe_to_path(os.path.abspath(args.metaphlan))    
@@ -375,6 +533,12 @@ def update_configuration(args):
         
     if args.protein_database:
         config.protein_database=os.path.abspath(args.protein_database)
+        
+    # Set the location of the cache
+    if args.cache_directory:
+        config.cache_directory=os.path.abspath(args.cache_directory)
+    config.database_cache_toggle=args.database_cache
+    config.tool_version_cache_toggle=args.tool_version_cache
 
     # if set, update the config run mode to resume
     if args.resume:
@@ -407,30 +571,70 @@ def update_configuration(args):
         config.bypass_nucleotide_index=True
         config.bypass_nucleotide_search=True
         
-    # Update thresholds
-    config.prescreen_threshold=args.prescreen_threshold
-    config.translated_subject_coverage_threshold=args.translated_subject_coverage_threshold
-    config.translated_query_coverage_threshold=args.translated_query_coverage_threshold
+    # Update thresholds, if set
+    if args.prescreen_threshold is not None:
+        config.prescreen_threshold=args.prescreen_threshold
+    if args.translated_subject_coverage_threshold is not None:
+        config.translated_subject_coverage_threshold=args.translated_subject_coverage_threshold
+    if args.translated_query_coverage_threshold is not None:
+        config.translated_query_coverage_threshold=args.translated_query_coverage_threshold
     
-    # Update the max decimals output
-    config.output_max_decimals=args.output_max_decimals
+    # Update the max decimals output, if set
+    if args.output_max_decimals is not None:
+        config.output_max_decimals=args.output_max_decimals
     
     # Update memory use
     config.memory_use=args.memory_use
     
-    # Update threads
-    config.threads=args.threads
+    # Update threads (if set) and max memory
+    if args.threads is not None:
+        config.threads=args.threads
+    config.max_memory=args.max_memory
     
-    # Update the evalue threshold
-    config.evalue_threshold=args.evalue
+    # Update the evalue threshold, if set
+    if args.evalue is not None:
+        config.evalue_threshold=args.evalue
     
     # Update translated alignment software
     config.translated_alignment_selected=args.translated_alignment
         
     # Update the computation toggle choices
     config.xipe_toggle=args.xipe
+    config.xipe_engine=args.xipe_engine
+    config.xipe_seed=args.xipe_seed
+    config.taxon_pathways=args.taxon_pathways
     config.minpath_toggle=args.minpath
+    config.minpath_engine=args.minpath_engine
+    config.minpath_cache_toggle=args.minpath_cache
     config.gap_fill_toggle=args.gap_fill
+    config.dedup_reads_toggle=args.dedup_reads
+    config.checkpoints_toggle=args.checkpoints
+    config.alignment_store_toggle=args.alignment_store
+    config.metrics_toggle=args.metrics
+    config.resource_sampler_toggle=args.resource_sampler
+    config.resource_sampler_interval=args.resource_sampler_interval
+    if config.resource_sampler_interval <= 0:
+        sys.exit("CRITICAL ERROR: The resource sampler interval must be greater than zero.")
+    config.profile_stages=args.profile_stage or []
+    config.trace_memory=args.trace_memory
+    
+    # Update the output format
+    if args.remove_stratified_output:
+        config.remove_stratified_output=True
+    if args.remove_column_description_output:
+        config.remove_column_description_output=True
+    config.output_format=args.output_format
+    config.output_compression=args.output_compression
+    config.columnar_value_type=args.columnar_value_type
+ 
+def update_sample_configuration(args):
+    """
+    Update the configuration settings for the input file (sample)
+    Set the output files, the temp directory, and the log file
+    """
+    
+    # Use the full path to the input file
+    args.input=os.path.abspath(args.input)
     
     # Check that the input file exists and is readable
     if not os.path.isfile(args.input):
@@ -439,24 +643,8 @@ def update_configuration(args):
     if not os.access(args.input, os.R_OK):
         sys.exit("CRITICAL ERROR: Not able to read input file selected: " + args.input)
         
-    # Update the output format
-    config.remove_stratified_output=args.remove_stratified_output
-    config.remove_column_description_output=args.remove_column_description_output    
- 
     # Check that the output directory is writeable
-    output_dir = os.path.abspath(args.output)
-    
-    if not os.path.isdir(output_dir):
-        try:
-            print("Creating output directory: " + output_dir)
-            os.mkdir(output_dir)
-        except EnvironmentError:
-            sys.exit("CRITICAL ERROR: Unable to create output directory.")
-    
-    if not os.access(output_dir, os.W_OK):
-        sys.exit("CRITICAL ERROR: The output directory is not " + 
-            "writeable. This software needs to write files to this directory.\n" +
-            "Please select another directory.")
+    output_dir = create_output_directory(args.output)
         
     print("Output files will be written to: " + output_dir) 
     
@@ -465,29 +653,25 @@ def update_configuration(args):
         config.file_basename=args.output_basename
     else:
         # Determine the basename of the input file to use as output file basename
-        input_file_basename=os.path.basename(args.input)
-        # Remove gzip extension if present
-        if re.search('.gz$',input_file_basename):
-            input_file_basename='.'.join(input_file_basename.split('.')[:-1])
-        # Remove input file extension if present
-        if '.' in input_file_basename:
-            input_file_basename='.'.join(input_file_basename.split('.')[:-1])
-    
-        config.file_basename=input_file_basename
-    
-    # Set the output format
-    config.output_format=args.output_format
+        config.file_basename=get_input_file_basename(args.input)
     
-    # Set final output file names and location
+    # Set final output file names and location (biom files are not compressed)
+    output_extension=""
+    if config.output_format == "tsv":
+        output_extension=config.output_compression_extension[config.output_compression]
     config.pathabundance_file=os.path.join(output_dir,
             config.file_basename + config.pathabundance_file + "." + 
-            config.output_format)
+            config.output_format + output_extension)
     config.pathcoverage_file=os.path.join(output_dir,
             config.file_basename + config.pathcoverage_file + "." + 
-            config.output_format)
+            config.output_format + output_extension)
     config.genefamilies_file=os.path.join(output_dir,
             config.file_basename + config.genefamilies_file + "." + 
-            config.output_format)
+            config.output_format + output_extension)
+    config.alignment_store_file=os.path.join(output_dir,
+            config.file_basename + config.alignment_store_file + config.alignment_store_extension)
+    config.metrics_file=os.path.join(output_dir,
+            config.file_basename + config.metrics_file + ".json")
 
     # set the location of the temp directory
     if not args.remove_temp_output:
@@ -503,6 +687,11 @@ def update_configuration(args):
         
     # create the unnamed temp directory
     config.unnamed_temp_dir=tempfile.mkdtemp(dir=config.temp_dir)
+    
+    # set the location of the resource samples file
+    # (written with the output files if the temp directory is removed at the end of the run)
+    config.resource_sampler_file=os.path.join(output_dir if args.remove_temp_output else config.temp_dir,
+        config.file_basename + config.resource_sampler_file + ".csv")
 
     # set the name of the log file 
     log_file=os.path.join(config.temp_dir,config.file_basename+".log")
@@ -512,8 +701,7 @@ def update_configuration(args):
         log_file=args.o_log
         
     # configure the logger
-    logging.basicConfig(filename=log_file,format='%(asctime)s - %(name)s - %(levelname)s: %(message)s',
-        level=getattr(logging,args.log_level), filemode='w', datefmt='%m/%d/%Y %I:%M:%S %p')
+    configure_logging(log_file, args.log_level)
     
     # write the version of the software to the log
     logger.info("Running humann2 v"+VERSION)
@@ -527,6 +715,57 @@ def update_configuration(args):
     if config.verbose: 
         print("\n"+message+"\n")    
 
+def get_input_file_basename(input):
+    """
+    Return the basename of the input file without extensions
+    """
+    
+    input_file_basename=os.path.basename(input)
+    # Remove gzip extension if present
+    if re.search('.gz$',input_file_basename):
+        input_file_basename='.'.join(input_file_basename.split('.')[:-1])
+    # Remove input file extension if present
+    if '.' in input_file_basename:
+        input_file_basename='.'.join(input_file_basename.split('.')[:-1])
+        
+    return input_file_basename
+
+def create_output_directory(output):
+    """
+    Create the output directory if needed and check that it is writeable
+    Return the full path to the directory
+    """
+    
+    output_dir = os.path.abspath(output)
+    
+    if not os.path.isdir(output_dir):
+        try:
+            print("Creating output directory: " + output_dir)
+            os.mkdir(output_dir)
+        except EnvironmentError:
+            sys.exit("CRITICAL ERROR: Unable to create output directory.")
+    
+    if not os.access(output_dir, os.W_OK):
+        sys.exit("CRITICAL ERROR: The output directory is not " + 
+            "writeable. This software needs to write files to this directory.\n" +
+            "Please select another directory.")
+        
+    return output_dir
+
+def configure_logging(log_file, log_level, filemode="w"):
+    """
+    Write the log to the file, replacing any prior log handlers 
+    so each sample processed has its own log file
+    """
+    
+    root_logger=logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+        handler.close()
+        
+    logging.basicConfig(filename=log_file,format='%(asctime)s - %(name)s - %(levelname)s: %(message)s',
+        level=getattr(logging,log_level), filemode=filemode, datefmt='%m/%d/%Y %I:%M:%S %p')
+
 def parse_chocophlan_gene_indexes(annotation_gene_index):
     """ Parse the chocophlan gene index input """
     
@@ -602,7 +841,17 @@ def check_requirements(args):
         else:
             sys.exit("CRITICAL ERROR: Unable to convert bam input file to sam.")
 
-    # If the input format is in biom then convert to tsv
+    from . import biom_tables
+    
+    # If the input format is in biom then read it in process as a gene table
+    if args.input_format == "biom" and biom_tables.biom_installed():
+        args.input_format="genetable"
+        
+    # Columnar input files are read as gene tables
+    if args.input_format == "columnar":
+        args.input_format="genetable"
+        
+    # Otherwise convert the biom input to tsv
     if args.input_format == "biom":
         
         # Check for the biom software
@@ -621,8 +870,8 @@ def check_requirements(args):
             
     # If the biom output format is selected, check for the biom package
     if config.output_format=="biom":
-        if not utilities.find_exe_in_path("biom"):
-            sys.exit("CRITICAL ERROR: The biom executable can not be found. "
+        if not biom_tables.biom_installed() and not utilities.find_exe_in_path("biom"):
+            sys.exit("CRITICAL ERROR: The biom package and executable can not be found. "
             "Please check the install or select another output format.")
      
     # If the file is fasta/fastq check for requirements   
@@ -771,6 +1020,17 @@ def check_requirements(args):
     # parse the chocophlan gene index
     chocophlan_gene_indexes=parse_chocophlan_gene_indexes(args.annotation_gene_index)            
         
+    # use the search mode of the run which created the alignment store, if not set
+    if args.input_format == "alignmentstore" and not args.search_mode:
+        from . import alignment_store
+        try:
+            stored_search_mode=alignment_store.AlignmentStore.read(args.input, 
+                metadata_only=True).metadata["search_mode"]
+        except (ValueError, KeyError):
+            sys.exit("CRITICAL ERROR: Unable to read the alignment store: " + args.input)
+        logger.info("Search mode set to " + stored_search_mode + " as used to create the alignment store")
+        config.search_mode=stored_search_mode
+    
     # set the user provided search mode, if set
     if args.search_mode:
         config.search_mode = args.search_mode
@@ -808,12 +1068,22 @@ def check_requirements(args):
         config.diamond_opts = config.diamond_opts_uniref50
 
               
-def timestamp_message(task, start_time):
+def timestamp_message(task, start_time, counts=None):
     """
     Print and log a message about the task completed and the time
     Log messages are tab delimited for quick task/time access with awk
+    Record the metrics for the task (with the counts of records) if set
     Return the new start time
     """
+    if config.metrics_toggle == "on":
+        from . import metrics
+        metrics.stage_completed(task, counts)
+    if config.resource_sampler_toggle == "on":
+        from . import sampler
+        sampler.stage_completed(task)
+    if config.profile_stages or config.trace_memory:
+        from . import profiling
+        profiling.stage_completed(task)
     message="TIMESTAMP: Completed \t" + task + " \t:\t " + \
         str(int(round(time.time() - start_time))) + "\t seconds"
     logger.info(message)
@@ -821,32 +1091,22 @@ def timestamp_message(task, start_time):
         print("\n"+message.replace("\t","")+"\n")   
         
     return time.time() 
-              
-def main():
-    # Parse arguments from command line
-    args=parse_arguments(sys.argv)
-    
-    # Update the configuration settings based on the arguments
-    update_configuration(args)
-    
-    # Check for required files, software, databases, and also permissions
-    check_requirements(args)
-    
-    # Write the config settings to the log file
-    config.log_settings()
 
-    # Initialize alignments and gene scores
-    minimize_memory_use=True
-    if config.memory_use == "maximum":
-        minimize_memory_use=False
-        
-    alignments=store.Alignments(minimize_memory_use=minimize_memory_use)
-    unaligned_reads_store=store.Reads(minimize_memory_use=minimize_memory_use)
-    gene_scores=store.GeneScores()
+def alignment_counts(alignments, unaligned_reads_store):
+    """
+    Return the counts of the reads and alignments for the metrics
+    """
     
-    # If id mapping is provided then process
-    if args.id_mapping:
-        alignments.process_id_mapping(args.id_mapping)
+    return {"reads": unaligned_reads_store.get_initial_read_count(),
+        "unaligned_reads": unaligned_reads_store.count_reads(),
+        "alignments": alignments.count_alignments(),
+        "genes": alignments.count_genes(),
+        "bugs": alignments.count_bugs()}
+              
+def load_databases():
+    """
+    Load the reactions and pathways databases
+    """
     
     # Load in the reactions database
     reactions_database=None
@@ -864,161 +1124,317 @@ def main():
     else:
         message="Load pathways database: " + config.pathways_database_part2
     logger.info(message)
+    
+    return reactions_database, pathways_database
+
+def run_sample(args, reactions_database, pathways_database, gene_family_names=None,
+               pathway_names=None):
+    """
+    Run the pipeline on the input file with the databases loaded
+    Return the list of output files created
+    """
+
+    # Initialize alignments and gene scores
+    minimize_memory_use=True
+    if config.memory_use == "maximum":
+        minimize_memory_use=False
+        
+    alignments=store.Alignments(minimize_memory_use=minimize_memory_use)
+    unaligned_reads_store=store.Reads(minimize_memory_use=minimize_memory_use)
+    gene_scores=store.GeneScores()
+    
+    # If id mapping is provided then process
+    if args.id_mapping:
+        alignments.process_id_mapping(args.id_mapping)
+
+    # Load the stores from the last checkpoint if resuming
+    from . import checkpoint
+    checkpoints=checkpoint.Checkpoints(checkpoint.checkpoint_folder(),
+        inputs=[args.input, args.taxonomic_profile, args.id_mapping],
+        fingerprint=checkpoint.config_fingerprint(VERSION, args.input_format),
+        enabled=config.checkpoints_toggle == "on" and not args.remove_temp_output)
+    state=checkpoints.start(config.resume)
+    alignments=state.get("alignments",alignments)
+    unaligned_reads_store=state.get("unaligned_reads_store",unaligned_reads_store)
+    gene_scores=state.get("gene_scores",gene_scores)
+    unaligned_reads_file_fasta=state.get("unaligned_reads_file_fasta")
+    
+    # Store all of the alignments before filtering if set
+    stored_alignments=None
+    if config.alignment_store_toggle == "on" and args.input_format in ["fasta","fastq","sam","blastm8"]:
+        from . import alignment_store
+        stored_alignments=state.get("stored_alignments",
+            alignment_store.AlignmentStore(nucleotide_stage=args.input_format != "blastm8"))
 
-    # Start timer
+    # Start timer and the metrics for the run if set
+    # (the modules are imported only when needed to reduce the time to start)
     start_time=time.time()
+    if config.metrics_toggle == "on":
+        from . import metrics
+        metrics.start_run(True, startup_end_time)
+    if config.resource_sampler_toggle == "on":
+        from . import sampler
+        sampler.start_run(True, config.resource_sampler_file, config.resource_sampler_interval)
+    if config.profile_stages or config.trace_memory:
+        from . import profiling
+        profiling.start_run(config.profile_stages, config.trace_memory)
+        for name, store_object in [("Alignments", alignments), ("Reads", unaligned_reads_store), 
+            ("GeneScores", gene_scores)]:
+            profiling.track_store(name, store_object)
 
     # Process fasta or fastq input files
+    # (the modules for each input format are imported only when needed to reduce the time to start)
     if args.input_format in ["fasta","fastq"]:
-        # Run prescreen to identify bugs
-        bug_file = "Empty"
-        if args.taxonomic_profile:
-            bug_file = os.path.abspath(args.taxonomic_profile)
-        else:
-            if not config.bypass_prescreen:
-                bug_file = prescreen.alignment(args.input)
-                start_time=timestamp_message("prescreen",start_time)
-    
-        # Create the custom database from the bugs list
-        custom_database = ""
-        if not config.bypass_nucleotide_index:
-            custom_database = prescreen.create_custom_database(config.nucleotide_database, bug_file)
-            start_time=timestamp_message("custom database creation",start_time)
-        else:
-            custom_database = "Bypass"
+        from .search import prescreen
+        from .search import nucleotide
+        from .search import translated
+        
+        if not checkpoints.completed("nucleotide"):
+            # Run prescreen to identify bugs
+            bug_file = "Empty"
+            if args.taxonomic_profile:
+                bug_file = os.path.abspath(args.taxonomic_profile)
+            else:
+                if not config.bypass_prescreen:
+                    bug_file = prescreen.alignment(args.input)
+                    start_time=timestamp_message("prescreen",start_time)
     
-        # Run nucleotide search on custom database
-        if custom_database != "Empty" and not config.bypass_nucleotide_search:
+            # Create the custom database from the bugs list
+            custom_database = ""
             if not config.bypass_nucleotide_index:
-                nucleotide_index_file = nucleotide.index(custom_database)
-                start_time=timestamp_message("database index",start_time)
+                custom_database = prescreen.create_custom_database(config.nucleotide_database, bug_file)
+                start_time=timestamp_message("custom database creation",start_time)
             else:
-                nucleotide_index_file = nucleotide.find_index(config.nucleotide_database)
-                
-            nucleotide_alignment_file = nucleotide.alignment(args.input, 
-                nucleotide_index_file)
-    
-            start_time=timestamp_message("nucleotide alignment",start_time)
-    
-            # Determine which reads are unaligned and reduce aligned reads file
-            # Remove the alignment_file as we only need the reduced aligned reads file
-            [ unaligned_reads_file_fasta, reduced_aligned_reads_file ] = nucleotide.unaligned_reads(
-                nucleotide_alignment_file, alignments, unaligned_reads_store, keep_sam=True)
+                custom_database = "Bypass"
             
-            start_time=timestamp_message("nucleotide alignment post-processing",start_time)
+            # Collapse exact duplicate reads so each unique sequence is only aligned once
+            # The number of reads each represents is used to weight the alignments
+            search_input=args.input
+            read_counts={}
+            if config.dedup_reads_toggle == "on":
+                search_input, read_counts = utilities.collapse_duplicate_reads(args.input)
+                unaligned_reads_store.set_read_counts(read_counts)
+                start_time=timestamp_message("duplicate read collapsing",start_time)
     
-            # Print out total alignments per bug
-            message="Total bugs from nucleotide alignment: " + str(alignments.count_bugs())
-            logger.info(message)
-            print(message)
-            
-            message=alignments.counts_by_bug()
-            logger.info("\n"+message)
-            print(message)        
+            # Run nucleotide search on custom database
+            if custom_database != "Empty" and not config.bypass_nucleotide_search:
+                if not config.bypass_nucleotide_index:
+                    nucleotide_index_file = nucleotide.index(custom_database)
+                    start_time=timestamp_message("database index",start_time)
+                else:
+                    nucleotide_index_file = nucleotide.find_index(config.nucleotide_database)
+                
+                nucleotide_alignment_file = nucleotide.alignment(search_input, 
+                    nucleotide_index_file)
     
-            message="Total gene families from nucleotide alignment: " + str(alignments.count_genes())
-            logger.info(message)
-            print("\n"+message)
+                start_time=timestamp_message("nucleotide alignment",start_time)
     
-            # Report reads unaligned
-            message="Unaligned reads after nucleotide alignment: " + utilities.estimate_unaligned_reads_stored(
-                args.input, unaligned_reads_store) + " %"
-            logger.info(message)
-            print("\n"+message+"\n")  
-        else:
-            logger.debug("Custom database is empty")
-            reduced_aligned_reads_file = "Empty"
-            unaligned_reads_file_fasta=args.input
-            unaligned_reads_store=store.Reads(unaligned_reads_file_fasta, minimize_memory_use=minimize_memory_use)
+                # Determine which reads are unaligned and reduce aligned reads file
+                # Remove the alignment_file as we only need the reduced aligned reads file
+                [ unaligned_reads_file_fasta, reduced_aligned_reads_file ] = nucleotide.unaligned_reads(
+                    nucleotide_alignment_file, alignments, unaligned_reads_store, keep_sam=True,
+                    alignment_store=stored_alignments)
+            
+                start_time=timestamp_message("nucleotide alignment post-processing",start_time,
+                    alignment_counts(alignments, unaligned_reads_store))
     
-        # Do not run if set to bypass translated search in config file
-        if not config.bypass_translated_search:
-            # Run translated search on UniRef database if unaligned reads exit
-            if unaligned_reads_store.count_reads()>0:
-                translated_alignment_file = translated.alignment(config.protein_database, 
-                    unaligned_reads_file_fasta)
-        
-                start_time=timestamp_message("translated alignment",start_time)
-        
-                # Determine which reads are unaligned
-                translated_unaligned_reads_file_fastq = translated.unaligned_reads(
-                    unaligned_reads_store, translated_alignment_file, alignments)
-                
-                start_time=timestamp_message("translated alignment post-processing",start_time)
-        
                 # Print out total alignments per bug
-                message="Total bugs after translated alignment: " + str(alignments.count_bugs())
+                message="Total bugs from nucleotide alignment: " + str(alignments.count_bugs())
                 logger.info(message)
                 print(message)
             
                 message=alignments.counts_by_bug()
                 logger.info("\n"+message)
-                print(message)
-        
-                message="Total gene families after translated alignment: " + str(alignments.count_genes())
+                print(message)        
+    
+                message="Total gene families from nucleotide alignment: " + str(alignments.count_genes())
                 logger.info(message)
                 print("\n"+message)
-        
+    
                 # Report reads unaligned
-                message="Unaligned reads after translated alignment: " + utilities.estimate_unaligned_reads_stored(
+                message="Unaligned reads after nucleotide alignment: " + utilities.estimate_unaligned_reads_stored(
                     args.input, unaligned_reads_store) + " %"
                 logger.info(message)
                 print("\n"+message+"\n")  
             else:
-                message="All reads are aligned so translated alignment will not be run"
+                logger.debug("Custom database is empty")
+                reduced_aligned_reads_file = "Empty"
+                unaligned_reads_file_fasta=search_input
+                unaligned_reads_store=store.Reads(unaligned_reads_file_fasta, minimize_memory_use=minimize_memory_use)
+                if read_counts:
+                    unaligned_reads_store.set_read_counts(read_counts)
+                    unaligned_reads_store.set_initial_read_count(unaligned_reads_store.count_reads())
+                if stored_alignments:
+                    for id in sorted(unaligned_reads_store.id_list()):
+                        stored_alignments.add_unmapped(id, unaligned_reads_store.get_read_count(id))
+    
+            # Save the stores to resume from the end of this stage
+            checkpoints.save("nucleotide", {"alignments": alignments, 
+                "unaligned_reads_store": unaligned_reads_store,
+                "unaligned_reads_file_fasta": unaligned_reads_file_fasta,
+                "stored_alignments": stored_alignments},
+                files=[unaligned_reads_file_fasta])
+    
+        if not checkpoints.completed("translated"):
+            # Do not run if set to bypass translated search in config file
+            if not config.bypass_translated_search:
+                # Run translated search on UniRef database if unaligned reads exit
+                if unaligned_reads_store.count_reads()>0:
+                    translated_alignment_file = translated.alignment(config.protein_database, 
+                        unaligned_reads_file_fasta)
+        
+                    start_time=timestamp_message("translated alignment",start_time)
+        
+                    # Determine which reads are unaligned
+                    translated_unaligned_reads_file_fastq = translated.unaligned_reads(
+                        unaligned_reads_store, translated_alignment_file, alignments,
+                        alignment_store=stored_alignments)
+                
+                    start_time=timestamp_message("translated alignment post-processing",start_time,
+                        alignment_counts(alignments, unaligned_reads_store))
+        
+                    # Print out total alignments per bug
+                    message="Total bugs after translated alignment: " + str(alignments.count_bugs())
+                    logger.info(message)
+                    print(message)
+            
+                    message=alignments.counts_by_bug()
+                    logger.info("\n"+message)
+                    print(message)
+        
+                    message="Total gene families after translated alignment: " + str(alignments.count_genes())
+                    logger.info(message)
+                    print("\n"+message)
+        
+                    # Report reads unaligned
+                    message="Unaligned reads after translated alignment: " + utilities.estimate_unaligned_reads_stored(
+                        args.input, unaligned_reads_store) + " %"
+                    logger.info(message)
+                    print("\n"+message+"\n")  
+                else:
+                    message="All reads are aligned so translated alignment will not be run"
+                    logger.info(message)
+                    print(message)
+            else:
+                message="Bypass translated search"
                 logger.info(message)
                 print(message)
-        else:
-            message="Bypass translated search"
-            logger.info(message)
-            print(message)
+
+            # Save the stores to resume from the end of this stage
+            checkpoints.save("translated", {"alignments": alignments, 
+                "unaligned_reads_store": unaligned_reads_store,
+                "stored_alignments": stored_alignments})
     
     # Process input files of sam format
     elif args.input_format in ["sam"]:
+        from .search import nucleotide
+        
         # Turn off frame picker if set on
         config.pick_frames_toggle="off"
         
-        # Store the sam mapping results
-        message="Process the sam mapping results ..."
-        logger.info(message)
-        print("\n"+message)
+        if not checkpoints.completed("nucleotide"):
+            # Store the sam mapping results
+            message="Process the sam mapping results ..."
+            logger.info(message)
+            print("\n"+message)
             
-        [unaligned_reads_file_fasta, reduced_aligned_reads_file] = nucleotide.unaligned_reads(
-            args.input, alignments, unaligned_reads_store, keep_sam=True)
+            [unaligned_reads_file_fasta, reduced_aligned_reads_file] = nucleotide.unaligned_reads(
+                args.input, alignments, unaligned_reads_store, keep_sam=True,
+                alignment_store=stored_alignments)
         
-        start_time=timestamp_message("alignment post-processing",start_time)
+            start_time=timestamp_message("alignment post-processing",start_time,
+                alignment_counts(alignments, unaligned_reads_store))
+            
+            # Save the stores to resume from the end of this stage
+            checkpoints.save("nucleotide", {"alignments": alignments, 
+                "unaligned_reads_store": unaligned_reads_store,
+                "stored_alignments": stored_alignments})
             
     # Process input files of tab-delimited blast format
     elif args.input_format in ["blastm8"]:
+        from .search import translated
         
-        # Store the blastm8 mapping results
-        message="Process the blastm8 mapping results ..."
+        if not checkpoints.completed("translated"):
+            # Store the blastm8 mapping results
+            message="Process the blastm8 mapping results ..."
+            logger.info(message)
+            print("\n"+message)
+        
+            translated_unaligned_reads_file_fastq = translated.unaligned_reads(
+                unaligned_reads_store, args.input, alignments, alignment_store=stored_alignments)
+        
+            start_time=timestamp_message("alignment post-processing",start_time,
+                alignment_counts(alignments, unaligned_reads_store))
+            
+            # Save the stores to resume from the end of this stage
+            checkpoints.save("translated", {"alignments": alignments, 
+                "unaligned_reads_store": unaligned_reads_store,
+                "stored_alignments": stored_alignments})
+            
+    # Process an alignment store with the current thresholds
+    elif args.input_format in ["alignmentstore"]:
+        
+        message="Process the alignment store ..."
         logger.info(message)
         print("\n"+message)
         
-        translated_unaligned_reads_file_fastq = translated.unaligned_reads(
-            unaligned_reads_store, args.input, alignments)
+        from . import alignment_store
+        try:
+            stored_alignments=alignment_store.AlignmentStore.read(args.input)
+        except ValueError as e:
+            sys.exit("CRITICAL ERROR: Unable to read the alignment store. " + str(e))
+        stored_alignments.quantify(alignments, unaligned_reads_store)
+        
+        start_time=timestamp_message("alignment store post-processing",start_time,
+            alignment_counts(alignments, unaligned_reads_store))
         
-        start_time=timestamp_message("alignment post-processing",start_time)
+        message="Total bugs from alignment store: " + str(alignments.count_bugs())
+        logger.info(message)
+        print(message)
+        
+        message="Total gene families from alignment store: " + str(alignments.count_genes())
+        logger.info(message)
+        print("\n"+message)
+        
+        # The alignment store is not written again
+        stored_alignments=None
+        
+    # Write all of the alignments to the alignment store
+    if stored_alignments and not checkpoints.completed("gene_families"):
+        stored_alignments.write(config.alignment_store_file)
+        logger.info("Alignment store written with " + str(stored_alignments.count_nucleotide()) + 
+            " nucleotide and " + str(stored_alignments.count_translated()) + " translated alignments")
         
     # Get the number of remaining unaligned reads
-    unaligned_reads_count=unaligned_reads_store.count_reads()
+    unaligned_reads_count=state.get("unaligned_reads_count",unaligned_reads_store.count_reads())
     
     # Clear all of the unaligned reads as they are no longer needed
     unaligned_reads_store.clear()
         
     # Compute or load in gene families
     output_files=[]
-    if args.input_format in ["fasta","fastq","sam","blastm8"]:
-        # Compute the gene families
-        message="Computing gene families ..."
-        logger.info(message)
-        print("\n"+message)
+    if args.input_format in ["fasta","fastq","sam","blastm8","alignmentstore"]:
+        from .quantify import families
         
-        families_file=families.gene_families(alignments,gene_scores,unaligned_reads_count)
-        output_files.append(families_file)
+        if not checkpoints.completed("gene_families"):
+            # Compute the gene families
+            message="Computing gene families ..."
+            logger.info(message)
+            print("\n"+message)
+        
+            families_file=families.gene_families(alignments,gene_scores,unaligned_reads_count,
+                gene_family_names)
     
-        start_time=timestamp_message("computing gene families",start_time)
+            start_time=timestamp_message("computing gene families",start_time,
+                {"genes": gene_scores.count_genes_for_bug("all"), "unaligned_reads": unaligned_reads_count})
+            
+            # Save the stores to resume from the end of this stage
+            checkpoints.save("gene_families", {"gene_scores": gene_scores,
+                "unaligned_reads_count": unaligned_reads_count, "families_file": families_file},
+                files=[families_file])
+        else:
+            families_file=state["families_file"]
+        output_files.append(families_file)
 
     elif args.input_format in ["genetable"]:
         # Load the gene scores
@@ -1028,7 +1444,8 @@ def main():
         
         unaligned_reads_count=gene_scores.add_from_file(args.input,id_mapping_file=args.id_mapping) 
         
-        start_time=timestamp_message("processing gene table",start_time)
+        start_time=timestamp_message("processing gene table",start_time,
+            {"genes": gene_scores.count_genes_for_bug("all")})
 
     # Handle input files of unknown formats
     else:
@@ -1043,14 +1460,33 @@ def main():
     print("\n"+message)
     pathways_and_reactions_store=modules.identify_reactions_and_pathways(
         gene_scores, reactions_database, pathways_database)
+    if config.profile_stages or config.trace_memory:
+        profiling.track_store("PathwaysAndReactions", pathways_and_reactions_store)
 
     # Compute pathway abundance and coverage
     abundance_file, coverage_file=modules.compute_pathways_abundance_and_coverage(
-        gene_scores, reactions_database, pathways_and_reactions_store, pathways_database, unaligned_reads_count)
+        gene_scores, reactions_database, pathways_and_reactions_store, pathways_database, unaligned_reads_count,
+        pathway_names)
     output_files.append(abundance_file)
     output_files.append(coverage_file)
+    if stored_alignments:
+        output_files.append(config.alignment_store_file)
 
-    start_time=timestamp_message("computing pathways",start_time)
+    start_time=timestamp_message("computing pathways",start_time,
+        {"pathways": pathways_and_reactions_store.count_pathways("all")})
+    
+    # Write the metrics for the run if set
+    if config.metrics_toggle == "on":
+        metrics.run_metrics.write(config.metrics_file, {"humann2_version": VERSION,
+            "sample": config.file_basename, "input": args.input, "input_format": args.input_format,
+            "threads": config.threads}, output_files)
+        output_files.append(config.metrics_file)
+        
+    # Stop sampling the resources and profiling
+    if config.resource_sampler_toggle == "on":
+        sampler.stop_run()
+    if config.profile_stages or config.trace_memory:
+        profiling.stop_run()
 
     message="\nOutput files created: \n" + "\n".join(output_files) + "\n"
     logger.info(message)
@@ -1063,3 +1499,307 @@ def main():
     if args.remove_temp_output:
         utilities.remove_directory(config.temp_dir)
         
+    return output_files
+
+# The settings and databases shared by all samples processed in batch mode
+batch_settings={}
+
+def get_config_settings():
+    """
+    Return a copy of all of the config settings
+    """
+    
+    config.load_user_edit_settings()
+    settings={}
+    for name, value in vars(config).items():
+        if (name.startswith("__") or inspect.ismodule(value) or inspect.isroutine(value) 
+            or isinstance(value, logging.Logger)):
+            continue
+        settings[name]=copy.deepcopy(value)
+        
+    return settings
+
+def set_config_settings(settings):
+    """
+    Set all of the config settings to those provided
+    """
+    
+    for name, value in settings.items():
+        setattr(config, name, copy.deepcopy(value))
+
+def read_input_list(input_list):
+    """
+    Return the input files from a file with one input file per line
+    or all of the files in a directory
+    """
+    
+    input_files=[]
+    if os.path.isdir(input_list):
+        for file in sorted(os.listdir(input_list)):
+            file=os.path.join(input_list, file)
+            if not os.path.basename(file).startswith(".") and os.path.isfile(file):
+                input_files.append(os.path.abspath(file))
+    else:
+        utilities.file_exists_readable(input_list)
+        with open(input_list, "rt") as file_handle:
+            for line in file_handle:
+                line=line.strip()
+                if line and not line.startswith("#"):
+                    input_files.append(os.path.abspath(line))
+                    
+    if not input_files:
+        sys.exit("CRITICAL ERROR: No input files found in the input list: " + input_list)
+        
+    # Check the samples will not write to the same output files
+    basenames={}
+    for file in input_files:
+        basename=get_input_file_basename(file)
+        if basename in basenames:
+            sys.exit("CRITICAL ERROR: The input files " + basenames[basename] + " and " + file +
+                " would write to the same output files. Please rename one of the files.")
+        basenames[basename]=file
+                    
+    return input_files
+
+def set_batch_settings(settings):
+    """
+    Set the settings and databases shared by the samples processed in batch mode
+    """
+    
+    batch_settings.update(settings)
+
+def process_batch_sample(input_file):
+    """
+    Process an input file from the list with the shared databases
+    Return the input file, the output files created, and an error message (if any)
+    """
+    
+    # Start from the same config settings for each sample
+    set_config_settings(batch_settings["config"])
+    args=copy.copy(batch_settings["args"])
+    args.input=input_file
+    args.input_list=None
+    args.o_log=None
+    
+    try:
+        update_sample_configuration(args)
+        check_requirements(args)
+        config.log_settings()
+        output_files=run_sample(args, *batch_settings["databases"])
+    except SystemExit as e:
+        return input_file, [], str(e)
+    except Exception:
+        # return any other error so only this sample fails (and not the whole batch)
+        message=traceback.format_exc()
+        logger.error("Unable to process sample " + input_file + "\n" + message)
+        return input_file, [], message
+    
+    return input_file, output_files, ""
+
+def load_shared_databases():
+    """
+    Load the databases and name mappings shared by all samples
+    """
+    
+    if config.pathways_database_part1:
+        utilities.file_exists_readable(config.pathways_database_part1)
+    utilities.file_exists_readable(config.pathways_database_part2)
+    reactions_database, pathways_database=load_databases()
+    gene_family_names=store.Names(config.gene_family_name_mapping_file)
+    pathway_names=store.Names(config.pathway_name_mapping_file)
+    
+    return reactions_database, pathways_database, gene_family_names, pathway_names
+
+def process_input_list(args, databases=None):
+    """
+    Process all of the input files in the list with the databases loaded once
+    Samples are processed in a pool of processes which share the databases
+    Return the list of output files created
+    """
+    
+    if args.output_basename:
+        sys.exit("CRITICAL ERROR: The option --output-basename can not be used with --input-list.")
+        
+    input_files=read_input_list(args.input_list)
+    output_dir=create_output_directory(args.output)
+    
+    log_file=args.o_log or os.path.join(output_dir, config.batch_log_file)
+    configure_logging(log_file, args.log_level)
+    logger.info("Running humann2 v"+VERSION+" on "+str(len(input_files))+" input files")
+    
+    # Load the databases once for all samples
+    if databases is None:
+        databases=load_shared_databases()
+    
+    settings={"args": args, "config": get_config_settings(), "databases": databases}
+    set_batch_settings(settings)
+    
+    processes=max(1,min(config.batch_processes, len(input_files)))
+    if processes > 1:
+        # Fork the processes so the databases are shared (copy-on-write)
+        # If fork is not available the databases are copied to each process
+        try:
+            context=multiprocessing.get_context("fork")
+            pool=context.Pool(processes)
+        except (AttributeError, ValueError):
+            pool=multiprocessing.Pool(processes, set_batch_settings, (settings,))
+        results=pool.map(process_batch_sample, input_files, chunksize=1)
+        pool.close()
+        pool.join()
+    else:
+        results=[process_batch_sample(file) for file in input_files]
+        
+    # Write the summary to the batch log
+    configure_logging(log_file, args.log_level, filemode="a")
+    errors=[]
+    all_output_files=[]
+    for input_file, output_files, error in results:
+        if error:
+            errors.append("Error processing " + input_file + " :\n" + error)
+        else:
+            logger.info("Output files created for " + input_file + " :\n" + "\n".join(output_files))
+            all_output_files+=output_files
+            
+    message=("\nProcessed " + str(len(results)-len(errors)) + " of " + str(len(results)) + 
+        " input files\n")
+    logger.info(message)
+    print(message)
+    
+    if errors:
+        message="CRITICAL ERROR: Unable to process all input files.\n\n"+"\n\n".join(errors)
+        logger.critical(message)
+        sys.exit(message)
+        
+    return all_output_files
+
+# The settings and databases loaded by the server
+server_settings={}
+
+def database_settings():
+    """
+    Return the settings which select the databases and name mappings
+    """
+    
+    return (config.pathways_database_part1, config.pathways_database_part2,
+        config.gene_family_name_mapping_file, config.pathway_name_mapping_file)
+
+def run_server_job(request):
+    """
+    Run a job submitted to the server
+    The databases loaded by the server are used unless the job selects other databases
+    Return the list of output files created
+    """
+    
+    if request.get("cwd"):
+        os.chdir(request["cwd"])
+    
+    # Start from the server config settings for each job
+    set_config_settings(server_settings["config"])
+    args=parse_arguments(["humann2"]+list(request.get("args",[])))
+    
+    if args.serve or args.submit:
+        sys.exit("CRITICAL ERROR: The options --serve and --submit can not be used in a job.")
+    
+    update_configuration(args)
+    
+    databases=server_settings["databases"]
+    if database_settings() != server_settings["database_settings"]:
+        databases=None
+    
+    if args.input_list:
+        return process_input_list(args, databases)
+    
+    update_sample_configuration(args)
+    check_requirements(args)
+    config.log_settings()
+    
+    if databases is None:
+        databases=load_shared_databases()
+    
+    return run_sample(args, *databases)
+
+def serve_jobs(args):
+    """
+    Load the databases and run the jobs submitted to the server
+    """
+    
+    output_dir=os.getcwd()
+    if args.output:
+        output_dir=create_output_directory(args.output)
+    
+    log_file=args.o_log or os.path.join(output_dir, config.server_log_file)
+    configure_logging(log_file, args.log_level)
+    logger.info("Running humann2 v"+VERSION+" server")
+    
+    databases=load_shared_databases()
+    
+    from . import server
+    
+    if args.warm_cache:
+        server.warm_file_cache([config.nucleotide_database, config.protein_database])
+        
+    server_settings.update({"config": get_config_settings(), "databases": databases,
+        "database_settings": database_settings()})
+    
+    server.serve(args.serve, run_server_job, config.batch_processes, VERSION)
+
+def remove_option(argv, option):
+    """
+    Return the arguments without the option and its value
+    """
+    
+    new_argv=[]
+    skip=False
+    for arg in argv:
+        if skip:
+            skip=False
+        elif arg == option:
+            skip=True
+        elif not arg.startswith(option+"="):
+            new_argv.append(arg)
+    
+    return new_argv
+
+def main():
+    global startup_end_time
+    
+    # Parse arguments from command line
+    args=parse_arguments(sys.argv)
+    
+    # Submit the job to the server
+    if args.submit:
+        from . import server
+        server.submit(args.submit, remove_option(sys.argv[1:], "--submit"), args.verbose)
+        return
+    
+    # Update the configuration settings based on the arguments
+    update_configuration(args)
+    
+    # Record the end of the startup for the metrics
+    startup_end_time=time.time()
+    
+    # Run as a server
+    if args.serve:
+        serve_jobs(args)
+        return
+    
+    # Process all of the input files in the list
+    if args.input_list:
+        process_input_list(args)
+        return
+    
+    # Update the configuration settings for the input file
+    update_sample_configuration(args)
+    
+    # Check for required files, software, databases, and also permissions
+    check_requirements(args)
+    
+    # Write the config settings to the log file
+    config.log_settings()
+    
+    # Load the databases
+    reactions_database, pathways_database=load_databases()
+    
+    # Run the pipeline on the input file
+    run_sample(args, reactions_database, pathways_database)
+        
@@ -0,0 +1,282 @@
+"""
+HUMAnN2: metrics module
+Record the performance metrics for each stage of a run
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+The metrics for each stage are the wall and cpu time (of this process and of the
+child processes finished during the stage), the peak resident set size of this process
+and of the child processes, the bytes read and written (from /proc/self/io, which
+includes the child processes once finished), and the records counted for the stage.
+The peak resident set size of this process is reset at the start of each stage where
+supported (linux), otherwise it is the peak of the run so far.
+The startup time is the seconds from the start of the process to the end of the
+startup (ie the time to load the modules and read the options), recorded for the
+first run in the process.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from . import utilities
+from . import checkpoint
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+METRICS_VERSION=1
+
+# the time this module was loaded (used if the process start time is not available)
+module_load_time=time.time()
+first_run=True
+
+def read_proc_file(file):
+    """
+    Return a dictionary of the values (as integers) from a /proc key/value file
+    """
+    
+    values={}
+    try:
+        with open(file) as file_handle:
+            for line in file_handle:
+                key, sep, value=line.partition(":")
+                try:
+                    values[key.strip()]=int(value.split()[0])
+                except (ValueError, IndexError):
+                    pass
+    except EnvironmentError:
+        pass
+    
+    return values
+
+def peak_rss():
+    """
+    Return the peak resident set size (in bytes) of this process
+    """
+    
+    # the status value is in kB and can be reset
+    status=read_proc_file("/proc/self/status")
+    if "VmHWM" in status:
+        return status["VmHWM"]*1024
+    
+    if resource:
+        # ru_maxrss is in kilobytes on linux and in bytes on mac os x
+        peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak*1024
+    
+    return None
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of this process (linux only)
+    """
+    
+    try:
+        with open("/proc/self/clear_refs","w") as file_handle:
+            file_handle.write("5")
+    except EnvironmentError:
+        pass
+
+def io_bytes():
+    """
+    Return the bytes read and written by this process (and finished child processes)
+    """
+    
+    io=read_proc_file("/proc/self/io")
+    return io.get("rchar"), io.get("wchar")
+
+def process_start_time():
+    """
+    Return the time this process started (from /proc on linux)
+    """
+    
+    try:
+        with open("/proc/self/stat") as file_handle:
+            # the fields after the command (which can include spaces) start with the state
+            start_ticks=int(file_handle.read().rpartition(")")[2].split()[19])
+        with open("/proc/uptime") as file_handle:
+            uptime=float(file_handle.read().split()[0])
+        return time.time()-uptime+start_ticks/float(os.sysconf("SC_CLK_TCK"))
+    except (EnvironmentError, ValueError, IndexError, AttributeError):
+        return module_load_time
+
+def difference(end, start):
+    """
+    Return the difference of the two values or None if either is not available
+    """
+    
+    if end is None or start is None:
+        return None
+    return end-start
+
+class Metrics(object):
+    """
+    Records the performance metrics for each stage of a run
+    """
+    
+    def __init__(self, enabled=True, startup_time=None):
+        self.__enabled=enabled
+        self.__startup_time=startup_time
+        self.__stages=[]
+        self.__run_start=None
+        self.__stage_start=None
+        
+    def snapshot(self):
+        """
+        Return the current wall time, cpu time, and io counts
+        """
+        
+        times=os.times()
+        with utilities.process_usage_totals_lock:
+            child_cpu_time=utilities.process_usage_totals["cpu_time"]
+            child_processes=utilities.process_usage_totals["processes"]
+        bytes_read, bytes_written=io_bytes()
+        return {"wall_time": time.time(), "cpu_time": times[0]+times[1],
+            "child_cpu_time": child_cpu_time, "child_processes": child_processes,
+            "bytes_read": bytes_read, "bytes_written": bytes_written}
+        
+    def start(self):
+        """
+        Start recording the metrics for the run
+        """
+        
+        if not self.__enabled:
+            return
+        
+        self.__stages=[]
+        utilities.pop_recent_process_peak_rss()
+        reset_peak_rss()
+        self.__run_start=self.__stage_start=self.snapshot()
+        
+    def measure(self, start):
+        """
+        Return the metrics from the start snapshot to now
+        """
+        
+        end=self.snapshot()
+        return {"wall_time": round(end["wall_time"]-start["wall_time"],3),
+            "cpu_time": round(end["cpu_time"]-start["cpu_time"],3),
+            "child_cpu_time": round(end["child_cpu_time"]-start["child_cpu_time"],3),
+            "child_processes": end["child_processes"]-start["child_processes"],
+            "bytes_read": difference(end["bytes_read"], start["bytes_read"]),
+            "bytes_written": difference(end["bytes_written"], start["bytes_written"])}
+        
+    def stage_completed(self, stage, counts=None):
+        """
+        Record the metrics for the stage completed and start the next stage
+        """
+        
+        if not self.__enabled:
+            return
+        
+        if not self.__stage_start:
+            self.start()
+        
+        metrics={"stage": stage}
+        metrics.update(self.measure(self.__stage_start))
+        metrics["peak_rss"]=peak_rss()
+        metrics["child_peak_rss"]=utilities.pop_recent_process_peak_rss()
+        metrics["counts"]=counts or {}
+        self.__stages.append(metrics)
+        
+        reset_peak_rss()
+        self.__stage_start=self.snapshot()
+        
+    def stages(self):
+        """
+        Return the metrics for the stages completed
+        """
+        
+        return self.__stages
+        
+    def report(self, info=None, output_files=None):
+        """
+        Return the metrics report for the run
+        """
+        
+        totals=self.measure(self.__run_start) if self.__run_start else {}
+        totals["peak_rss"]=max([stage["peak_rss"] or 0 for stage in self.__stages]+[0]) or peak_rss()
+        # use the stages as the process totals include the prior runs in this process
+        totals["child_peak_rss"]=max([stage["child_peak_rss"] for stage in self.__stages]+[0])
+        
+        output_file_sizes={}
+        for file in output_files or []:
+            try:
+                output_file_sizes[os.path.basename(file)]=os.path.getsize(file)
+            except EnvironmentError:
+                pass
+        
+        report={"version": METRICS_VERSION}
+        report.update(info or {})
+        report["startup_time"]=self.__startup_time
+        report["totals"]=totals
+        report["stages"]=self.__stages
+        report["output_files"]=output_file_sizes
+        return report
+        
+    def write(self, file, info=None, output_files=None):
+        """
+        Write the metrics report for the run to a json file
+        """
+        
+        if not self.__enabled:
+            return
+        
+        try:
+            with checkpoint.atomic_write(file) as file_handle:
+                file_handle.write(json.dumps(self.report(info, output_files), indent=2, 
+                    sort_keys=True).encode("utf-8"))
+        except EnvironmentError:
+            logger.warning("Unable to write metrics file: " + file)
+
+# the metrics for the run in progress
+run_metrics=Metrics(enabled=False)
+
+def start_run(enabled, startup_end=None):
+    """
+    Start recording the metrics for a new run (with the time the startup ended)
+    """
+    
+    global run_metrics, first_run
+    startup_time=None
+    if first_run:
+        if startup_end is None:
+            startup_end=time.time()
+        startup_time=round(max(0, startup_end-process_start_time()),3)
+        first_run=False
+    run_metrics=Metrics(enabled=enabled, startup_time=startup_time)
+    run_metrics.start()
+    return run_metrics
+
+def stage_completed(stage, counts=None):
+    """
+    Record the metrics for the stage completed in the run in progress
+    """
+    
+    run_metrics.stage_completed(stage, counts)
@@ -0,0 +1,376 @@
+"""
+HUMAnN2: profiling module
+Profile the stages of a run with cProfile and trace the memory with tracemalloc
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+The stages profiled are named from the tasks reported as completed by humann2 (ie
+"nucleotide alignment post-processing" is "nucleotide_alignment_post-processing").
+The profiler only runs for a stage if it can be one of those selected (from the stages
+which can follow the stage completed, as some are skipped depending on the input and
+settings) and the stats are written for those selected to
+$TEMP_DIR/profiles/$SAMPLENAME_$STAGE.pstats.
+The per-bug pathways functions, which are run in a pool of processes, are profiled
+with the "computing_pathways" stage with one stats file for each bug.
+
+When tracing memory, a tracemalloc snapshot is taken at the end of each stage and the
+top allocation sites for the stage and the sizes of the stores are written to the log.
+"""
+
+import os
+import re
+import sys
+import logging
+import weakref
+
+try:
+    import cProfile
+except ImportError:
+    cProfile = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from . import config
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+PROFILE_EXTENSION=".pstats"
+PROFILE_FOLDER="profiles"
+TOP_ALLOCATIONS=10
+
+# the stages in the order they are run
+STAGES=config.profile_stage_choices
+ALL_STAGES=config.profile_all_stages
+
+# the stages which can run next after each stage is completed
+# (any stage can run first as it depends on the input format and the checkpoints)
+NEXT_STAGES={"prescreen":["custom_database_creation","duplicate_read_collapsing",
+        "nucleotide_alignment","translated_alignment","computing_gene_families"],
+    "custom_database_creation":["duplicate_read_collapsing","database_index",
+        "translated_alignment","computing_gene_families"],
+    "duplicate_read_collapsing":["database_index","nucleotide_alignment",
+        "translated_alignment","computing_gene_families"],
+    "database_index":["nucleotide_alignment"],
+    "nucleotide_alignment":["nucleotide_alignment_post-processing"],
+    "nucleotide_alignment_post-processing":["translated_alignment","computing_gene_families"],
+    "translated_alignment":["translated_alignment_post-processing"],
+    "translated_alignment_post-processing":["computing_gene_families"],
+    "alignment_post-processing":["computing_gene_families"],
+    "alignment_store_post-processing":["computing_gene_families"],
+    "computing_gene_families":["computing_pathways"],
+    "processing_gene_table":["computing_pathways"],
+    "computing_pathways":[]}
+BY_BUG_STAGE="computing_pathways"
+
+def stage_name(task):
+    """
+    Return the name of the stage for the task
+    """
+    
+    return task.strip().lower().replace(" ","_")
+
+def profile_folder():
+    """
+    Return the folder for the profile stats
+    """
+    
+    return os.path.join(config.temp_dir, PROFILE_FOLDER)
+
+def profile_file(name):
+    """
+    Return the profile stats file for the name (removing characters not allowed in file names)
+    """
+    
+    name=re.sub("[^A-Za-z0-9._-]","_",name)
+    return os.path.join(profile_folder(), config.file_basename + "_" + name + PROFILE_EXTENSION)
+
+def create_profile_folder():
+    """
+    Create the folder for the profile stats if it does not exist
+    """
+    
+    try:
+        os.makedirs(profile_folder())
+    except EnvironmentError:
+        # the folder might have been created by another process
+        if not os.path.isdir(profile_folder()):
+            raise
+
+def stage_selected(stage):
+    """
+    Return true if the stage is selected to be profiled
+    """
+    
+    return ALL_STAGES in config.profile_stages or stage in config.profile_stages
+
+def next_stage_selected(stage):
+    """
+    Return true if the stage which runs after the stage completed (None at the start
+    of the run) can be one of those selected to be profiled
+    """
+    
+    return any(stage_selected(next_stage) for next_stage in NEXT_STAGES.get(stage, STAGES))
+
+def object_size(obj):
+    """
+    Return the size in bytes of the object including all of the objects it contains
+    """
+    
+    seen=set()
+    objects=[obj]
+    size=0
+    while objects:
+        obj=objects.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size+=sys.getsizeof(obj)
+        
+        if isinstance(obj, dict):
+            objects.extend(obj.keys())
+            objects.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            objects.extend(obj)
+        elif hasattr(obj, "__dict__") and not isinstance(obj, type):
+            objects.append(obj.__dict__)
+    
+    return size
+
+def megabytes(size):
+    """
+    Return the size in megabytes formatted for the log
+    """
+    
+    return str(round(size / (1024.0*1024.0), 2)) + " MB"
+
+class StageProfiler(object):
+    """
+    Profiles each stage and traces the memory at the end of each stage
+    """
+    
+    def __init__(self, profile=True, trace_memory=False):
+        self.__profile=profile and bool(cProfile)
+        self.__trace_memory=trace_memory and bool(tracemalloc)
+        self.__pid=os.getpid()
+        self.__profiler=None
+        self.__snapshot=None
+        self.__stores={}
+        
+        if profile and not cProfile:
+            logger.warning("Unable to profile the stages as cProfile is not available")
+        if trace_memory and not tracemalloc:
+            logger.warning("Unable to trace memory as tracemalloc is not available")
+        
+    def active(self):
+        """
+        Return true if the stages are profiled in this process
+        """
+        
+        return bool(self.__profiler) and self.__pid == os.getpid()
+        
+    def start(self):
+        """
+        Start profiling and tracing the memory for the first stage
+        """
+        
+        if self.__profile:
+            self.start_profile(None)
+            
+        if self.__trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            self.__snapshot=self.take_snapshot()
+            
+    def track_store(self, name, store):
+        """
+        Add a store to report the size of at the end of each stage
+        """
+        
+        try:
+            self.__stores[name]=weakref.ref(store)
+        except TypeError:
+            self.__stores[name]=lambda: store
+        
+    def take_snapshot(self):
+        """
+        Return a tracemalloc snapshot without the allocations of tracemalloc and cProfile
+        """
+        
+        filters=[tracemalloc.Filter(False, tracemalloc.__file__)]
+        if cProfile:
+            filters.append(tracemalloc.Filter(False, cProfile.__file__))
+        return tracemalloc.take_snapshot().filter_traces(filters)
+        
+    def start_profile(self, stage):
+        """
+        Start profiling the next stage if it can be one of those selected
+        """
+        
+        self.__profiler=None
+        if next_stage_selected(stage):
+            self.__profiler=cProfile.Profile()
+            self.__profiler.enable()
+        
+    def write_profile(self, stage):
+        """
+        Write the stats for the stage profiled (if selected)
+        """
+        
+        self.__profiler.disable()
+        if stage_selected(stage):
+            file=profile_file(stage)
+            try:
+                create_profile_folder()
+                self.__profiler.dump_stats(file)
+                logger.info("Wrote profile for " + stage + " to: " + file)
+            except EnvironmentError:
+                logger.warning("Unable to write profile: " + file)
+        
+    def report_memory(self, stage):
+        """
+        Write the top allocation sites for the stage and the sizes of the stores to the log
+        """
+        
+        snapshot=self.take_snapshot()
+        current, peak=tracemalloc.get_traced_memory()
+        logger.info("MEMORY: \t" + stage + " \t:\t current " + megabytes(current) + 
+            " \t peak " + megabytes(peak))
+        
+        for statistic in snapshot.compare_to(self.__snapshot, "lineno")[:TOP_ALLOCATIONS]:
+            frame=statistic.traceback[0]
+            logger.info("MEMORY: \t" + stage + " \t:\t " + frame.filename + ":" + str(frame.lineno) + 
+                " \t " + megabytes(statistic.size) + " \t (" + megabytes(statistic.size_diff) + 
+                " in stage) \t " + str(statistic.count) + " blocks")
+            
+        for name in sorted(self.__stores):
+            store=self.__stores[name]()
+            if store is not None:
+                logger.info("MEMORY: \t" + stage + " \t:\t store " + name + " \t " + 
+                    megabytes(object_size(store)))
+                
+        self.__snapshot=snapshot
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        
+    def stage_completed(self, task):
+        """
+        Write the profile and memory report for the stage completed
+        """
+        
+        stage=stage_name(task)
+        if self.__profile and self.__pid == os.getpid():
+            if self.__profiler:
+                self.write_profile(stage)
+            self.start_profile(stage)
+        if self.__trace_memory and self.__snapshot:
+            self.report_memory(stage)
+        
+    def stop(self):
+        """
+        Stop profiling and tracing the memory
+        """
+        
+        if self.active():
+            self.__profiler.disable()
+        self.__profiler=None
+        
+        if self.__trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.__snapshot=None
+        self.__stores={}
+
+# the profiler for the run in progress
+run_profiler=None
+
+def start_run(profile_stages, trace_memory):
+    """
+    Start profiling the stages for a new run (stopping the profiler for the prior run)
+    """
+    
+    global run_profiler
+    stop_run()
+    
+    if not profile_stages and not trace_memory:
+        return None
+    
+    run_profiler=StageProfiler(profile=bool(profile_stages), trace_memory=trace_memory)
+    run_profiler.start()
+    return run_profiler
+
+def track_store(name, store):
+    """
+    Add a store to report the size of when tracing memory
+    """
+    
+    if run_profiler:
+        run_profiler.track_store(name, store)
+
+def stage_completed(task):
+    """
+    Write the profile and memory report for the stage completed in the run in progress
+    """
+    
+    if run_profiler:
+        run_profiler.stage_completed(task)
+
+def stop_run():
+    """
+    Stop profiling the run in progress
+    """
+    
+    global run_profiler
+    if run_profiler:
+        run_profiler.stop()
+        run_profiler=None
+
+def profile_call(name, function, *args):
+    """
+    Return the result of the function, profiled if the per-bug functions are selected
+    The call is not profiled on its own if the stage is already profiled in this process
+    """
+    
+    if not cProfile or not stage_selected(BY_BUG_STAGE) or (run_profiler and run_profiler.active()):
+        return function(*args)
+    
+    profiler=cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # another profiler is active in this process
+        return function(*args)
+    
+    try:
+        result=function(*args)
+    finally:
+        profiler.disable()
+    
+    file=profile_file(name)
+    try:
+        create_profile_folder()
+        profiler.dump_stats(file)
+    except EnvironmentError:
+        logger.warning("Unable to write profile: " + file)
+        
+    return result
@@ -27,8 +27,12 @@ import math
 import re
 import sys
 
+# The max number of values to memoize
+CACHE_MAX_SIZE = 100000
+_cache = {}
+
 # Adapted from samtools; will be occasionally inaccurate due to iteration stoppage
-def incomplete_gamma1( dS, dZ ):
+def incomplete_gamma1( dS, dZ, dLogGamma=None ):
     
     dS, dZ = (float(d) for d in (dS, dZ))
     dSum = dX = 1
@@ -37,7 +41,12 @@ def incomplete_gamma1( dS, dZ ):
         dSum += dX
         if ( dX / dSum ) < 1e-14:
             break
-    return ( math.exp( ( dS * math.log( dZ ) ) - dZ - _log_gamma( dS + 1 ) + math.log( dSum ) ) if dZ else 0 )
+    if not dZ:
+        return 0
+    # the log gamma term only depends on dS so it can be provided
+    if dLogGamma is None:
+        dLogGamma = _log_gamma( dS + 1 )
+    return math.exp( ( dS * math.log( dZ ) ) - dZ - dLogGamma + math.log( dSum ) )
 
 def _log_gamma( dZ ):
     
@@ -90,3 +99,26 @@ def chi2cdf( dX, dK ):
         return dRet
     return incomplete_gamma2( dK, dX )
 
+def chi2cdf_batch( adX, dK ):
+    """
+    Return the chi2cdf for each of the values with the same degrees of freedom
+    The log gamma term is computed once for all values and results are memoized
+    """
+    
+    dS = dK / 2
+    dLogGamma = None
+    adRet = []
+    for dX in adX:
+        dRet = _cache.get( ( dX, dK ) )
+        if dRet is None:
+            dZ = dX / 2
+            if dZ and dLogGamma is None:
+                dLogGamma = _log_gamma( float(dS) + 1 )
+            dRet = incomplete_gamma1( dS, dZ, dLogGamma )
+            if abs( dRet ) == float("Inf"):
+                dRet = incomplete_gamma2( dS, dZ )
+            if len( _cache ) >= CACHE_MAX_SIZE:
+                _cache.clear()
+            _cache[( dX, dK )] = dRet
+        adRet.append( dRet )
+    return adRet
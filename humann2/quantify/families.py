@@ -34,61 +34,56 @@ from .. import store
 # name global logging instance
 logger=logging.getLogger(__name__)
 
-def gene_families(alignments,gene_scores,unaligned_reads_count):
+def gene_families_rows(gene_scores,unaligned_reads_count,gene_names):
     """
-    Compute the gene families from the alignments
+    Yield the rows (gene name, bug, score) of the gene families output file
     """
     
-    logger.debug("Compute gene families")
-    
-    # Compute scores for each gene family for each bug set
-    alignments.convert_alignments_to_gene_scores(gene_scores)
-        
-    # Process the gene id to names mappings
-    gene_names=store.Names(config.gene_family_name_mapping_file)
-     
-    delimiter=config.output_file_column_delimiter
-    category_delimiter=config.output_file_category_delimiter     
-
-    # Write the scores ordered with the top first
-    column_name=config.file_basename+"_Abundance-RPKs"
-    if config.remove_column_description_output:
-        column_name=config.file_basename
-    tsv_output=["# Gene Family"+delimiter+column_name]
-    
     # Add the unaligned reads count
-    tsv_output.append(config.unmapped_gene_name+delimiter+utilities.format_float_to_string(unaligned_reads_count))  
+    yield (config.unmapped_gene_name, None, unaligned_reads_count)
 
     # Print out the gene families with those with the highest scores first
-    for gene in gene_scores.gene_list_sorted_by_score("all"):
+    sorted_genes=gene_scores.gene_list_sorted_by_score("all")
+    
+    # Look up the names for all of the genes at once
+    sorted_gene_names=gene_names.get_names(sorted_genes)
+    
+    for gene in sorted_genes:
         all_score=gene_scores.get_score("all",gene)
         if all_score>0:
-            gene_name=gene_names.get_name(gene)
+            gene_name=sorted_gene_names[gene]
             # Print the computation of all bugs for gene family
-            tsv_output.append(gene_name+delimiter+utilities.format_float_to_string(all_score))
+            yield (gene_name, None, all_score)
             # Process and print per bug if selected
             if not config.remove_stratified_output:
                 # Print scores per bug for family ordered with those with the highest values first
                 scores_by_bug=gene_scores.get_scores_for_gene_by_bug(gene)
                 for bug in utilities.double_sort(scores_by_bug):
                     if scores_by_bug[bug]>0:
-                        tsv_output.append(gene_name+category_delimiter+bug+delimiter
-                            +utilities.format_float_to_string(scores_by_bug[bug]))       
-        
-    if config.output_format=="biom":
-        # Open a temp file if a conversion to biom is selected
-        tmpfile=utilities.unnamed_temp_file()
-        file_handle=open(tmpfile,'w')
-        file_handle.write("\n".join(tsv_output))
-        file_handle.close()
-        
-        utilities.tsv_to_biom(tmpfile,config.genefamilies_file,"Gene")
+                        yield (gene_name, bug, scores_by_bug[bug])
+
+def gene_families(alignments,gene_scores,unaligned_reads_count,gene_names=None):
+    """
+    Compute the gene families from the alignments
+    Use the gene names if provided or read them from the mapping file
+    """
+    
+    logger.debug("Compute gene families")
+    
+    # Compute scores for each gene family for each bug set
+    alignments.convert_alignments_to_gene_scores(gene_scores)
         
-    else:
-        # Write output as tsv format
-        file_handle = open(config.genefamilies_file, "w")
-        file_handle.write("\n".join(tsv_output))
-        file_handle.close()
+    # Process the gene id to names mappings
+    if gene_names is None:
+        gene_names=store.Names(config.gene_family_name_mapping_file)
+     
+    # Write the scores ordered with the top first
+    column_name=config.file_basename+"_Abundance-RPKs"
+    if config.remove_column_description_output:
+        column_name=config.file_basename
+    
+    utilities.write_table(config.genefamilies_file, "# Gene Family", column_name, 
+        gene_families_rows(gene_scores,unaligned_reads_count,gene_names), "Gene")
 
     return config.genefamilies_file
 
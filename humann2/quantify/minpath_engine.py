@@ -0,0 +1,461 @@
+"""
+HUMAnN2: minpath_engine module
+Identify the minimal set of pathways for the reactions found (MinPath) in process
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+This follows the "-any" mode of MinPath12hmp.py. The integer program solved
+by glpsol (select the fewest pathways so each reaction found is in at least
+one selected pathway) is a set cover which is solved here with a branch and
+bound after removing the essential pathways and dominated rows and columns.
+The pathways with at least half of their reactions found are then added back
+as is done by MinPath.
+
+The pathways selected depend only on the set of reactions found (not their
+abundances) so the results are stored in a cache (a sqlite3 file in the cache
+directory) keyed by the reactions, the pathways database, and the engine.
+"""
+
+import os
+import time
+import json
+import hashlib
+import logging
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+from .. import config
+from .. import scheduler
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+# the map shared with the processes which identify the pathways for each bug
+_pathway_map=None
+
+class PathwayMap(object):
+    """
+    Holds the pathways to reactions map indexed in both directions
+    Pathways are referenced by their index in the order of the map
+    """
+
+    def __init__(self, database):
+        """
+        Read the map from the flat database (one pathway per line followed by reactions)
+        """
+
+        self.pathways=[]
+        self.pathway_reactions=[]
+        self.reaction_pathways={}
+
+        pathway_index={}
+        for line in database.split("\n"):
+            if line.startswith("#"):
+                continue
+            data=line.strip().split()
+            if len(data) < 2:
+                continue
+            pathway=data[0]
+            if not pathway in pathway_index:
+                pathway_index[pathway]=len(self.pathways)
+                self.pathways.append(pathway)
+                self.pathway_reactions.append([])
+            index=pathway_index[pathway]
+            for reaction in data[1:]:
+                pathways=self.reaction_pathways.setdefault(reaction,[])
+                # the same pathway and reaction could be listed multiple times
+                if not index in pathways:
+                    pathways.append(index)
+                    self.pathway_reactions[index].append(reaction)
+
+    def find_pathways(self, reaction):
+        """
+        Return the indexes of the pathways which include the reaction
+        """
+
+        return self.reaction_pathways.get(reaction,[])
+
+def minimum_set_cover(sets, max_nodes=None):
+    """
+    Return the smallest list of keys of the sets (a dictionary of sets of items)
+    which together include all of the items
+    Ties are resolved in the order of the keys
+    """
+
+    if max_nodes is None:
+        max_nodes=config.minpath_max_nodes
+
+    sets=dict((key, set(items)) for key, items in sets.items() if items)
+    items_to_keys={}
+    for key in sorted(sets):
+        for item in sets[key]:
+            items_to_keys.setdefault(item,[]).append(key)
+
+    selected=[]
+    while items_to_keys:
+        changed=False
+
+        # select the sets which are the only ones to include an item
+        for item in sorted(items_to_keys):
+            if not item in items_to_keys:
+                continue
+            keys=items_to_keys[item]
+            if len(keys) == 1:
+                key=keys[0]
+                selected.append(key)
+                remove_items(sets, items_to_keys, list(sets[key]))
+                changed=True
+
+        # remove the sets which are included in another set
+        keys=sorted(sets, key=lambda key: (-len(sets[key]), key))
+        for i, key in enumerate(keys):
+            if not key in sets:
+                continue
+            for larger_key in keys[:i]:
+                if larger_key in sets and sets[key] <= sets[larger_key]:
+                    remove_set(sets, items_to_keys, key)
+                    changed=True
+                    break
+
+        # remove the items which are always included with another item
+        items=sorted(items_to_keys, key=lambda item: (len(items_to_keys[item]), item))
+        for i, item in enumerate(items):
+            if not item in items_to_keys:
+                continue
+            keys=set(items_to_keys[item])
+            for other_item in items[i+1:]:
+                if other_item in items_to_keys and keys.issubset(items_to_keys[other_item]):
+                    remove_items(sets, items_to_keys, [other_item])
+                    changed=True
+
+        if not changed:
+            break
+
+    # solve each group of sets which share items separately
+    for group in connected_sets(sets, items_to_keys):
+        selected+=branch_and_bound(dict((key, sets[key]) for key in group), max_nodes)
+
+    return sorted(selected)
+
+def remove_items(sets, items_to_keys, items):
+    """
+    Remove the items from the sets, removing the sets with no items remaining
+    """
+
+    for item in items:
+        for key in items_to_keys.pop(item,[]):
+            if key in sets:
+                sets[key].discard(item)
+                if not sets[key]:
+                    del sets[key]
+
+def remove_set(sets, items_to_keys, key):
+    """
+    Remove the set from the sets and from the items to sets index
+    """
+
+    for item in sets.pop(key):
+        items_to_keys[item].remove(key)
+
+def connected_sets(sets, items_to_keys):
+    """
+    Return the groups of keys of the sets which share items
+    """
+
+    groups=[]
+    found=set()
+    for key in sorted(sets):
+        if key in found:
+            continue
+        group=[]
+        queue=[key]
+        found.add(key)
+        while queue:
+            current=queue.pop()
+            group.append(current)
+            for item in sets[current]:
+                for other_key in items_to_keys[item]:
+                    if not other_key in found:
+                        found.add(other_key)
+                        queue.append(other_key)
+        groups.append(sorted(group))
+
+    return groups
+
+def branch_and_bound(sets, max_nodes):
+    """
+    Return the smallest list of keys of the sets which include all of the items
+    The items are stored as bits so the sets are unions of integers
+    """
+
+    keys=sorted(sets)
+    items=sorted(set(item for key in keys for item in sets[key]))
+    bits=dict((item, 1 << i) for i, item in enumerate(items))
+    masks=[sum(bits[item] for item in sets[key]) for key in keys]
+    item_sets=[[j for j, mask in enumerate(masks) if mask & (1 << i)] for i in range(len(items))]
+    all_items=(1 << len(items)) - 1
+    max_size=max(len(sets[key]) for key in keys)
+
+    # start with the greedy solution as the upper bound
+    best=[]
+    uncovered=all_items
+    while uncovered:
+        index=max(range(len(keys)), key=lambda j: (bin(masks[j] & uncovered).count("1"), -j))
+        best.append(index)
+        uncovered&=~masks[index]
+
+    nodes=[0]
+    def lower_bound(uncovered):
+        # items which do not share sets each require a different set
+        disjoint=0
+        remaining=uncovered
+        while remaining:
+            low_bit=remaining & -remaining
+            i=low_bit.bit_length()-1
+            disjoint+=1
+            for j in item_sets[i]:
+                remaining&=~masks[j]
+            remaining&=~low_bit
+        return max(disjoint, (bin(uncovered).count("1") + max_size - 1) // max_size)
+
+    def search(uncovered, chosen):
+        nodes[0]+=1
+        if not uncovered:
+            if len(chosen) < len(best):
+                best[:]=chosen
+            return
+        if nodes[0] > max_nodes:
+            return
+        if len(chosen) + lower_bound(uncovered) >= len(best):
+            return
+        # branch on the uncovered item which is in the fewest sets
+        remaining=uncovered
+        branch_item=None
+        while remaining:
+            low_bit=remaining & -remaining
+            i=low_bit.bit_length()-1
+            if branch_item is None or len(item_sets[i]) < len(item_sets[branch_item]):
+                branch_item=i
+            remaining&=~low_bit
+        options=sorted(item_sets[branch_item], key=lambda j: (-bin(masks[j] & uncovered).count("1"), j))
+        for j in options:
+            search(uncovered & ~masks[j], chosen + [j])
+
+    search(all_items, [])
+    if nodes[0] > max_nodes:
+        logger.warning("MinPath search stopped after " + str(max_nodes) +
+            " nodes, the pathways selected may not be the minimum set")
+
+    return [keys[j] for j in best]
+
+def identify_pathways(pathway_map, reaction_scores, allowed_pathways=None):
+    """
+    Return a dictionary of reactions to the pathways selected for the reactions found
+    If the set of allowed pathways is provided only those pathways are candidates
+    """
+
+    candidates={}
+    for reaction in reaction_scores:
+        for pathway in pathway_map.find_pathways(reaction):
+            if allowed_pathways is None or pathway_map.pathways[pathway] in allowed_pathways:
+                candidates.setdefault(pathway,set()).add(reaction)
+
+    # find the reactions which are in at least one candidate pathway
+    reactions_found=set()
+    for reactions in candidates.values():
+        reactions_found.update(reactions)
+
+    selected=set(minimum_set_cover(candidates))
+
+    # add back the pathways with most of their reactions found
+    for pathway, reactions in candidates.items():
+        if len(reactions) >= len(pathway_map.pathway_reactions[pathway]) * config.minpath_populate_fraction:
+            selected.add(pathway)
+
+    pathways={}
+    for pathway in sorted(selected):
+        for reaction in pathway_map.pathway_reactions[pathway]:
+            if reaction in reactions_found:
+                pathways.setdefault(reaction,[]).append(pathway_map.pathways[pathway])
+
+    return pathways
+
+def set_pathway_map(pathway_map):
+    """
+    Set the map used to identify the pathways for each bug
+    """
+
+    global _pathway_map
+    _pathway_map=pathway_map
+
+def identify_pathways_for_bug(args):
+    """
+    Identify the pathways (reaction scores and allowed pathways) using the map shared with the process
+    """
+
+    reaction_scores, allowed_pathways=args
+    return identify_pathways(_pathway_map, reaction_scores, allowed_pathways)
+
+def identify_pathways_by_bug(pathway_map, reaction_scores_by_bug, processes=None,
+    allowed_pathways_by_bug=None):
+    """
+    Identify the pathways for each bug, with the bugs run in a pool of processes
+    The candidate pathways for a bug are restricted if included in the allowed pathways
+    Return a dictionary of bugs with the reactions to pathways
+    """
+
+    if allowed_pathways_by_bug is None:
+        allowed_pathways_by_bug={}
+
+    bugs=sorted(reaction_scores_by_bug)
+    results=scheduler.process_map(identify_pathways_for_bug,
+        [(reaction_scores_by_bug[bug], allowed_pathways_by_bug.get(bug)) for bug in bugs], processes,
+        initializer=set_pathway_map, initargs=(pathway_map,))
+
+    return dict(zip(bugs, results))
+
+class MinPathCache(object):
+    """
+    Stores the pathways identified for each set of reactions across runs
+    The least recently used results are removed when the cache is full
+    """
+
+    def __init__(self, database, engine):
+        """
+        Open the cache for the flat pathways database and the engine
+        """
+
+        self.database_id=hashlib.sha1(database.encode("utf-8")).hexdigest()
+        self.engine=engine
+        self.hits=0
+        self.misses=0
+
+        self.cache_file=None
+        if not sqlite3 is None and config.minpath_cache_toggle == "on":
+            self.cache_file=os.path.join(config.cache_directory, config.database_cache_folder,
+                config.minpath_cache_file)
+            try:
+                if not os.path.isdir(os.path.dirname(self.cache_file)):
+                    os.makedirs(os.path.dirname(self.cache_file))
+                connection=self._connect()
+                connection.execute("CREATE TABLE IF NOT EXISTS results " + 
+                    "(key TEXT PRIMARY KEY, pathways TEXT, last_used REAL)")
+                connection.commit()
+                connection.close()
+            except (EnvironmentError, sqlite3.Error):
+                logger.warning("Unable to open MinPath cache: " + self.cache_file)
+                self.cache_file=None
+
+    def _connect(self):
+        """
+        Return a new connection to the cache
+        A connection is opened for each read and write so the cache can be used
+        by forked processes and concurrent runs (which wait on the sqlite3 locks)
+        """
+
+        return sqlite3.connect(self.cache_file, timeout=config.minpath_cache_timeout)
+
+    def key(self, reactions, allowed_pathways=None):
+        """
+        Return the key for the set of reactions (and the allowed pathways if restricted)
+        """
+
+        data=[str(config.minpath_cache_version), self.engine, self.database_id]+sorted(reactions)
+        if not allowed_pathways is None:
+            data+=["# allowed pathways"]+sorted(allowed_pathways)
+        data="\n".join(data)
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    def get(self, reactions_by_bug, allowed_pathways_by_bug=None):
+        """
+        Return a dictionary of the bugs with results stored for their reactions
+        """
+
+        results={}
+        if self.cache_file is None or not reactions_by_bug:
+            return results
+
+        if allowed_pathways_by_bug is None:
+            allowed_pathways_by_bug={}
+        keys=dict((bug, self.key(reactions, allowed_pathways_by_bug.get(bug))) 
+            for bug, reactions in reactions_by_bug.items())
+        stored={}
+        try:
+            connection=self._connect()
+            unique_keys=sorted(set(keys.values()))
+            for start in range(0, len(unique_keys), config.name_mapping_lookup_size):
+                subset=unique_keys[start:start+config.name_mapping_lookup_size]
+                query="SELECT key, pathways FROM results WHERE key IN ("+",".join(["?"]*len(subset))+")"
+                for key, pathways in connection.execute(query, subset):
+                    stored[key]=json.loads(pathways)
+            connection.executemany("UPDATE results SET last_used=? WHERE key=?",
+                [(time.time(), key) for key in stored])
+            connection.commit()
+            connection.close()
+        except (sqlite3.Error, ValueError):
+            logger.warning("Unable to read MinPath cache: " + self.cache_file)
+
+        for bug, key in keys.items():
+            if key in stored:
+                results[bug]=stored[key]
+                self.hits+=1
+            else:
+                self.misses+=1
+
+        return results
+
+    def add(self, reactions_by_bug, pathways_by_bug, allowed_pathways_by_bug=None):
+        """
+        Store the pathways identified for the reactions of each bug
+        """
+
+        if self.cache_file is None or not pathways_by_bug:
+            return
+
+        if allowed_pathways_by_bug is None:
+            allowed_pathways_by_bug={}
+        rows=[(self.key(reactions_by_bug[bug], allowed_pathways_by_bug.get(bug)), json.dumps(pathways_by_bug[bug], sort_keys=True), 
+            time.time()) for bug in sorted(pathways_by_bug)]
+        try:
+            connection=self._connect()
+            connection.executemany("INSERT OR REPLACE INTO results VALUES (?,?,?)", rows)
+            # remove the least recently used results if the cache is full
+            extra=connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]-config.minpath_cache_max_entries
+            if extra > 0:
+                connection.execute("DELETE FROM results WHERE key IN " +
+                    "(SELECT key FROM results ORDER BY last_used, rowid LIMIT ?)", (extra,))
+            connection.commit()
+            connection.close()
+        except sqlite3.Error:
+            logger.warning("Unable to write MinPath cache: " + self.cache_file)
+
+    def summary(self):
+        """
+        Return a string with the hit rate of the cache
+        """
+
+        total=self.hits+self.misses
+        rate=100.0*self.hits/total if total else 0.0
+        return ("MinPath cache hits: " + str(self.hits) + " of " + str(total) + " bugs (" +
+            str(round(rate,2)) + "%)")
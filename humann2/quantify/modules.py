@@ -32,10 +32,13 @@ import subprocess
 import logging
 
 from . import chi2cdf
+from . import minpath_engine
+from . import xipe_engine
 
 from .. import utilities
 from .. import config
 from .. import store
+from .. import scheduler
 
 # name global logging instance
 logger=logging.getLogger(__name__)
@@ -61,6 +64,16 @@ def minpath_command(reactions_file,metacyc_datafile):
     
     return tmpfile, command
 
+def file_size(file):
+    """
+    Return the size of the file in bytes (zero if not available)
+    """
+    
+    try:
+        return os.path.getsize(file)
+    except EnvironmentError:
+        return 0
+
 def xipe_command(infile):
     """
     Return the xipe command and the name of the output files
@@ -79,112 +92,276 @@ def xipe_command(infile):
     return stdout_file, stderr_file, command
     
 
-def identify_reactions_and_pathways(gene_scores, reactions_database, pathways_database):
+def reaction_scores_for_bug(gene_scores_for_bug, reactions_database):
     """
-    Identify the reactions and then pathways from the hits found
+    Compute the reaction scores for one bug from the gene scores
+    This is the product of the sparse gene scores and gene by reaction incidence
+    so only the reactions with genes that have scores are computed
+    Return a dictionary of the reaction scores (in sorted reaction order)
+    """
+    
+    # Find the reactions for the genes with scores
+    reactions=set()
+    for gene in gene_scores_for_bug:
+        reactions.update(reactions_database.find_reactions(gene))
+    
+    reaction_scores={}
+    for reaction in sorted(reactions):
+        # Add the scores in the order of the reaction gene list
+        abundance=0
+        for gene in reactions_database.find_genes(reaction):
+            abundance+=gene_scores_for_bug.get(gene,0)
+        
+        # Only store reactions where the abundance is greater than 0
+        if abundance>0:
+            reaction_scores[reaction]=abundance
+            
+    return reaction_scores
+
+def sum_reaction_scores(reaction_scores_by_bug):
+    """
+    Return the sum of the reaction scores for the bugs (in sorted reaction order)
+    """
+    
+    all_reaction_scores={}
+    for bug in sorted(reaction_scores_by_bug):
+        for reaction, abundance in reaction_scores_by_bug[bug].items():
+            all_reaction_scores[reaction]=all_reaction_scores.get(reaction,0)+abundance
+            
+    return dict((reaction, all_reaction_scores[reaction]) for reaction in sorted(all_reaction_scores))
+
+def compute_reaction_scores(gene_scores, reactions_database):
+    """
+    Compute the reaction scores for all bugs from the gene scores
+    Return a dictionary of bugs with the reaction scores (in sorted reaction order)
+    
+    The reaction scores are linear in the gene scores so if the "all" gene scores 
+    are the sum of the gene scores of the bugs (as computed from alignments) the "all" 
+    reaction scores are the sum of the reaction scores of the bugs. Otherwise (as for 
+    gene tables where the "all" scores are read from the file) the "all" reaction scores
+    are computed from the "all" gene scores. The pathways identified with MinPath and
+    the abundance and coverage (which use the median reaction score) are not linear 
+    so these are always computed for "all" separately.
+    """
+    
+    bugs=gene_scores.bug_list()
+    derive_all="all" in bugs and gene_scores.all_is_sum_of_bugs()
+    
+    reaction_scores={}
+    for bug in bugs:
+        if bug == "all" and derive_all:
+            continue
+        reaction_scores[bug]=reaction_scores_for_bug(gene_scores.scores_for_bug(bug), reactions_database)
+    
+    if derive_all:
+        logger.debug("Compute reaction scores for all bugs from the reaction scores of each bug")
+        reaction_scores["all"]=sum_reaction_scores(reaction_scores)
+                
+    return reaction_scores
+
+def read_minpath_details(details_file):
+    """
+    Return a dictionary of reactions to pathways from the MinPath details file
     """
+    
+    pathways={}
+    file_handle_read=open(details_file, "rt")
+    line=file_handle_read.readline()
+        
+    while line:
+        data=line.strip().split(config.minpath_pathway_delimiter)
+        if re.search(config.minpath_pathway_identifier,line):
+            current_pathway=data[config.minpath_pathway_index]
+        else:
+            current_reaction=data[config.minpath_reaction_index]
+            # store the pathway and reaction
+            pathways[current_reaction]=pathways.get(
+                current_reaction,[]) + [current_pathway]      
+        line=file_handle_read.readline()
+    
+    file_handle_read.close()
+    
+    return pathways
+
+def restrict_pathways_database(pathways_database_flat, allowed_pathways):
+    """
+    Return the flat pathways database with only the allowed pathways
+    """
+    
+    lines=[]
+    for line in pathways_database_flat.split("\n"):
+        data=line.strip().split()
+        if data and data[0] in allowed_pathways:
+            lines.append(line)
             
-    if config.minpath_toggle == "on":
-        # Write a flat reactions to pathways file
-        logger.debug("Write flat reactions to pathways file for Minpath")
-        pathways_database_file=utilities.unnamed_temp_file()
-        file_handle=open(pathways_database_file,"w")
-        file_handle.write(pathways_database.get_database())
+    return "\n".join(lines)
+
+def run_minpath(minpath_reactions, pathways_database_flat, allowed_pathways_by_bug=None):
+    """
+    Run minpath on the reactions for each bug with the external MinPath script
+    The pathways database for a bug is restricted if included in the allowed pathways
+    Return a dictionary of bugs with the reactions to pathways
+    """
+    
+    if allowed_pathways_by_bug is None:
+        allowed_pathways_by_bug={}
+    
+    # Write a flat reactions to pathways file
+    logger.debug("Write flat reactions to pathways file for Minpath")
+    pathways_database_file=utilities.unnamed_temp_file()
+    file_handle=open(pathways_database_file,"w")
+    file_handle.write(pathways_database_flat)
+    file_handle.close()
+    
+    minpath_results={}
+    minpath_tasks=[]
+    for bug in sorted(minpath_reactions):
+        # Create a temp file for the reactions results
+        reactions_file=utilities.unnamed_temp_file()
+        file_handle=open(reactions_file,"w")
+        for reaction in sorted(minpath_reactions[bug]):
+            file_handle.write(reaction+config.output_file_column_delimiter
+                +str(minpath_reactions[bug][reaction])+"\n")
         file_handle.close()
+        
+        # Write a restricted reactions to pathways file if the pathways for the bug are restricted
+        bug_pathways_database_file=pathways_database_file
+        if bug in allowed_pathways_by_bug:
+            bug_pathways_database_file=utilities.unnamed_temp_file()
+            file_handle=open(bug_pathways_database_file,"w")
+            file_handle.write(restrict_pathways_database(pathways_database_flat, 
+                allowed_pathways_by_bug[bug]))
+            file_handle.close()
+        
+        tmpfile, command=minpath_command(reactions_file, bug_pathways_database_file)
+        minpath_results[bug]=tmpfile
+        # the memory required scales with the size of the inputs
+        minpath_tasks.append(scheduler.command_task("MinPath " + bug, command,
+            memory=file_size(reactions_file)+file_size(bug_pathways_database_file)))
+            
+    # Run through the minpath tasks
+    scheduler.run_tasks(minpath_tasks)
+    
+    minpath_pathways={}
+    for bug in sorted(minpath_results):
+        tmpfile=minpath_results[bug]
+        # Process the minpath results
+        if os.path.isfile(tmpfile):
+            minpath_pathways[bug]=read_minpath_details(tmpfile)
+        else:
+            message="Empty results file from MinPath run for bug: " + bug
+            print(message)
+            logger.warning(message)
+            
+    return minpath_pathways
+
+def taxon_allowed_pathways(reactions, pathways_database):
+    """
+    Return a dictionary of bugs with the candidate pathways known for the genus or 
+    species of the bug (only includes those bugs which are restricted)
+    """
     
+    allowed_pathways_by_bug={}
+    if config.taxon_pathways == "off":
+        return allowed_pathways_by_bug
+    
+    taxon_pathways=store.TaxonPathways(config.taxon_pathways_file)
+    for bug in sorted(reactions):
+        # the pathways for all bugs and unclassified are not restricted
+        known_pathways=None
+        if bug != "all":
+            known_pathways=taxon_pathways.pathways_for_bug(bug, config.taxon_pathways)
+        if known_pathways is None:
+            logger.debug("Pathways not restricted by taxon for bug: " + bug)
+            continue
+        
+        candidates=set()
+        for reaction in reactions[bug]:
+            candidates.update(pathways_database.find_pathways(reaction))
+        
+        allowed_pathways_by_bug[bug]=set(pathway for pathway in candidates 
+            if taxon_pathways.allowed(pathway, known_pathways))
+        logger.info("Pruned " + str(len(candidates)-len(allowed_pathways_by_bug[bug])) + 
+            " of " + str(len(candidates)) + " candidate pathways by " + config.taxon_pathways + 
+            " for bug: " + bug)
+        
+    return allowed_pathways_by_bug
+
+def identify_reactions_and_pathways(gene_scores, reactions_database, pathways_database):
+    """
+    Identify the reactions and then pathways from the hits found
+    """
+            
     # Create a store for the pathways and reactions by bug
     pathways_and_reactions_store=store.PathwaysAndReactions()
     reactions={}
     
-    minpath_results={}
-    minpath_commands=[]
+    # Compute the reaction scores for all bugs at once
+    if reactions_database:
+        reactions=compute_reaction_scores(gene_scores, reactions_database)
+    
+    minpath_reactions={}
     # Run through each of the score sets by bug
     for bug in gene_scores.bug_list():
-        gene_scores_for_bug=gene_scores.scores_for_bug(bug)
-        
-        # Merge the gene scores to reaction scores   
         message="Compute reaction scores for bug: " + bug
         logger.info(message)
         
-        reactions[bug]={}
-        reactions_file_lines=[]
-        if reactions_database:
-            for reaction in sorted(reactions_database.reaction_list()):
-                genes_list=reactions_database.find_genes(reaction)
-                abundance=0
-                # Add the scores for each gene to the total score for the reaction
-                for gene in genes_list:
-                    abundance+=gene_scores_for_bug.get(gene,0)  
-                
-                # Only write out reactions where the abundance is greater than 0
-                if abundance>0: 
-                    reactions_file_lines.append(reaction+config.output_file_column_delimiter
-                        +str(abundance)+"\n")
-                    # Store the abundance data to compile with the minpath pathways
-                    reactions[bug][reaction]=abundance
-        else:
+        if not reactions_database:
+            gene_scores_for_bug=gene_scores.scores_for_bug(bug)
+            reactions[bug]={}
             for gene in gene_scores_for_bug:
                 score=gene_scores_for_bug[gene]
                 
                 if score>0:
-                    reactions_file_lines.append(gene+config.output_file_column_delimiter
-                        +str(score)+"\n")
                     # Store the abundance data to compile with the minpath pathways
                     reactions[bug][gene]=score
     
-        pathways={}
         # Run minpath if toggle on and also if there is more than one reaction   
-        if config.minpath_toggle == "on" and len(reactions_file_lines)>3:   
-    
-            # Create a temp file for the reactions results
-            reactions_file=utilities.unnamed_temp_file()
-            file_handle=open(reactions_file,"w")
-            file_handle.write("".join(reactions_file_lines))
-            file_handle.close()
-        
-            # Run minpath to identify the pathways
+        if config.minpath_toggle == "on" and len(reactions[bug])>3:   
             logger.info("Run MinPath on " + bug)
-                
-            tmpfile, command=minpath_command(reactions_file, pathways_database_file)
-            minpath_results[bug]=tmpfile
-            minpath_commands.append(command)
+            minpath_reactions[bug]=reactions[bug]
             
-    # Run through the minpath commands if minpath is to be run
-    if minpath_commands:
-        utilities.command_threading(config.threads,minpath_commands)
+    # Restrict the candidate pathways for each bug to those known for the taxon
+    allowed_pathways_by_bug=taxon_allowed_pathways(reactions, pathways_database)
+            
+    minpath_pathways={}
+    if minpath_reactions:
+        pathways_database_flat=pathways_database.get_database()
+        
+        # Use the pathways stored for the bugs with the same reactions as prior runs
+        minpath_cache=minpath_engine.MinPathCache(pathways_database_flat, config.minpath_engine)
+        minpath_pathways=minpath_cache.get(minpath_reactions, allowed_pathways_by_bug)
+        new_reactions=dict((bug, minpath_reactions[bug]) for bug in minpath_reactions 
+            if not bug in minpath_pathways)
+        
+        if not new_reactions:
+            new_pathways={}
+        elif config.minpath_engine == "internal":
+            # Index the reactions to pathways map once and run the bugs in parallel
+            logger.debug("Index reactions to pathways map for Minpath")
+            pathway_map=minpath_engine.PathwayMap(pathways_database_flat)
+            new_pathways=minpath_engine.identify_pathways_by_bug(pathway_map, new_reactions,
+                allowed_pathways_by_bug=allowed_pathways_by_bug)
+        else:
+            new_pathways=run_minpath(new_reactions, pathways_database_flat, allowed_pathways_by_bug)
+            
+        minpath_cache.add(new_reactions, new_pathways, allowed_pathways_by_bug)
+        minpath_pathways.update(new_pathways)
+        logger.info(minpath_cache.summary())
     
     # Link the pathways to reactions
     for bug in gene_scores.bug_list():
         pathways={}
-        if bug in minpath_results:
-            tmpfile=minpath_results[bug]
-            # Process the minpath results
-            if os.path.isfile(tmpfile):
-        
-                file_handle_read=open(tmpfile, "rt")
-                line=file_handle_read.readline()
-                    
-                while line:
-                    data=line.strip().split(config.minpath_pathway_delimiter)
-                    if re.search(config.minpath_pathway_identifier,line):
-                        current_pathway=data[config.minpath_pathway_index]
-                    else:
-                        current_reaction=data[config.minpath_reaction_index]
-                        # store the pathway and reaction
-                        pathways[current_reaction]=pathways.get(
-                            current_reaction,[]) + [current_pathway]      
-                    line=file_handle_read.readline()
-                
-                file_handle_read.close()
-            else:
-                message="Empty results file from MinPath run for bug: " + bug
-                print(message)
-                logger.warning(message)
-        else:
+        if bug in minpath_pathways:
+            pathways=minpath_pathways[bug]
+        elif not bug in minpath_reactions:
             # Add all pathways associated with each reaction if not using minpath
             for current_reaction in reactions.get(bug,{}):
-                pathways[current_reaction]=pathways.get(
-                    current_reaction, []) + pathways_database.find_pathways(current_reaction) 
+                current_pathways=pathways_database.find_pathways(current_reaction)
+                if bug in allowed_pathways_by_bug:
+                    current_pathways=[pathway for pathway in current_pathways 
+                        if pathway in allowed_pathways_by_bug[bug]]
+                pathways[current_reaction]=pathways.get(current_reaction, []) + current_pathways
          
         # Store the pathway abundance for each reaction
         for current_reaction in reactions.get(bug,{}):
@@ -197,54 +374,137 @@ def identify_reactions_and_pathways(gene_scores, reactions_database, pathways_da
    
     return pathways_and_reactions_store
 
+def xipe_pathways_to_remove(bug, pathways_coverage):
+    """
+    Return the pathways to remove for the bug, those with the lowest coverage
+    unless xipe finds they can be told from zero
+    """
+    
+    rng=xipe_engine.random_generator(config.xipe_seed, bug)
+    results, pathways_to_remove=xipe_engine.xipe(pathways_coverage, rng=rng)
+    
+    # Keep some of the pathways to remove based on their xipe scores
+    for pathway in list(pathways_to_remove):
+        score, bin=results[pathway]
+        if score >= config.xipe_probability and bin == config.xipe_bin:
+            pathways_to_remove.remove(pathway)
+            
+    return pathways_to_remove
+
+# the pathways database shared with the processes which compute the pathways for each bug
+_pathways_database=None
+
+def set_pathways_database(pathways_database):
+    """
+    Set the pathways database used to compute the pathways for each bug
+    """
+    
+    global _pathways_database
+    _pathways_database=pathways_database
+    
+def run_for_bug(args):
+    """
+    Run the function for one bug with the pathways database shared with the process
+    """
+    
+    function=args[0]
+    args=list(args[1:])+[_pathways_database]
+    if not config.profile_stages:
+        return function(*args)
+    
+    # the bug is the first argument of each function
+    from .. import profiling
+    return profiling.profile_call(function.__name__+"_"+str(args[0]), function, *args)
+
+def run_by_bug(function, args_by_bug, pathways_database):
+    """
+    Run the function for each bug in a pool of processes
+    Return the results in the order of the bugs
+    """
+    
+    return scheduler.process_map(run_for_bug, [[function]+list(args) for args in args_by_bug],
+        initializer=set_pathways_database, initargs=(pathways_database,))
+
+def pathways_and_reactions_by_pathway(pathways_and_reactions_store, bug):
+    """
+    Return a list of the pathways, with their reaction scores, for the bug
+    """
+    
+    return [(pathway, pathways_and_reactions_store.reaction_scores(bug,pathway)) 
+        for pathway in pathways_and_reactions_store.pathway_list(bug)]
+
+def compute_pathways_coverage_for_bug(bug, pathways_and_reactions, median_score_value, 
+    pathways_database):
+    """
+    Compute the coverage of the pathways (a list of pathways with reaction scores) for one bug
+    Return the list of pathways with coverage and the pathways to remove found with xipe
+    """
+    
+    logger.debug("Compute pathway coverage for bug: " + bug)
+    
+    # Process through each pathway to compute coverage
+    pathways_coverage=[]
+    for pathway, reaction_scores in pathways_and_reactions:
+            
+        # Check if the pathways database is structured
+        if pathways_database.is_structured():
+            program=pathways_database.get_program_for_pathway(pathway)
+            key_reactions=pathways_database.get_key_reactions_for_pathway(pathway)
+            # Apply gap fill
+            reaction_scores=gap_fill(key_reactions, reaction_scores)
+            # Compute the structured pathway coverage
+            coverage=compute_pathway_program_abundance_or_coverage(program,
+                reaction_scores,True,median_score_value)
+        else:
+            # Count the reactions with scores greater than the median
+            count_greater_than_median=0
+            for reaction, score in reaction_scores.items():
+                if score > median_score_value:
+                   count_greater_than_median+=1
+            
+            # Compute coverage
+            coverage=0
+            total_reactions_for_pathway=len(pathways_database.find_reactions(pathway))
+            if total_reactions_for_pathway:
+                coverage=count_greater_than_median/float(total_reactions_for_pathway)
+        
+        pathways_coverage.append((pathway, coverage))
+        
+    # Check config to determine if xipe should be run in process
+    pathways_to_remove=[]
+    if config.xipe_toggle == "on" and config.xipe_engine == "internal":
+        pathways_to_remove=xipe_pathways_to_remove(bug, dict(pathways_coverage))
+        
+    return pathways_coverage, pathways_to_remove
+
 def compute_pathways_coverage(pathways_and_reactions_store,pathways_database):
     """
     Compute the coverage of pathways for each bug
     """
 
+    # Compute the coverage for the bugs in parallel
+    bugs=pathways_and_reactions_store.bug_list()
+    results=run_by_bug(compute_pathways_coverage_for_bug, [(bug, 
+        pathways_and_reactions_by_pathway(pathways_and_reactions_store, bug),
+        pathways_and_reactions_store.median_score(bug)) for bug in bugs], pathways_database)
+
     pathways_coverage_store=store.Pathways()
     xipe_stdout_results={}
     xipe_stderr_results={}
-    xipe_commands=[]
-    for bug in pathways_and_reactions_store.bug_list():
-    
-        logger.debug("Compute pathway coverage for bug: " + bug)
+    xipe_tasks=[]
+    for bug, (pathways_coverage, pathways_to_remove) in zip(bugs, results):
         
-        # Process through each pathway to compute coverage
         xipe_input=[]
-        median_score_value=pathways_and_reactions_store.median_score(bug)
-        
-        for pathway in pathways_and_reactions_store.pathway_list(bug):
-                
-            reaction_scores=pathways_and_reactions_store.reaction_scores(bug,pathway)
-            
-            # Check if the pathways database is structured
-            if pathways_database.is_structured():
-                structure=pathways_database.get_structure_for_pathway(pathway)
-                key_reactions=pathways_database.get_key_reactions_for_pathway(pathway)
-                # Apply gap fill
-                reaction_scores=gap_fill(key_reactions, reaction_scores)
-                # Compute the structured pathway coverage
-                coverage=compute_structured_pathway_abundance_or_coverage(structure,
-                    key_reactions,reaction_scores,True,median_score_value)
-            else:
-                # Count the reactions with scores greater than the median
-                count_greater_than_median=0
-                for reaction, score in reaction_scores.items():
-                    if score > median_score_value:
-                       count_greater_than_median+=1
-                
-                # Compute coverage
-                coverage=0
-                total_reactions_for_pathway=len(pathways_database.find_reactions(pathway))
-                if total_reactions_for_pathway:
-                    coverage=count_greater_than_median/float(total_reactions_for_pathway)
-            
+        for pathway, coverage in pathways_coverage:
             pathways_coverage_store.add(bug,pathway,coverage)
             xipe_input.append(config.xipe_delimiter.join([pathway,str(coverage)]))
+            
+        # Remove the pathways found with xipe run in process
+        for pathway in pathways_to_remove:
+            pathways_coverage_store.delete(bug,pathway)
         
-        # Check config to determine if xipe should be run
-        if config.xipe_toggle == "on":
+        # Check config to determine if xipe should be run with the script
+        if config.xipe_toggle == "on" and config.xipe_engine == "external":
 
             # Create temp file for input
             infile=utilities.unnamed_temp_file()
@@ -256,13 +516,13 @@ def compute_pathways_coverage(pathways_and_reactions_store,pathways_database):
             
             stdout_file, stderr_file, command = xipe_command(infile)
             
-            xipe_commands.append(command)
+            xipe_tasks.append(scheduler.command_task("xipe " + bug, command,
+                memory=file_size(infile)))
             xipe_stdout_results[bug]=stdout_file
             xipe_stderr_results[bug]=stderr_file
             
     # Run xipe
-    if xipe_commands:
-        utilities.command_threading(config.threads,xipe_commands)
+    scheduler.run_tasks(xipe_tasks)
             
     # Process the xipe output
     for bug in xipe_stdout_results:
@@ -313,52 +573,65 @@ def harmonic_mean(values):
     
     return mean
 
-def compute_structured_pathway_abundance_or_coverage(structure, key_reactions, reaction_scores, 
+def compute_pathway_program_abundance_or_coverage(program, reaction_scores, 
     coverage_computation, median_value):
     """
-    Compute the abundance or coverage for a structured pathway
+    Compute the abundance or coverage for a structured pathway from the compiled program
     """
     
-    # Process through the structure to compute the abundance
-    required_reaction_abundances=[]
-    optional_reaction_abundances=[]
-    # Select the join instead of removing from the list to not alter the list for
-    # the calling function
-    join=structure[0]
-    for item in structure[1:]:
-        if isinstance(item, list):
-            required_reaction_abundances.append(compute_structured_pathway_abundance_or_coverage(item, 
-                key_reactions, reaction_scores, coverage_computation, median_value))
+    # Update the scores for all of the reactions at once if this is a coverage computation
+    if coverage_computation:
+        reactions=set()
+        for join, required_items, optional_reactions in program:
+            reactions.update(item for item in required_items if not isinstance(item, int))
+            reactions.update(optional_reactions)
+        reactions=list(reactions)
+        reaction_scores=dict(zip(reactions, chi2cdf.chi2cdf_batch(
+            [reaction_scores.get(reaction,0) for reaction in reactions], median_value)))
+    
+    # The results for each node, the last node is the full pathway
+    results=[]
+    for join, required_items, optional_reactions in program:
+        # Find the scores for the required items (reactions or prior nodes) and optional reactions
+        required_reaction_abundances=[]
+        for item in required_items:
+            if isinstance(item, int):
+                required_reaction_abundances.append(results[item])
+            else:
+                required_reaction_abundances.append(reaction_scores.get(item,0))
+                
+        optional_reaction_abundances=[reaction_scores.get(item,0) for item in optional_reactions]
+    
+        # If this is an OR join then use the max of all of the reaction abundances
+        if join == config.pathway_OR:
+            all_reaction_abundances=required_reaction_abundances + optional_reaction_abundances
+            abundance=0
+            if all_reaction_abundances:
+                abundance = max(all_reaction_abundances)
         else:
-            score=reaction_scores.get(item,0)
+            # If this is not an OR, then take the harmonic mean of the reactions
+            abundance=harmonic_mean(required_reaction_abundances)
+            # Add the optional reactions if they are present
+            if optional_reaction_abundances:
+                # Filter the optional abundances to only include those that are greater than the abundance
+                # from the required reactions
+                optional_reaction_abundances_filtered=[value for value in optional_reaction_abundances if value > abundance]
+                abundance=harmonic_mean(required_reaction_abundances + optional_reaction_abundances_filtered)
                 
-            # Update the score for the reaction if this is a coverage computation
-            if coverage_computation:
-                score=chi2cdf.chi2cdf(score,median_value)
+        results.append(abundance)
+        
+    return results[-1]
 
-            # Check if this is an optional reaction
-            if item in key_reactions:
-                required_reaction_abundances.append(score)
-            else:
-                optional_reaction_abundances.append(score)
+def compute_structured_pathway_abundance_or_coverage(structure, key_reactions, reaction_scores, 
+    coverage_computation, median_value):
+    """
+    Compute the abundance or coverage for a structured pathway
+    """
     
-    # If this is an OR join then use the max of all of the reaction abundances
-    if join == config.pathway_OR:
-        all_reaction_abundances=required_reaction_abundances + optional_reaction_abundances
-        abundance=0
-        if all_reaction_abundances:
-            abundance = max(all_reaction_abundances)
-    else:
-        # If this is not an OR, then take the harmonic mean of the reactions
-        abundance=harmonic_mean(required_reaction_abundances)
-        # Add the optional reactions if they are present
-        if optional_reaction_abundances:
-            # Filter the optional abundances to only include those that are greater than the abundance
-            # from the required reactions
-            optional_reaction_abundances_filtered=[value for value in optional_reaction_abundances if value > abundance]
-            abundance=harmonic_mean(required_reaction_abundances + optional_reaction_abundances_filtered)
-        
-    return abundance
+    program=store.compile_pathway_structure(structure, key_reactions)
+    
+    return compute_pathway_program_abundance_or_coverage(program, reaction_scores,
+        coverage_computation, median_value)
 
 def gap_fill(key_reactions, reaction_scores):
     """
@@ -400,116 +673,118 @@ def gap_fill(key_reactions, reaction_scores):
     return reaction_scores_gap_filled
     
 
-def compute_pathways_abundance(pathways_and_reactions_store, pathways_database):
+def compute_pathways_abundance_for_bug(bug, pathways_and_reactions, pathways_database):
     """
-    Compute the abundance of pathways for each bug
-    Also find the set of the reactions with abundance in all pathways present
+    Compute the abundance of the pathways (a list of pathways with reaction scores) for one bug
+    Return the list of pathways with abundance and the set of the reactions 
+    with abundance in the pathways present
     """
     
-    # Store the reactions which have abundance in the pathways with abundance
-    reactions_in_pathways_present={}
+    logger.debug("Compute pathway abundance for bug: " + bug)
     
-    # Process through each pathway for each bug to compute abundance
-    pathways_abundance_store=store.Pathways()
-    for bug in pathways_and_reactions_store.bug_list():
+    reactions_in_pathways_present=set()
+    pathways_abundance=[]
+    for pathway, reaction_scores in pathways_and_reactions:
         
-        logger.debug("Compute pathway abundance for bug: " + bug)
+        # Check if the pathways database is structured
+        if pathways_database.is_structured():
+            program=pathways_database.get_program_for_pathway(pathway)
+            key_reactions=pathways_database.get_key_reactions_for_pathway(pathway)
+            # Apply gap fill
+            reaction_scores_gap_filled=gap_fill(key_reactions, reaction_scores)
+            # Compute the structured pathway abundance
+            abundance=compute_pathway_program_abundance_or_coverage(program,
+                reaction_scores_gap_filled,False,0)
         
-        reactions_in_pathways_present[bug]=set()
-        for pathway in pathways_and_reactions_store.pathway_list(bug):
-            
-            reaction_scores=pathways_and_reactions_store.reaction_scores(bug,pathway)
-            
-            # Check if the pathways database is structured
-            if pathways_database.is_structured():
-                structure=pathways_database.get_structure_for_pathway(pathway)
-                key_reactions=pathways_database.get_key_reactions_for_pathway(pathway)
-                # Apply gap fill
-                reaction_scores_gap_filled=gap_fill(key_reactions, reaction_scores)
-                # Compute the structured pathway abundance
-                abundance=compute_structured_pathway_abundance_or_coverage(structure,
-                    key_reactions,reaction_scores_gap_filled,False,0)
-            
-            else:
-                # Initialize any reactions in the pathway not found to 0
-                for reaction in pathways_database.find_reactions(pathway):
-                    reaction_scores.setdefault(reaction, 0)
-                    
-                # Sort the scores for all of the reactions in the pathway from low to high
-                sorted_reaction_scores=sorted(reaction_scores.values())
-                    
-                # Select the second half of the list of reaction scores
-                abundance_set=sorted_reaction_scores[int(len(sorted_reaction_scores)/ 2):]
+        else:
+            # Initialize any reactions in the pathway not found to 0
+            for reaction in pathways_database.find_reactions(pathway):
+                reaction_scores.setdefault(reaction, 0)
                 
-                # Compute abundance
-                abundance=sum(abundance_set)/len(abundance_set)
+            # Sort the scores for all of the reactions in the pathway from low to high
+            sorted_reaction_scores=sorted(reaction_scores.values())
                 
-            # If this pathway is present, store those reactions with abundance
-            if abundance > 0:
-                for reaction,score in reaction_scores.items():
-                    if score > 0:
-                        reactions_in_pathways_present[bug].add(reaction)
+            # Select the second half of the list of reaction scores
+            abundance_set=sorted_reaction_scores[int(len(sorted_reaction_scores)/ 2):]
             
-            # Store the abundance
+            # Compute abundance
+            abundance=sum(abundance_set)/len(abundance_set)
+            
+        # If this pathway is present, store those reactions with abundance
+        if abundance > 0:
+            for reaction,score in reaction_scores.items():
+                if score > 0:
+                    reactions_in_pathways_present.add(reaction)
+        
+        pathways_abundance.append((pathway, abundance))
+        
+    return pathways_abundance, reactions_in_pathways_present
+
+def compute_pathways_abundance(pathways_and_reactions_store, pathways_database):
+    """
+    Compute the abundance of pathways for each bug
+    Also find the set of the reactions with abundance in all pathways present
+    """
+    
+    # Compute the abundance for the bugs in parallel
+    bugs=pathways_and_reactions_store.bug_list()
+    results=run_by_bug(compute_pathways_abundance_for_bug, [(bug, 
+        pathways_and_reactions_by_pathway(pathways_and_reactions_store, bug)) for bug in bugs],
+        pathways_database)
+    
+    # Store the abundance in the order of the bugs and pathways
+    reactions_in_pathways_present={}
+    pathways_abundance_store=store.Pathways()
+    for bug, (pathways_abundance, reactions) in zip(bugs, results):
+        reactions_in_pathways_present[bug]=reactions
+        for pathway, abundance in pathways_abundance:
             pathways_abundance_store.add(bug, pathway, abundance)
     
     return pathways_abundance_store, reactions_in_pathways_present
     
-    
-def print_pathways(pathways, file, header, pathway_names, sorted_pathways_and_bugs,
-                   unmapped_all, unintegrated_all, unintegrated_per_bug):
+def pathways_rows(pathways, pathway_names, sorted_pathways_and_bugs,
+                  unmapped_all, unintegrated_all, unintegrated_per_bug):
     """
-    Print the pathways data to a file organized by pathway
+    Yield the rows (pathway name, bug, score) of the pathways output file
     """
     
-    logger.debug("Print pathways %s", header)
-    
-    delimiter=config.output_file_column_delimiter
-    category_delimiter=config.output_file_category_delimiter            
- 
-    # Create the header
-    column_name=config.file_basename + header
-    if config.remove_column_description_output:
-        column_name=config.file_basename
-    tsv_output=["# Pathway"+ delimiter + column_name]
-    
     # Add the unmapped and unintegrated values
-    tsv_output.append(config.unmapped_pathway_name+delimiter+utilities.format_float_to_string(unmapped_all))
-    tsv_output.append(config.unintegrated_pathway_name+delimiter+utilities.format_float_to_string(unintegrated_all))
+    yield (config.unmapped_pathway_name, None, unmapped_all)
+    yield (config.unintegrated_pathway_name, None, unintegrated_all)
     # Process and print per bug if selected
     if not config.remove_stratified_output:
         for bug in utilities.double_sort(unintegrated_per_bug):
-            tsv_output.append(config.unintegrated_pathway_name+category_delimiter+bug
-                              +delimiter+utilities.format_float_to_string(unintegrated_per_bug[bug]))
+            yield (config.unintegrated_pathway_name, bug, unintegrated_per_bug[bug])
+            
+    # Look up the names for all of the pathways at once
+    sorted_pathway_names=pathway_names.get_names([pathway for pathway, bugs_list in sorted_pathways_and_bugs])
             
     # Print out all pathways sorted
     for pathway, bugs_list in sorted_pathways_and_bugs:
-        all_score=pathways.get_score(pathway)
-        pathway_name=pathway_names.get_name(pathway)
+        pathway_name=sorted_pathway_names[pathway]
         # Print the computation of all bugs for pathway
-        tsv_output.append(pathway_name+delimiter+utilities.format_float_to_string(all_score))
+        yield (pathway_name, None, pathways.get_score(pathway))
         # Process and print per bug if selected
         if not config.remove_stratified_output:
             # Print scores for all bugs sorted
             for bug in bugs_list:
-                score=pathways.get_score_for_bug(bug,pathway)
-                tsv_output.append(pathway_name+category_delimiter+bug+delimiter
-                                  +utilities.format_float_to_string(score))
+                yield (pathway_name, bug, pathways.get_score_for_bug(bug,pathway))
+
+def print_pathways(pathways, file, header, pathway_names, sorted_pathways_and_bugs,
+                   unmapped_all, unintegrated_all, unintegrated_per_bug):
+    """
+    Print the pathways data to a file organized by pathway
+    """
+    
+    logger.debug("Print pathways %s", header)
  
-    if config.output_format == "biom":
-        # Open a temp file if a conversion to biom is selected
-        tmpfile=utilities.unnamed_temp_file()
-        file_out=open(tmpfile,"w")
-        file_out.write("\n".join(tsv_output))
-        file_out.close()
-        
-        utilities.tsv_to_biom(tmpfile,file,"Pathway")
-            
-    else:
-        # Write the final file as tsv
-        file_handle=open(file,"w") 
-        file_handle.write("\n".join(tsv_output))                  
-        file_handle.close()
+    # Create the header
+    column_name=config.file_basename + header
+    if config.remove_column_description_output:
+        column_name=config.file_basename
+    
+    utilities.write_table(file, "# Pathway", column_name, pathways_rows(pathways, pathway_names,
+        sorted_pathways_and_bugs, unmapped_all, unintegrated_all, unintegrated_per_bug), "Pathway")
     
 def compute_gene_abundance_in_pathways(gene_scores, reactions_database, reactions_in_pathways_present):
     """
@@ -517,30 +792,27 @@ def compute_gene_abundance_in_pathways(gene_scores, reactions_database, reaction
     Also compute the remaining gene abundance that did not contribute to any pathways present
     """
     
-    # From each of the reactions present in pathways, find the list of all genes
-    # that contributed to the pathway abundance (for each bug found in community)
-    genes_in_pathways_present={}
+    # Compute the abundance of the genes that contributed to the reactions 
+    # present in pathways (for each bug found in community)
+    gene_abundance_in_pathways={}
+    remaining_gene_abundance={}
     for bug in reactions_in_pathways_present:
-        genes_in_pathways_present[bug]=set()
-        for reaction in reactions_in_pathways_present[bug]:
+        reactions_present=reactions_in_pathways_present[bug]
+        gene_scores_for_bug=gene_scores.scores_for_bug(bug)
+        for gene, score in gene_scores_for_bug.items():
             if reactions_database:
-                # Find the list of genes for this reaction
-                gene_list=reactions_database.find_genes(reaction)
-                genes_in_pathways_present[bug].update(gene_list)
+                # Use the same gene by reaction incidence as used to compute the reaction scores
+                gene_in_pathways=any(reaction in reactions_present 
+                    for reaction in reactions_database.find_reactions(gene))
             else:
                 # If the reactions database is not provided, then the pathway is defined
                 # in terms of genes
-                genes_in_pathways_present[bug].add(reaction)
-        
-    # Compute the abundance for the genes present
-    gene_abundance_in_pathways={}
-    remaining_gene_abundance={}
-    for bug in genes_in_pathways_present:
-        for gene in genes_in_pathways_present[bug]:
-            gene_abundance_in_pathways[bug]=gene_abundance_in_pathways.get(bug,0)+gene_scores.get_score(bug,gene)
+                gene_in_pathways=gene in reactions_present
+            if gene_in_pathways:
+                gene_abundance_in_pathways[bug]=gene_abundance_in_pathways.get(bug,0)+score
             
         # Compute the remaining gene abundance
-        total_gene_abundance=sum(gene_scores.scores_for_bug(bug).values())
+        total_gene_abundance=sum(gene_scores_for_bug.values())
         remaining_gene_abundance[bug]=total_gene_abundance-gene_abundance_in_pathways.get(bug,0)
         
     return gene_abundance_in_pathways, remaining_gene_abundance
@@ -578,13 +850,16 @@ def compute_unmapped_and_unintegrated(gene_abundance_in_pathways, remaining_gene
     
 
 def compute_pathways_abundance_and_coverage(gene_scores, reactions_database, 
-                                            pathways_and_reactions_store, pathways_database, unaligned_reads_count):
+                                            pathways_and_reactions_store, pathways_database, unaligned_reads_count,
+                                            pathway_names=None):
     """
     Compute the abundance and coverage of the pathways
+    Use the pathway names if provided or read them from the mapping file
     """
     
     # Read in and store the pathway id to name mappings
-    pathway_names=store.Names(config.pathway_name_mapping_file)
+    if pathway_names is None:
+        pathway_names=store.Names(config.pathway_name_mapping_file)
     
     # Compute abundance for all pathways
     pathways_abundance, reactions_in_pathways_present=compute_pathways_abundance(
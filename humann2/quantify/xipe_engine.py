@@ -0,0 +1,194 @@
+"""
+HUMAnN2: xipe_engine module
+Identify the pathways which can be told from zero (xipe) in process
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+This follows xipe.py as run by humann2 (a percent as the second sample and the
+default sample size, repetitions, and paranoid mode). The samples are drawn
+with a binary search of the cumulative weights and the counts for each key are
+stored in lists indexed by key, instead of a linear scan of the dictionary for
+each element drawn. The random numbers are drawn in the same order as xipe.py,
+so with the same seed (and the keys in the same order) the results are the same.
+
+In paranoid mode xipe.py compares a (confidence, bin) tuple to a confidence
+so only the first of the three comparisons is used. Here the worst of the
+three is used as described in xipe.py.
+"""
+
+import bisect
+import random
+import hashlib
+
+from .. import config
+
+# the confidence levels with the percentiles of the deltas between the mixed samples
+CONFIDENCE_LEVELS=[(99,.5,99.5),(98,1,99),(97,1.5,98.5),(96,2,98),(95,2.5,97.5),
+    (94,3,97),(93,3.5,96.5),(92,4,96),(91,4.5,95.5),(90,5,95),(80,10,90),(70,15,85),
+    (60,20,80),(50,25,75)]
+
+def random_generator(seed=None, name=""):
+    """
+    Return a random number generator seeded for the name (ie bug)
+    If the seed is not set the generator is seeded from the system
+    """
+
+    if seed is None:
+        return random.Random()
+
+    digest=hashlib.sha1((str(seed)+"\t"+name).encode("utf-8")).hexdigest()
+    return random.Random(int(digest[:16],16))
+
+def remove_lowest(sample, percent):
+    """
+    Return the sample without the lowest percent of the values and the keys removed
+    The sample is a list of (key, value) tuples
+    """
+
+    sorted_sample=sorted(sample, key=lambda item: item[1])
+    count=int(round(percent*len(sorted_sample)))
+
+    return sorted_sample[count:], [key for key, value in sorted_sample[:count]]
+
+class Distribution(object):
+    """
+    Draws keys with probability proportional to their values
+    """
+
+    def __init__(self, sample, key_index):
+        self.indexes=[]
+        self.cumulative=[]
+        total=0
+        for key, value in sample:
+            total+=value
+            self.indexes.append(key_index[key])
+            self.cumulative.append(total)
+        self.total=total
+
+    def counts(self, sample_size, total_keys, rng):
+        """
+        Return the number of times each key is drawn in the sample (by key index)
+        """
+
+        counts=[0]*total_keys
+        if not self.indexes:
+            return counts
+
+        cumulative=self.cumulative
+        last=len(cumulative)-1
+        for i in range(sample_size):
+            position=bisect.bisect_left(cumulative, rng.random()*self.total)
+            counts[self.indexes[min(position,last)]]+=1
+
+        return counts
+
+def median(sorted_values):
+    """
+    Return the median of the values (sorted largest first) as computed by xipe
+    """
+
+    total=len(sorted_values)
+    middle=int(round(total/2.0))
+    if total % 2 == 1:
+        return sorted_values[middle]
+    return sorted_values[middle]*.5 + sorted_values[middle+1]*.5
+
+def classify(delta_median, space_deltas):
+    """
+    Return the confidence and bin for the median delta given the
+    deltas between the mixed samples (sorted largest first)
+    """
+
+    result=(0,0)
+    scale=int(round(len(space_deltas)/100.0))
+    for confidence, lower, upper in CONFIDENCE_LEVELS:
+        if delta_median > space_deltas[int(scale*lower)]:
+            result=max(result,(confidence,1))
+        if delta_median < space_deltas[int(scale*upper)]:
+            result=max(result,(confidence,2))
+
+    return result
+
+def compare_samples(sample1, sample2, sample_size, repetitions, rng):
+    """
+    Return a dictionary of the keys with the (confidence, bin) that
+    the values differ between the two samples
+    """
+
+    keys=[key for key, value in sample1]
+    key_index=dict((key, i) for i, key in enumerate(keys))
+    total_keys=len(keys)
+
+    # the mixed samples include the keys from both samples in the order first found
+    values1=dict(sample1)
+    values2=dict(sample2)
+    mix1=[(key, values1[key]+values2.get(key,0)) for key in keys]
+    mix2=[(key, values2[key]+values1.get(key,0)) for key, value in sample2]
+    mix2+=[(key, values1[key]) for key in keys if not key in values2]
+
+    distributions=[Distribution(sample, key_index) for sample in [sample1, sample2, mix1, mix2]]
+
+    sample_deltas=[[0]*repetitions for key in keys]
+    space_deltas=[[0]*repetitions for key in keys]
+    for repetition in range(repetitions):
+        counts1, counts2, mix_counts1, mix_counts2=[distribution.counts(sample_size, total_keys, rng)
+            for distribution in distributions]
+        for i in range(total_keys):
+            sample_deltas[i][repetition]=counts1[i]-counts2[i]
+            space_deltas[i][repetition]=mix_counts1[i]-mix_counts2[i]
+
+    results={}
+    for i, key in enumerate(keys):
+        sample_deltas[i].sort(reverse=True)
+        space_deltas[i].sort(reverse=True)
+        results[key]=classify(median(sample_deltas[i]), space_deltas[i])
+
+    return results
+
+def xipe(values, percent=None, sample_size=None, repetitions=None, paranoid=None, rng=None):
+    """
+    Compare the values to the values without the lowest percent
+    Return a dictionary of the keys with the (confidence, bin) and the keys removed
+    With paranoid the comparison is repeated three times and the worst confidence is used
+    """
+
+    if percent is None:
+        percent=float(config.xipe_percent)
+    if sample_size is None:
+        sample_size=config.xipe_sample_size
+    if repetitions is None:
+        repetitions=config.xipe_repetitions
+    if paranoid is None:
+        paranoid=config.xipe_paranoid
+    if rng is None:
+        rng=random_generator(config.xipe_seed)
+
+    # only the keys with values greater than zero are included (in sorted order)
+    sample1=[(key, float(values[key])) for key in sorted(values) if float(values[key]) > 0]
+    sample2, removed=remove_lowest(sample1, percent)
+
+    results={}
+    for i in range(3 if paranoid else 1):
+        for key, result in compare_samples(sample1, sample2, sample_size, repetitions, rng).items():
+            if not key in results or result < results[key]:
+                results[key]=result
+
+    return results, removed
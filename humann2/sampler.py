@@ -0,0 +1,320 @@
+"""
+HUMAnN2: sampler module
+Sample the resources used by humann2 and the software it runs while in progress
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+The sampler is a thread which, at each interval, records the cpu time, resident set
+size, and bytes read/written of this process and of all of its descendants (ie the
+alignment software run with utilities.execute_command). The samples are written to a
+csv file as they are taken so the timeline is available if the run is killed. The
+processes are found with psutil if installed, otherwise from /proc (linux).
+
+Each sample row is tagged with the number of the stage in progress. A stage row is
+written as each stage is completed with the number and the name of the stage.
+"""
+
+import os
+import time
+import logging
+import threading
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+COLUMNS=["time","event","stage","pid","ppid","command","cpu_time","cpu_percent",
+    "rss","read_bytes","write_bytes"]
+
+try:
+    page_size=os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    page_size=4096
+
+try:
+    clock_ticks=os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    clock_ticks=100
+
+def proc_available():
+    """
+    Return true if the process information can be read from /proc
+    """
+    
+    return os.path.isfile(os.path.join("/proc",str(os.getpid()),"stat"))
+
+def read_proc_stat(pid):
+    """
+    Return the ppid, command, cpu time (seconds), and rss (bytes) for the process from /proc
+    """
+    
+    with open(os.path.join("/proc",str(pid),"stat")) as file_handle:
+        stat=file_handle.read()
+    
+    # the command is in parentheses and can include spaces
+    command=stat[stat.index("(")+1:stat.rindex(")")]
+    data=stat[stat.rindex(")")+2:].split()
+    cpu_time=(int(data[11])+int(data[12]))/float(clock_ticks)
+    rss=int(data[21])*page_size
+    
+    return int(data[1]), command, cpu_time, rss
+
+def read_proc_io(pid):
+    """
+    Return the bytes read and written by the process from /proc (or None if not readable)
+    """
+    
+    io={}
+    try:
+        with open(os.path.join("/proc",str(pid),"io")) as file_handle:
+            for line in file_handle:
+                key, sep, value=line.partition(":")
+                io[key]=int(value)
+    except (EnvironmentError, ValueError):
+        pass
+    
+    return io.get("rchar"), io.get("wchar")
+
+def proc_processes(pid):
+    """
+    Return the usage of the process and all of its descendants from /proc
+    """
+    
+    # find the parent of each process
+    stats={}
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                stats[int(name)]=read_proc_stat(name)
+            except (EnvironmentError, ValueError, IndexError):
+                pass
+    
+    children={}
+    for process_id, stat in stats.items():
+        children.setdefault(stat[0],[]).append(process_id)
+    
+    processes=[]
+    process_ids=[pid]
+    while process_ids:
+        process_id=process_ids.pop(0)
+        if process_id in stats:
+            ppid, command, cpu_time, rss=stats[process_id]
+            read_bytes, write_bytes=read_proc_io(process_id)
+            processes.append([process_id, ppid, command, cpu_time, rss, read_bytes, write_bytes])
+            process_ids+=sorted(children.get(process_id,[]))
+    
+    return processes
+
+def psutil_processes(pid):
+    """
+    Return the usage of the process and all of its descendants from psutil
+    """
+    
+    try:
+        process=psutil.Process(pid)
+        all_processes=[process]+process.children(recursive=True)
+    except psutil.Error:
+        return []
+    
+    processes=[]
+    for process in all_processes:
+        try:
+            with process.oneshot():
+                cpu_times=process.cpu_times()
+                rss=process.memory_info().rss
+                read_bytes=write_bytes=None
+                try:
+                    io=process.io_counters()
+                    read_bytes=getattr(io,"read_chars",io.read_bytes)
+                    write_bytes=getattr(io,"write_chars",io.write_bytes)
+                except (AttributeError, psutil.Error):
+                    pass
+                processes.append([process.pid, process.ppid(), process.name(),
+                    cpu_times.user+cpu_times.system, rss, read_bytes, write_bytes])
+        except psutil.Error:
+            pass
+    
+    return processes
+
+def available():
+    """
+    Return true if the processes can be sampled on this system
+    """
+    
+    return bool(psutil) or proc_available()
+
+def processes(pid):
+    """
+    Return the usage of the process and all of its descendants
+    [pid, ppid, command, cpu time, rss, bytes read, bytes written]
+    """
+    
+    if psutil:
+        return psutil_processes(pid)
+    return proc_processes(pid)
+
+class ResourceSampler(threading.Thread):
+    """
+    Samples the resources used by this process and its descendants at each interval
+    """
+    
+    def __init__(self, file, interval=1.0, pid=None):
+        threading.Thread.__init__(self)
+        self.daemon=True
+        self.__file=file
+        self.__interval=interval
+        self.__pid=pid or os.getpid()
+        self.__stop_event=threading.Event()
+        self.__lock=threading.Lock()
+        self.__file_handle=None
+        self.__stage=1
+        self.__start_time=time.time()
+        self.__cpu_times={}
+        
+    def write_row(self, row):
+        """
+        Write a row to the samples file
+        """
+        
+        line=",".join("" if value is None else str(value) for value in row)
+        with self.__lock:
+            if self.__file_handle:
+                self.__file_handle.write(line+"\n")
+                self.__file_handle.flush()
+        
+    def elapsed_time(self):
+        """
+        Return the seconds since the sampler was created
+        """
+        
+        return round(time.time()-self.__start_time,3)
+        
+    def sample(self):
+        """
+        Record the resources used by the process and its descendants
+        """
+        
+        sample_time=time.time()
+        for pid, ppid, command, cpu_time, rss, read_bytes, write_bytes in processes(self.__pid):
+            # the cpu percent is from the prior sample of the process
+            cpu_percent=None
+            if pid in self.__cpu_times:
+                prior_time, prior_cpu_time=self.__cpu_times[pid]
+                if sample_time > prior_time:
+                    cpu_percent=round(100.0*(cpu_time-prior_cpu_time)/(sample_time-prior_time),1)
+            self.__cpu_times[pid]=(sample_time, cpu_time)
+            
+            # remove characters which would change the csv columns
+            command=command.replace(",","_").replace("\n","_")
+            self.write_row([round(sample_time-self.__start_time,3),"sample",self.__stage,
+                pid,ppid,command,round(cpu_time,2),cpu_percent,rss,read_bytes,write_bytes])
+    
+    def stage_completed(self, stage):
+        """
+        Record the stage completed and start tagging samples with the next stage
+        """
+        
+        self.write_row([self.elapsed_time(),"stage",self.__stage,None,None,
+            stage.replace(",","_")]+[None]*5)
+        self.__stage+=1
+        
+    def run(self):
+        while not self.__stop_event.wait(self.__interval):
+            try:
+                self.sample()
+            except (EnvironmentError, ValueError):
+                logger.debug("Unable to sample the resources used")
+        
+    def start(self):
+        """
+        Open the samples file and start sampling
+        """
+        
+        try:
+            self.__file_handle=open(self.__file,"w")
+        except EnvironmentError:
+            logger.warning("Unable to write resource samples file: " + self.__file)
+            return
+        
+        self.write_row(COLUMNS)
+        self.sample()
+        threading.Thread.start(self)
+        
+    def stop(self):
+        """
+        Take a final sample, stop sampling, and close the samples file
+        """
+        
+        if not self.__file_handle:
+            return
+        
+        self.__stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.sample()
+        with self.__lock:
+            self.__file_handle.close()
+            self.__file_handle=None
+
+# the sampler for the run in progress
+run_sampler=None
+
+def start_run(enabled, file, interval):
+    """
+    Start sampling the resources for a new run (stopping the sampler for the prior run)
+    """
+    
+    global run_sampler
+    stop_run()
+    
+    if not enabled:
+        return None
+    
+    if not available():
+        logger.warning("Unable to sample the resources used. Please install psutil.")
+        return None
+    
+    logger.info("Writing resource samples every " + str(interval) + " seconds to: " + file)
+    run_sampler=ResourceSampler(file, interval)
+    run_sampler.start()
+    return run_sampler
+
+def stage_completed(stage):
+    """
+    Tag the samples which follow with the next stage
+    """
+    
+    if run_sampler:
+        run_sampler.stage_completed(stage)
+
+def stop_run():
+    """
+    Stop sampling the resources for the run in progress
+    """
+    
+    global run_sampler
+    if run_sampler:
+        run_sampler.stop()
+        run_sampler=None
@@ -0,0 +1,258 @@
+"""
+HUMAnN2: scheduler module
+Run a set of tasks within a cpu and memory budget
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import sys
+import time
+import threading
+import multiprocessing
+import traceback
+import logging
+
+from . import config
+from . import utilities
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+# the tasks run, with their resource use, in the order they finished
+task_history=[]
+task_history_lock=threading.Lock()
+
+class Task(object):
+    """
+    A task to run with the number of cpus and memory (in bytes) it requires
+    """
+
+    def __init__(self, name, function, args=None, cpus=1, memory=0):
+        self.name=name
+        self.function=function
+        self.args=args or []
+        self.cpus=max(1,int(cpus))
+        self.memory=max(0,int(memory))
+
+        # the status is one of queued, running, completed, failed, or cancelled
+        self.status="queued"
+        self.error=""
+        self.result=None
+
+        # the resources used to run the task
+        self.wall_time=0.0
+        self.cpu_time=0.0
+        self.peak_rss=0
+
+    def run(self):
+        """
+        Run the task, recording the resources used by the task processes
+        """
+
+        utilities.reset_process_usage()
+        start_time=time.time()
+        try:
+            self.result=self.function(*self.args)
+            self.status="completed"
+        except (Exception, SystemExit) as e:
+            self.status="failed"
+            self.error=str(e)
+            logger.debug("TRACEBACK: \n" + traceback.format_exc())
+        self.wall_time=time.time()-start_time
+        self.cpu_time, self.peak_rss=utilities.get_process_usage()
+
+    def resource_summary(self):
+        """
+        Return a string with the resources used to run the task
+        """
+
+        return (self.name + "\t" + self.status + "\twall time: " + str(round(self.wall_time,2)) +
+            " seconds\tcpu time: " + str(round(self.cpu_time,2)) + " seconds\tpeak rss: " +
+            str(round(utilities.byte_to_megabyte(self.peak_rss),2)) + " MB")
+
+def command_task(name, command, cpus=1, memory=0):
+    """
+    Return a task to run a command of the form used by utilities.execute_command
+    [exe, args, infiles, outfiles, stdout_file, stdin_file, raise_error, stderr_file]
+    """
+
+    return Task(name, utilities.execute_command_args_convert, [command], cpus, memory)
+
+def max_memory_bytes():
+    """
+    Return the max memory setting in bytes (zero if there is no limit)
+    """
+
+    return int(config.max_memory*1024*1024*1024)
+
+class Scheduler(object):
+    """
+    Run tasks using threads, largest tasks first, within a cpu and memory budget
+    Queued tasks are cancelled on the first failure
+    """
+
+    def __init__(self, threads=None, max_memory=None):
+        if threads is None:
+            threads=config.threads
+        if max_memory is None:
+            max_memory=max_memory_bytes()
+
+        self.threads=max(1,int(threads))
+        self.max_memory=max_memory
+
+        self.__condition=threading.Condition()
+        self.__cpus_in_use=0
+        self.__memory_in_use=0
+        self.__running=0
+        self.__failed=False
+
+    def fits(self, task):
+        """
+        Check if the task can be started with the resources not in use
+        A task larger than the full budget is run when nothing else is running
+        """
+
+        if not self.__running:
+            return True
+
+        if self.__cpus_in_use+task.cpus > self.threads:
+            return False
+
+        if self.max_memory and self.__memory_in_use+task.memory > self.max_memory:
+            return False
+
+        return True
+
+    def run_task(self, task):
+        """
+        Run the task and release the resources when complete
+        """
+
+        task.run()
+
+        with task_history_lock:
+            task_history.append(task)
+        logger.info("Task resources: " + task.resource_summary())
+
+        with self.__condition:
+            self.__cpus_in_use-=task.cpus
+            self.__memory_in_use-=task.memory
+            self.__running-=1
+            if task.status == "failed":
+                self.__failed=True
+            self.__condition.notify_all()
+
+    def run(self, tasks):
+        """
+        Run all of the tasks, return when all have finished or been cancelled
+        """
+
+        # order the tasks by size, largest first
+        # ties keep the order the tasks were provided
+        queued=sorted(tasks, key=lambda task: (task.memory, task.cpus), reverse=True)
+
+        workers=[]
+        with self.__condition:
+            while queued and not self.__failed:
+                # start the largest task that fits in the resources available
+                next_task=None
+                for task in queued:
+                    if self.fits(task):
+                        next_task=task
+                        break
+
+                if next_task is None:
+                    self.__condition.wait()
+                    continue
+
+                queued.remove(next_task)
+                next_task.status="running"
+                self.__cpus_in_use+=next_task.cpus
+                self.__memory_in_use+=next_task.memory
+                self.__running+=1
+
+                worker=threading.Thread(target=self.run_task, args=(next_task,))
+                worker.start()
+                workers.append(worker)
+
+        # cancel the remaining tasks if there was a failure
+        for task in queued:
+            task.status="cancelled"
+
+        for worker in workers:
+            worker.join()
+
+        return tasks
+
+def run_tasks(tasks, threads=None, max_memory=None):
+    """
+    Run the tasks with the scheduler
+    Exit with an error if any of the tasks fail
+    """
+
+    if not tasks:
+        return tasks
+
+    Scheduler(threads, max_memory).run(tasks)
+
+    failed_tasks=[task for task in tasks if task.status == "failed"]
+    cancelled_tasks=[task for task in tasks if task.status == "cancelled"]
+
+    if failed_tasks:
+        message="\nCRITICAL ERROR: Unable to process all tasks.\n\n"
+        for task in failed_tasks:
+            message+="Error returned from task " + task.name + ": " + task.error + "\n"
+        if cancelled_tasks:
+            message+="\nTasks cancelled: " + str(len(cancelled_tasks)) + "\n"
+        logger.critical(message)
+        sys.exit(message)
+
+    return tasks
+
+def process_map(function, items, processes=None, initializer=None, initargs=()):
+    """
+    Return the results of the function applied to each item, in the order of the items
+    The items are run in a pool of processes which are forked so they share the
+    memory of the parent process (the initializer is run in each process)
+    """
+
+    if processes is None:
+        processes=config.threads
+    processes=max(1,min(int(processes),len(items)))
+
+    # processes in a pool (as when running samples in batch) can not start a pool
+    if processes == 1 or multiprocessing.current_process().daemon:
+        if initializer:
+            initializer(*initargs)
+        return [function(item) for item in items]
+
+    try:
+        context=multiprocessing.get_context("fork")
+    except (AttributeError, ValueError):
+        context=multiprocessing
+    pool=context.Pool(processes, initializer, initargs)
+    try:
+        results=pool.map(function, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
@@ -210,10 +210,12 @@ def find_md_field(info):
         
     return md_field
 
-def unaligned_reads(sam_alignment_file, alignments, unaligned_reads_store, keep_sam=None):
+def unaligned_reads(sam_alignment_file, alignments, unaligned_reads_store, keep_sam=None,
+    alignment_store=None):
     """ 
     Return file and data structure of the unaligned reads 
     Store the alignments and return
+    Add all of the alignments (before filtering) to the alignment store if provided
     """
 
     #for translated search create fasta unaligned reads file
@@ -256,6 +258,9 @@ def unaligned_reads(sam_alignment_file, alignments, unaligned_reads_store, keep_
             # check flag to determine if unaligned
             if int(info[config.sam_flag_index]) & config.sam_unmapped_flag != 0:
                 unaligned_read=True
+                if alignment_store:
+                    alignment_store.add_unmapped(info[config.sam_read_name_index],
+                        unaligned_reads_store.get_read_count(info[config.sam_read_name_index]))
             else:
                     
                 # convert the cigar string and md field to percent identity
@@ -272,12 +277,16 @@ def unaligned_reads(sam_alignment_file, alignments, unaligned_reads_store, keep_
                 new_info[config.blast_identity_index]=str(identity)
                 new_info[config.blast_aligned_length_index]=str(alignment_length)
                 file_handle_write_aligned.write(config.blast_delimiter.join(new_info)+"\n")
+                
+                if alignment_store:
+                    alignment_store.add_nucleotide(query, info[config.sam_reference_index], identity,
+                        alignment_length, unaligned_reads_store.get_read_count(query))
                    
                 # only store alignments with identity greater than threshold
                 if identity > config.identity_threshold:
                     matches=identity/100.0*alignment_length
                     alignments.add_annotated(query,matches,info[config.sam_reference_index],
-                        alignment_length)
+                        alignment_length,unaligned_reads_store.get_read_count(query))
                 else:
                     small_identity_count+=1
                     unaligned_read=True
@@ -313,8 +322,9 @@ def unaligned_reads(sam_alignment_file, alignments, unaligned_reads_store, keep_
     file_handle_write_unaligned.close()   
     file_handle_write_aligned.close()
     
-    # set the total number of queries
-    unaligned_reads_store.set_initial_read_count(len(query_ids))
+    # set the total number of queries, including the duplicate reads each represents
+    unaligned_reads_store.set_initial_read_count(sum(unaligned_reads_store.get_read_count(query) 
+        for query in query_ids))
     
     # set the unaligned reads file to read sequences from
     unaligned_reads_store.set_file(unaligned_reads_file_fasta)
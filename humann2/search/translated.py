@@ -33,6 +33,7 @@ import traceback
 from .. import utilities
 from .. import config
 from .. import store
+from .. import scheduler
 from ..search import blastx_coverage
 
 # name global logging instance
@@ -66,7 +67,7 @@ def usearch_alignment(alignment_file, uniref, unaligned_reads_file_fasta):
 
        #run the search on each of the databases in the directory
         temp_out_files=[]
-        command_args=[]
+        tasks=[]
         for input_file in temp_in_files:
             for database in os.listdir(uniref):
                 if database.endswith(config.usearch_database_extension):
@@ -79,9 +80,12 @@ def usearch_alignment(alignment_file, uniref, unaligned_reads_file_fasta):
     
                     full_args+=["-blast6out",temp_out_file]
     
-                    command_args.append([exe,full_args,[input_database],[],None,None,True,None])
+                    # usearch loads the full database into memory
+                    tasks.append(scheduler.command_task("usearch " + os.path.basename(input_file) +
+                        " " + database, [exe,full_args,[input_database],[],None,None,True,None],
+                        memory=os.path.getsize(input_database)))
                 
-        utilities.command_threading(config.threads,command_args)
+        scheduler.run_tasks(tasks)
 
         # merge the temp output files
         exe="cat"
@@ -267,10 +271,11 @@ def alignment(uniref, unaligned_reads_file):
 
     return alignment_file
 
-def unaligned_reads(unaligned_reads_store, alignment_file_tsv, alignments):
+def unaligned_reads(unaligned_reads_store, alignment_file_tsv, alignments, alignment_store=None):
     """
     Create a fasta file of the unaligned reads
     Store the alignment results
+    Add all of the alignments (before filtering) to the alignment store if provided
     """
 
     #create a fasta file of unaligned reads
@@ -294,14 +299,15 @@ def unaligned_reads(unaligned_reads_store, alignment_file_tsv, alignments):
     small_coverage_count=0
     for alignment_info in utilities.get_filtered_translated_alignments(alignment_file_tsv, alignments,
                                                   apply_filter=True, log_filter=True,
-                                                  unaligned_reads_store=unaligned_reads_store):
+                                                  unaligned_reads_store=unaligned_reads_store,
+                                                  alignment_store=alignment_store):
         (protein_name, gene_length, queryid, matches, bug, alignment_length,
          subject_start_index, subject_stop_index) = alignment_info
         # check the protein matches one allowed
         if protein_name in allowed_proteins:
             # if matches allowed, then add alignment
             alignments.add(protein_name, gene_length, queryid, matches, 
-                           bug, alignment_length)
+                           bug, alignment_length, unaligned_reads_store.get_read_count(queryid))
                         
             # remove the id of the alignment from the unaligned reads store
             unaligned_reads_store.remove_id(queryid)
@@ -0,0 +1,403 @@
+"""
+HUMAnN2: server module
+Run jobs submitted over a local (unix domain) socket
+
+Copyright (c) 2014 Harvard School of Public Health
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+
+The protocol is one json object per line in each direction. The client sends
+a request, one of:
+
+    {"command": "run", "args": [humann2 options], "cwd": "/path"}
+    {"command": "ping"}
+    {"command": "shutdown"}
+
+The server replies with a stream of events, each with an "event" key:
+
+    queued    : the max number of jobs are running so the job will start once one finishes
+                (with the "position" in the queue)
+    accepted  : the job has started (with the "pid" of the job process)
+    output    : text the job printed (with the "text" and the "stream", stdout or stderr)
+    log       : a log message from the job (with the "level" and "message")
+    completed : the job finished (with the "output_files")
+    failed    : the job did not finish (with the "error")
+    ready     : reply to a ping (with the "version" and the number of "jobs" running and "queued")
+    shutdown  : reply to a shutdown
+"""
+
+import os
+import sys
+import json
+import signal
+import socket
+import logging
+import traceback
+import collections
+
+from . import config
+
+# name global logging instance
+logger=logging.getLogger(__name__)
+
+# the seconds to wait for a client to send a request
+REQUEST_TIMEOUT=30
+
+def check_platform():
+    """
+    Check unix domain sockets and fork are available
+    """
+
+    if not hasattr(socket, "AF_UNIX") or not hasattr(os, "fork"):
+        sys.exit("CRITICAL ERROR: The humann2 server requires unix domain sockets " +
+            "and fork which are not available on this platform.")
+
+def encode_message(message):
+    """
+    Return the message as a line of json
+    """
+
+    return (json.dumps(message) + "\n").encode("utf-8")
+
+def read_message(file_handle):
+    """
+    Read a line of json from the socket file
+    Return None if the socket is closed
+    """
+
+    line=file_handle.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+class EventStream(object):
+    """
+    Send events to the client
+    If the client disconnects the job continues without sending events
+    """
+
+    def __init__(self, connection):
+        self.connection=connection
+        self.closed=False
+
+    def send(self, event, **data):
+        data["event"]=event
+        if self.closed:
+            return
+        try:
+            self.connection.sendall(encode_message(data))
+        except EnvironmentError:
+            self.closed=True
+
+class EventOutput(object):
+    """
+    A file object which sends the text written as output events
+    """
+
+    def __init__(self, events, stream):
+        self.events=events
+        self.stream=stream
+
+    def write(self, text):
+        if text:
+            self.events.send("output", text=text, stream=self.stream)
+
+    def flush(self):
+        pass
+
+class EventLogHandler(logging.Handler):
+    """
+    A logging handler which sends the log messages as log events
+    """
+
+    def __init__(self, events, level=logging.INFO):
+        logging.Handler.__init__(self, level)
+        self.events=events
+
+    def emit(self, record):
+        try:
+            self.events.send("log", level=record.levelname, message=record.getMessage())
+        except Exception:
+            self.handleError(record)
+
+def run_job(connection, request, job_function):
+    """
+    Run the job, sending the progress events to the client
+    """
+
+    events=EventStream(connection)
+    events.send("accepted", pid=os.getpid())
+
+    # send the text printed and the log messages to the client
+    stdout, stderr=sys.stdout, sys.stderr
+    sys.stdout=EventOutput(events, "stdout")
+    sys.stderr=EventOutput(events, "stderr")
+    log_handler=EventLogHandler(events)
+    logging.getLogger("humann2").addHandler(log_handler)
+
+    status=0
+    try:
+        output_files=job_function(request)
+        events.send("completed", output_files=output_files or [])
+    except SystemExit as e:
+        status=1
+        events.send("failed", error=str(e.code) if e.code is not None else "")
+    except Exception:
+        status=1
+        events.send("failed", error=traceback.format_exc())
+    finally:
+        logging.getLogger("humann2").removeHandler(log_handler)
+        sys.stdout, sys.stderr=stdout, stderr
+
+    return status
+
+def check_socket_in_use(socket_path):
+    """
+    Exit if a server is running on the socket, otherwise remove the stale socket file
+    """
+
+    if not os.path.exists(socket_path):
+        return
+
+    client=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except EnvironmentError:
+        os.remove(socket_path)
+        return
+    finally:
+        client.close()
+
+    sys.exit("CRITICAL ERROR: A humann2 server is already running on the socket: " + socket_path)
+
+def warm_file_cache(folders):
+    """
+    Read the database files so they are in the file system cache
+    """
+
+    for folder in folders:
+        if not folder or not os.path.isdir(folder):
+            continue
+        for file in sorted(os.listdir(folder)):
+            file=os.path.join(folder, file)
+            if not os.path.isfile(file):
+                continue
+            logger.info("Warm file cache: " + file)
+            try:
+                with open(file, "rb") as file_handle:
+                    while file_handle.read(config.file_cache_read_size):
+                        pass
+            except EnvironmentError:
+                logger.warning("Unable to read file to warm cache: " + file)
+
+def remove_finished_jobs(jobs):
+    """
+    Remove the process ids of the jobs which have finished
+    """
+
+    for pid in list(jobs):
+        if os.waitpid(pid, os.WNOHANG)[0]:
+            jobs.discard(pid)
+
+def start_job(server, connection, request, job_function, queued):
+    """
+    Run the job in a forked process and return the process id
+    """
+
+    logger.info("Start job: " + " ".join(request.get("args",[])))
+    pid=os.fork()
+    if pid == 0:
+        server.close()
+        for queued_connection, queued_request in queued:
+            queued_connection.close()
+        status=1
+        try:
+            status=run_job(connection, request, job_function)
+        finally:
+            os._exit(status)
+    connection.close()
+    return pid
+
+def serve(socket_path, job_function, processes=1, version=""):
+    """
+    Accept requests on the socket until a shutdown request is received
+    Each job is run in a forked process so it shares the memory of the server
+    Jobs are queued if the max number are running (and started as the running jobs finish)
+    """
+
+    check_platform()
+
+    socket_path=os.path.abspath(socket_path)
+    check_socket_in_use(socket_path)
+
+    server=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # only the user running the server can connect as the jobs run with the server user
+    # (set the umask while binding so the socket is never created with other permissions)
+    umask=os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    server.settimeout(1)
+
+    # stop the server on a terminate signal
+    # this is only possible when the server is run in the main thread
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    try:
+        signal.signal(signal.SIGTERM, terminate)
+    except ValueError:
+        pass
+
+    message="Server listening on socket: " + socket_path
+    logger.info(message)
+    print(message)
+
+    jobs=set()
+    queued=collections.deque()
+    try:
+        while True:
+            remove_finished_jobs(jobs)
+
+            # start the queued jobs if fewer than the max number are running
+            while queued and len(jobs) < processes:
+                connection, request=queued.popleft()
+                jobs.add(start_job(server, connection, request, job_function, queued))
+
+            try:
+                connection, address=server.accept()
+            except socket.timeout:
+                continue
+
+            connection.settimeout(REQUEST_TIMEOUT)
+            try:
+                request=read_message(connection.makefile("rb"))
+            except (EnvironmentError, ValueError):
+                request=None
+            connection.settimeout(None)
+
+            if not isinstance(request, dict):
+                connection.close()
+                continue
+
+            command=request.get("command","run")
+            if command == "ping":
+                remove_finished_jobs(jobs)
+                connection.sendall(encode_message({"event": "ready", "version": version,
+                    "jobs": len(jobs), "queued": len(queued)}))
+                connection.close()
+                continue
+            elif command == "shutdown":
+                connection.sendall(encode_message({"event": "shutdown"}))
+                connection.close()
+                break
+            elif command != "run":
+                connection.sendall(encode_message({"event": "failed",
+                    "error": "Unknown command: " + str(command)}))
+                connection.close()
+                continue
+
+            # queue the job if the max number are running
+            # (the server keeps accepting requests so it still replies to ping and shutdown)
+            if len(jobs) >= processes:
+                try:
+                    connection.sendall(encode_message({"event": "queued",
+                        "position": len(queued)+1}))
+                except EnvironmentError:
+                    connection.close()
+                    continue
+                logger.info("Queue job: " + " ".join(request.get("args",[])))
+                queued.append((connection, request))
+                continue
+
+            jobs.add(start_job(server, connection, request, job_function, queued))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        # the queued jobs are not run
+        for connection, request in queued:
+            try:
+                connection.sendall(encode_message({"event": "failed",
+                    "error": "CRITICAL ERROR: The humann2 server stopped before the job started."}))
+            except EnvironmentError:
+                pass
+            connection.close()
+
+    # wait for the running jobs to finish
+    for pid in jobs:
+        os.waitpid(pid, 0)
+
+    message="Server stopped"
+    logger.info(message)
+    print(message)
+
+def send_request(socket_path, request):
+    """
+    Send the request to the server and yield the events returned
+    """
+
+    check_platform()
+
+    client=socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except EnvironmentError:
+        sys.exit("CRITICAL ERROR: Unable to connect to the humann2 server on the socket: " +
+            socket_path)
+
+    try:
+        client.sendall(encode_message(request))
+        file_handle=client.makefile("rb")
+        while True:
+            event=read_message(file_handle)
+            if event is None:
+                break
+            yield event
+    finally:
+        client.close()
+
+def submit(socket_path, args, verbose=False):
+    """
+    Submit a job to the server and print the progress
+    Return the output files created
+    """
+
+    request={"command": "run", "args": args, "cwd": os.getcwd()}
+
+    for event in send_request(socket_path, request):
+        if event["event"] == "output":
+            stream=sys.stderr if event.get("stream") == "stderr" else sys.stdout
+            stream.write(event["text"])
+            stream.flush()
+        elif event["event"] == "queued" and verbose:
+            print("Job queued until one of the running jobs finishes")
+        elif event["event"] == "log" and verbose:
+            print(event["level"] + ": " + event["message"])
+        elif event["event"] == "completed":
+            return event["output_files"]
+        elif event["event"] == "failed":
+            sys.exit(event["error"])
+
+    sys.exit("CRITICAL ERROR: The humann2 server closed the connection before the job completed.")
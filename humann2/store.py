@@ -34,6 +34,21 @@ import math
 import sys
 import gzip
 import bz2
+import hashlib
+import tempfile
+import gc
+import shutil
+import threading
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 from . import config
 from . import utilities
@@ -110,10 +125,12 @@ class Alignments:
         self.__scores_by_bug_gene={}
         self.__gene_counts={}
         self.__bug_counts={}
+        self.__query_weights={}
         self.__id_mapping={}   
         
         self.__temp_alignments_file=None
         self.__temp_alignments_file_handle=None
+        self.__saved_temp_alignments_file=None
         self.__delimiter="\t"
         
         if minimize_memory_use:
@@ -195,7 +212,52 @@ class Alignments:
         
         self.__temp_alignments_file=None
         self.__temp_alignments_file_handle=None
+
+    def save_checkpoint_files(self, file_prefix):
+        """
+        Copy the temp alignments file (if any) to be included by path when next pickled
+        Return the list of files saved
+        """
         
+        self.__saved_temp_alignments_file=None
+        if self.__temp_alignments_file:
+            try:
+                self.__temp_alignments_file_handle.flush()
+            except (EnvironmentError, ValueError):
+                pass
+            self.__saved_temp_alignments_file=file_prefix+".temp_alignments"
+            shutil.copyfile(self.__temp_alignments_file, self.__saved_temp_alignments_file)
+            return [self.__saved_temp_alignments_file]
+        return []
+
+    def __getstate__(self):
+        """
+        Include a copy of the temp alignments file in place of the file when pickled
+        (the copy is on disk so the alignments are not all read into memory)
+        """
+
+        saved_temp_alignments_file=self.__saved_temp_alignments_file
+        self.__saved_temp_alignments_file=None
+        if self.__temp_alignments_file and not saved_temp_alignments_file:
+            saved_temp_alignments_file=self.save_checkpoint_files(
+                utilities.unnamed_temp_file("pickled_alignments"))[0]
+            self.__saved_temp_alignments_file=None
+
+        state=self.__dict__.copy()
+        state["_Alignments__temp_alignments_file"]=None
+        state["_Alignments__temp_alignments_file_handle"]=None
+        state["_Alignments__saved_temp_alignments_file"]=saved_temp_alignments_file
+        return state
+
+    def __setstate__(self, state):
+        saved_temp_alignments_file=state.pop("_Alignments__saved_temp_alignments_file",None)
+        self.__dict__.update(state)
+        self.__saved_temp_alignments_file=None
+        if saved_temp_alignments_file:
+            self.create_temp_alignments_file()
+            with open(saved_temp_alignments_file, "rt") as file_handle:
+                shutil.copyfileobj(file_handle, self.__temp_alignments_file_handle)
+
     def process_id_mapping(self,file):
         """
         Process the id mapping file
@@ -286,7 +348,7 @@ class Alignments:
 
         return [gene,length,bug]
 
-    def add_annotated(self, query, matches, annotated_reference, read_length=None):
+    def add_annotated(self, query, matches, annotated_reference, read_length=None, weight=None):
         """
         Add an alignment with an annotated reference
         """
@@ -294,17 +356,24 @@ class Alignments:
         # Obtain the reference id length and bug
         [referenceid,length,bug]=self.process_reference_annotation(annotated_reference)
         
-        self.add(referenceid, length, query, matches, bug, read_length)
+        self.add(referenceid, length, query, matches, bug, read_length, weight)
 
-    def add(self, reference, reference_length, query, matches, bug, read_length=None): 
+    def add(self, reference, reference_length, query, matches, bug, read_length=None, weight=None): 
         """ 
         Add the hit to the list
         Add the index of the hit to the bugs list and gene list
+        The weight is the number of reads represented by the query (ie duplicate reads)
         """
         
         # set default read length
         if read_length is None:
             read_length = 1
+            
+        # set default weight
+        if weight is None:
+            weight = 1
+        elif weight != 1:
+            self.__query_weights[query]=weight
         
         if reference_length==0:
             reference_length=config.default_reference_length
@@ -318,8 +387,8 @@ class Alignments:
             score=0.0
             
         # Increase the counts for gene and bug
-        self.__bug_counts[bug]=self.__bug_counts.get(bug,0)+1
-        self.__gene_counts[reference]=self.__gene_counts.get(reference,0)+1
+        self.__bug_counts[bug]=self.__bug_counts.get(bug,0)+weight
+        self.__gene_counts[reference]=self.__gene_counts.get(reference,0)+weight
             
         # Add to the scores by query and store if query has multiple scores
         if query in self.__total_scores_by_query:
@@ -335,7 +404,7 @@ class Alignments:
         
         # Store the scores by bug and gene
         normalized_reference_length=normalized_gene_length(reference_length, read_length)
-        normalized_score=1/normalized_reference_length
+        normalized_score=1/normalized_reference_length*weight
         if bug in self.__scores_by_bug_gene:
             self.__scores_by_bug_gene[bug][reference]=self.__scores_by_bug_gene[bug].get(reference,0)+normalized_score
         else:
@@ -363,6 +432,12 @@ class Alignments:
         Return total number of genes
         """
         return len(self.__gene_counts)      
+    
+    def count_alignments(self):
+        """
+        Return total number of alignments (including the duplicate reads each represents)
+        """
+        return sum(self.__bug_counts.values())
             
     def counts_by_bug(self):
         """
@@ -440,7 +515,9 @@ class Alignments:
         
         query_normalize=self.__total_scores_by_query[query]
         
-        original_score=1/length
+        # scale by the number of reads the query represents
+        weight=self.__query_weights.get(query,1)
+        original_score=1/length*weight
         updated_score=score/query_normalize*original_score
         self.__scores_by_bug_gene[bug][reference]=self.__scores_by_bug_gene[bug][reference]-original_score+updated_score
         
@@ -475,8 +552,8 @@ class Alignments:
             total_gene_families_for_bug=len(self.__scores_by_bug_gene[bug])
             messages.append(bug + " : " + str(total_gene_families_for_bug) + " gene families")
              
-        # add all gene scores to structure
-        gene_scores_store.add(all_gene_scores,"all")
+        # add all gene scores to structure (these are the sum of the bugs)
+        gene_scores_store.add(all_gene_scores,"all",all_is_sum_of_bugs=True)
         
         # print messages if in verbose mode
         message="\n".join(messages)
@@ -496,8 +573,37 @@ class Alignments:
         self.__scores_by_bug_gene.clear()
         self.__gene_counts.clear()
         self.__bug_counts.clear()
+        self.__query_weights.clear()
 
         
+def read_gene_table(file):
+    """
+    Yield the data (gene and value) for each line of the gene table
+    Biom files are read in process if the biom package is installed
+    """
+    
+    from . import biom_tables
+    from . import columnar_tables
+    
+    if biom_tables.is_biom_table(file) and biom_tables.biom_installed():
+        for data in biom_tables.read_table(file):
+            yield data
+    elif columnar_tables.is_columnar_table(file):
+        # use the values for the first sample
+        table=columnar_tables.ColumnarTable(file)
+        for feature, stratum, values in table.rows():
+            if not stratum is None:
+                feature+=config.gene_table_category_delimiter+stratum
+            yield [feature, values[0] if values else ""]
+        table.close()
+    else:
+        file_handle=open(file,"rt")
+        for line in file_handle:
+            # Ignore comment lines
+            if not re.search(config.gene_table_comment_indicator,line):
+                yield line.rstrip().split(config.gene_table_delimiter)
+        file_handle.close()
+        
 class GeneScores:
     """
     Holds scores for all of the genes
@@ -505,12 +611,17 @@ class GeneScores:
     
     def __init__(self):
         self.__scores={}
+        self.__all_is_sum_of_bugs=False
         
-    def add(self,gene_scores,bug):
+    def add(self,gene_scores,bug,all_is_sum_of_bugs=False):
         """ 
         Add gene scores for a specific bug
+        For "all" set if the scores are the sum of the scores of the bugs already added
         """
         
+        # adding scores for any bug could change the sum of the bugs
+        self.__all_is_sum_of_bugs=all_is_sum_of_bugs and bug == "all"
+        
         if bug in self.__scores:
             self.__scores[bug]=dict(list(self.__scores[bug].items()) + list(gene_scores.items()))
         else:
@@ -521,11 +632,19 @@ class GeneScores:
         Add a score for a specific bug and gene
         """
 
+        self.__all_is_sum_of_bugs=False
         if bug in self.__scores:
             self.__scores[bug][gene]=score
         else:
             self.__scores[bug]={gene:score}
         
+    def all_is_sum_of_bugs(self):
+        """
+        Return True if the scores for "all" are the sum of the scores of the bugs
+        """
+        
+        return self.__all_is_sum_of_bugs
+        
     def count_genes_for_bug(self,bug):
         """
         Count the total number of genes stored for all bugs
@@ -609,49 +728,40 @@ class GeneScores:
         # Check the file exists and is readable
         utilities.file_exists_readable(file)
          
-        file_handle=open(file,"rt")
-         
-        line=file_handle.readline()
-        while line:
-            # Ignore comment lines
-            if not re.search(config.gene_table_comment_indicator,line):
-                data=line.rstrip().split(config.gene_table_delimiter)
-                gene=""
-                bug="all"
+        for data in read_gene_table(file):
+            gene=""
+            bug="all"
+            
+            # Use id mapping if present
+            if id_mapping:
+                if data[config.gene_table_gene_index] in id_mapping:
+                     [gene,length,bug]=id_mapping[data[config.gene_table_gene_index]]
+            
+            # If gene not set with id mapping, then process
+            if not gene:
+                if config.gene_table_category_delimiter in data[config.gene_table_gene_index]:
+                    gene_data=data[config.gene_table_gene_index].split(
+                        config.gene_table_category_delimiter)
+                    gene=gene_data[0]
+                    bug=gene_data[1]
+                else:
+                    gene=data[config.gene_table_gene_index]
                 
-                # Use id mapping if present
-                if id_mapping:
-                    if data[config.gene_table_gene_index] in id_mapping:
-                         [gene,length,bug]=id_mapping[data[config.gene_table_gene_index]]
+            # remove the name of the gene if present
+            if gene:
+                gene=gene.split(config.name_mapping_join)[0]
                 
-                # If gene not set with id mapping, then process
-                if not gene:
-                    if config.gene_table_category_delimiter in data[config.gene_table_gene_index]:
-                        gene_data=data[config.gene_table_gene_index].split(
-                            config.gene_table_category_delimiter)
-                        gene=gene_data[0]
-                        bug=gene_data[1]
-                    else:
-                        gene=data[config.gene_table_gene_index]
-                    
-                # remove the name of the gene if present
-                if gene:
-                    gene=gene.split(config.name_mapping_join)[0]
-                    
-                try:
-                    value=float(data[config.gene_table_value_index])
-                except (ValueError, IndexError):
-                    value=0
-                    if line.rstrip():
-                        logger.debug("Unable to convert gene table value to float: %s",
-                            line.rstrip())
-                if gene == config.unmapped_gene_name:
-                    unaligned_reads_count = value
-                else:
-                    self.add_single_score(bug,gene,value)
-            line=file_handle.readline()
-
-        file_handle.close()
+            try:
+                value=float(data[config.gene_table_value_index])
+            except (ValueError, IndexError):
+                value=0
+                if any(data):
+                    logger.debug("Unable to convert gene table value to float: %s",
+                        config.gene_table_delimiter.join(data))
+            if gene == config.unmapped_gene_name:
+                unaligned_reads_count = value
+            else:
+                self.add_single_score(bug,gene,value)
         
         return unaligned_reads_count
     
@@ -863,77 +973,183 @@ class Pathways:
         # Remove any pathways from the sorted list that are equivalent to zero based
         # on the precision selected for the output file
         # Double sort so that pathways with the same values are then sorted by name
-        sorted_pathways_list=list(filter(lambda pathway: float(utilities.format_float_to_string(self.get_score(pathway))) > 0, self.get_pathways_double_sorted()))
+        threshold=utilities.nonzero_threshold()
+        sorted_pathways_list=[pathway for pathway in self.get_pathways_double_sorted()
+            if self.get_score(pathway) >= threshold]
         
         sorted_pathways_and_bugs=[]
         # Get the bugs for each of the pathways
         for pathway in sorted_pathways_list:
             # Remove any zero values based on precision selected and double sort
-            bugs=list(filter(lambda bug: float(utilities.format_float_to_string(self.get_score_for_bug(bug, pathway))) > 0, self.get_bugs_double_sorted(pathway)))
+            bugs=[bug for bug in self.get_bugs_double_sorted(pathway) 
+                if self.get_score_for_bug(bug, pathway) >= threshold]
             sorted_pathways_and_bugs.append([pathway,bugs])
             
         return sorted_pathways_and_bugs
     
+def database_cache_key(database, *settings):
+    """
+    Return the key for the compiled database from the source file and the settings used to read it
+    """
+    
+    stat=os.stat(database)
+    return (config.database_cache_version, sys.version_info[0], os.path.abspath(database),
+        stat.st_mtime, stat.st_size) + settings
+
+def database_cache_file(database, kind, extension=None):
+    """
+    Return the compiled database file for the source file
+    """
+    
+    if extension is None:
+        extension=config.database_cache_extension
+    
+    name=hashlib.sha1(os.path.abspath(database).encode("utf-8")).hexdigest()
+    return os.path.join(config.cache_directory, config.database_cache_folder,
+        kind + "_" + name + "_py" + str(sys.version_info[0]) + extension)
+
+def read_database_cache(database, kind, key):
+    """
+    Return the compiled database data if the cache is not stale, otherwise None
+    """
+    
+    if config.database_cache_toggle != "on":
+        return None
+    
+    cache_file=database_cache_file(database, kind)
+    if not os.path.isfile(cache_file):
+        return None
+    
+    # pause garbage collection while the large number of objects are loaded
+    gc_enabled=gc.isenabled()
+    gc.disable()
+    data=None
+    try:
+        with open(cache_file, "rb") as file_handle:
+            # the key is stored first so stale caches are found without loading the data
+            if pickle.load(file_handle) == key:
+                data=pickle.load(file_handle)
+    except (EnvironmentError, EOFError, pickle.UnpicklingError, ValueError, TypeError, 
+            AttributeError, ImportError, IndexError):
+        logger.debug("Unable to read compiled database: " + cache_file)
+    finally:
+        if gc_enabled:
+            gc.enable()
+        
+    if data is None:
+        logger.debug("Compiled database is stale: " + cache_file)
+    else:
+        logger.debug("Load compiled database: " + cache_file)
+        
+    return data
+
+def write_database_cache(database, kind, key, data):
+    """
+    Write the compiled database data to the cache
+    """
+    
+    if config.database_cache_toggle != "on":
+        return
+    
+    from . import checkpoint
+    
+    cache_file=database_cache_file(database, kind)
+    cache_folder=os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+        # write to a temp file and then rename so other processes never read a partial file
+        with checkpoint.atomic_write(cache_file) as file_handle:
+            pickle.dump(key, file_handle, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(data, file_handle, pickle.HIGHEST_PROTOCOL)
+        logger.debug("Write compiled database: " + cache_file)
+    except (EnvironmentError, pickle.PicklingError):
+        logger.warning("Unable to write compiled database: " + cache_file)
+
 class ReactionsDatabase:
     """
     Holds all of the genes/reactions data from the file provided
     """
     
+    def _load_database(self, database):
+        """
+        Read in the reactions data from the database file
+        """
+        
+        if database.endswith(".gz"):
+            file_handle = gzip.open(database, "rt")
+        elif database.endswith(".bz2"):
+            # read the bz2 file in binary and then decode for python2/3 compatibility
+            file_handle = bz2.BZ2File(database, "r")
+        else:
+            file_handle=open(database,"rt")
+         
+        # database is expected to contain a single line per reaction
+        # this line begins with the reaction name and ec number and is followed 
+        # by all genes associated with the reaction
+         
+        for line in file_handle:
+            if isinstance(line, bytes):
+                line=line.decode('utf-8')
+            data=line.rstrip().split(config.reactions_database_delimiter)
+            if len(data)>2:
+                reaction=data.pop(0)
+                
+                if config.pathways_ec_column:
+                    ec_number=data.pop(0)
+             
+                # store the data
+                self.__reactions_to_genes[reaction]=data
+             
+                for gene in data:
+                    self.__genes_to_reactions.setdefault(gene,[]).append(reaction)
+             
+        file_handle.close()
+    
     def __init__(self, database=None):
         """
         Load in the reactions data from the database
+        Use the compiled database from the cache if it is not stale
         """
         self.__reactions_to_genes={}
         self.__genes_to_reactions={}
+        self.__source_key=None
         
         if not database is None:
             # Check the database file exists and is readable
             utilities.file_exists_readable(database)
             
-            if database.endswith(".gz"):
-                file_handle = gzip.open(database, "rt")
-                readlines = file_handle.readlines()
-            elif database.endswith(".bz2"):
-                # read the bz2 file in binary and then decode for python2/3 compatibility
-                file_handle = bz2.BZ2File(database, "r")
-                readlines = [line.decode('utf-8') for line in file_handle.readlines()]
+            self.__source_key=database_cache_key(database, config.pathways_ec_column, 
+                config.reactions_database_delimiter)
+            cached=read_database_cache(database, "reactions", self.__source_key)
+            
+            if cached is None:
+                self._load_database(database)
+                write_database_cache(database, "reactions", self.__source_key,
+                    (self.__reactions_to_genes, self.__genes_to_reactions))
             else:
-                file_handle=open(database,"rt")
-                readlines = file_handle.readlines()
-             
-            # database is expected to contain a single line per reaction
-            # this line begins with the reaction name and ec number and is followed 
-            # by all genes associated with the reaction
-             
-            for line in readlines:
-                data=line.rstrip().split(config.reactions_database_delimiter)
-                if len(data)>2:
-                    reaction=data.pop(0)
-                    
-                    if config.pathways_ec_column:
-                        ec_number=data.pop(0)
-                 
-                    # store the data
-                    self.__reactions_to_genes[reaction]=data
-                 
-                    for gene in data:
-                        if gene in self.__genes_to_reactions:
-                            self.__genes_to_reactions[gene]+=[reaction]
-                        else:
-                            self.__genes_to_reactions[gene]=[reaction]    
-                 
-            file_handle.close()
+                self.__reactions_to_genes, self.__genes_to_reactions = cached
+        
+    def source_key(self):
+        """
+        Return the key of the source database file (None if not read from a file)
+        """
+        
+        return self.__source_key
         
     def add_reactions(self, reactions):
         """
         Add these reactions and genes
         """
         
+        # the database no longer matches the source file
+        self.__source_key=None
+        
         for reaction in reactions:
-            self.__reactions_to_genes[reaction]=self.__reactions_to_genes.get(reaction,[])+reactions[reaction]
+            self.__reactions_to_genes.setdefault(reaction,[]).extend(reactions[reaction])
             
             for gene in reactions[reaction]:
-                self.__genes_to_reactions[gene]=self.__genes_to_reactions.get(gene,[])+[reaction]
+                self.__genes_to_reactions.setdefault(gene,[]).append(reaction)
         
     def find_reactions(self,gene):
         """
@@ -974,6 +1190,34 @@ class ReactionsDatabase:
             
         return present
     
+def compile_pathway_structure(structure, key_reactions):
+    """
+    Compile the nested pathway structure into a flat program of nodes in post-order
+    Each node is the join, the required items (key reactions or the index of a prior node),
+    and the optional reactions, in the order of the structure
+    The last node in the program is the full pathway
+    """
+    
+    key_reactions=set(key_reactions)
+    program=[]
+    
+    def compile_node(node):
+        required=[]
+        optional=[]
+        for item in node[1:]:
+            if isinstance(item, list):
+                required.append(compile_node(item))
+            elif item in key_reactions:
+                required.append(item)
+            else:
+                optional.append(item)
+        program.append((node[0], tuple(required), tuple(optional)))
+        return len(program)-1
+    
+    compile_node(structure)
+    
+    return tuple(program)
+
 class PathwaysDatabase:
     """
     Holds all of the reactions/pathways data from the file provided
@@ -1096,6 +1340,9 @@ class PathwaysDatabase:
             # Store the list of key reactions for the pathway
             self.__key_reactions[pathway]=key_reactions
             
+            # Compile the structure to compute abundance and coverage
+            self.__pathways_program[pathway]=compile_pathway_structure(structure, key_reactions)
+            
             # Update the reactions dictionary to contain the list of reactions instead of the structure string
             reactions[pathway]=reaction_list
         
@@ -1108,58 +1355,82 @@ class PathwaysDatabase:
         
         for pathway in reactions:
             for reaction in reactions[pathway]:
-                self.__pathways_to_reactions[pathway]=self.__pathways_to_reactions.get(
-                    pathway,[]) + [reaction]
-                self.__reactions_to_pathways[reaction]=self.__reactions_to_pathways.get(
-                    reaction,[]) + [pathway]
+                self.__pathways_to_reactions.setdefault(pathway,[]).append(reaction)
+                self.__reactions_to_pathways.setdefault(reaction,[]).append(pathway)
+                
+    def _load_database(self, database, reaction_names=None):
+        """
+        Read in the pathways data from the database file
+        """
+        
+        file_handle=open(database,"rt")
+         
+        # database is expected to contain a single line per pathway
+        # this line begins with the pathway name and is followed 
+        # by all reactions and/or pathways associated with the pathway
+         
+        reactions={}
+        structured_pathway=False
+        for line in file_handle:
+            data=line.strip().split(config.pathways_database_delimiter)
+            if len(data)>1:
+                # replace any white spaces with underscores
+                pathway=data.pop(0).replace(" ","_")
+                reactions[pathway]=data
+
+                # check to see if the pathway has structure
+                if "(" in data[0]:
+                    structured_pathway=True
+        
+        file_handle.close()
+        
+        # if this is a structured pathways set, then store the structure
+        if structured_pathway:
+            # use a set for fast lookups of the reaction names
+            if not reaction_names is None:
+                reaction_names=set(reaction_names)
+            reactions=self._set_pathways_structure(reactions, reaction_names)
+        
+        self._store_pathways(reactions)
 
     def __init__(self, database=None, reactions_database=None):
         """
         Load in the pathways data from the database
+        Use the compiled database from the cache if it is not stale
         """
         self.__pathways_to_reactions={}
         self.__reactions_to_pathways={}
         self.__pathways_structure={}
         self.__key_reactions={}
+        self.__pathways_program={}
         
         reaction_names=None
+        reactions_key=None
         if not reactions_database is None:
             reaction_names=reactions_database.reaction_list()
+            reactions_key=reactions_database.source_key()
         
         if not database is None:
             # Check the database file exists and is readable
             utilities.file_exists_readable(database)
             
-            file_handle=open(database,"rt")
-             
-            line=file_handle.readline()
-             
-            # database is expected to contain a single line per pathway
-            # this line begins with the pathway name and is followed 
-            # by all reactions and/or pathways associated with the pathway
-             
-            reactions={}
-            structured_pathway=False
-            while line:
-                data=line.strip().split(config.pathways_database_delimiter)
-                if len(data)>1:
-                    # replace any white spaces with underscores
-                    pathway=data.pop(0).replace(" ","_")
-                    reactions[pathway]=data
-    
-                    # check to see if the pathway has structure
-                    if "(" in data[0]:
-                        structured_pathway=True
-                    
-                line=file_handle.readline()
-            
-            file_handle.close()
-            
-            # if this is a structured pathways set, then store the structure
-            if structured_pathway:
-                reactions=self._set_pathways_structure(reactions, reaction_names)
-            
-            self._store_pathways(reactions)
+            # the structure depends on the reaction names so the cache can only be used
+            # if the reactions database was also read from a file
+            cached=None
+            key=None
+            if reactions_database is None or not reactions_key is None:
+                key=database_cache_key(database, reactions_key, config.pathways_database_delimiter)
+                cached=read_database_cache(database, "pathways", key)
+                
+            if cached is None:
+                self._load_database(database, reaction_names)
+                if not key is None:
+                    write_database_cache(database, "pathways", key, (self.__pathways_to_reactions,
+                        self.__reactions_to_pathways, self.__pathways_structure, self.__key_reactions,
+                        self.__pathways_program))
+            else:
+                (self.__pathways_to_reactions, self.__reactions_to_pathways, 
+                    self.__pathways_structure, self.__key_reactions, self.__pathways_program) = cached
             
     def is_structured(self):
         """
@@ -1197,6 +1468,14 @@ class PathwaysDatabase:
         
         return copy.deepcopy(self.__pathways_structure.get(pathway, [])) 
         
+    def get_program_for_pathway(self,pathway):
+        """
+        Return the compiled structure for a pathway
+        The program is shared so it is not copied
+        """
+        
+        return self.__pathways_program.get(pathway, ())
+        
     def get_key_reactions_for_pathway(self,pathway):
         """
         Return the key reactions for a pathway
@@ -1243,6 +1522,105 @@ class PathwaysDatabase:
                 config.pathways_database_delimiter.join(self.__pathways_to_reactions[pathway]))
         return "\n".join(data)
     
+def taxon_names(bug):
+    """
+    Return the genus and species for the bug (ie g__Genus.s__Genus_species)
+    The names are empty strings if not included
+    """
+    
+    genus=""
+    species=""
+    for item in bug.split(config.taxon_pathways_bug_delimiter):
+        if item.startswith("g__"):
+            genus=item[3:].replace("_"," ")
+        elif item.startswith("s__"):
+            species=item[3:].replace("_"," ")
+            
+    return genus, species
+
+class TaxonPathways:
+    """
+    Holds the pathways known for each genus and species (ie the MetaCyc organisms)
+    """
+    
+    def __init__(self, file=None):
+        """
+        Read the pathways to organisms file (a pathway followed by a list of organisms)
+        """
+        
+        self.__pathways=set()
+        self.__pathways_by_genus={}
+        self.__pathways_by_species={}
+        
+        if file:
+            self.add_from_file(file)
+        
+    def add(self, pathway, organisms):
+        """
+        Add the pathway for each of the organisms
+        """
+        
+        self.__pathways.add(pathway)
+        for organism in organisms:
+            names=organism.split()
+            if not names:
+                continue
+            self.__pathways_by_genus.setdefault(names[0],set()).add(pathway)
+            if len(names) > 1:
+                self.__pathways_by_species.setdefault(" ".join(names[:2]),set()).add(pathway)
+        
+    def add_from_file(self, file):
+        """
+        Read the pathways and organisms from the file
+        """
+        
+        try:
+            file_handle=open(file,"rt")
+        except EnvironmentError:
+            message="CRITICAL ERROR: Unable to read pathways to organisms file: " + file
+            logger.critical(message)
+            sys.exit(message)
+        
+        for line in file_handle:
+            data=line.rstrip("\n").split(config.pathways_database_delimiter)
+            if data[0]:
+                organisms=data[1].split(config.taxon_pathways_organism_delimiter) if len(data) > 1 else []
+                self.add(data[0], organisms)
+                
+        file_handle.close()
+        
+    def is_listed(self, pathway):
+        """
+        Check if the pathway is included (with or without organisms)
+        """
+        
+        return pathway in self.__pathways
+        
+    def pathways_for_bug(self, bug, level):
+        """
+        Return the set of pathways known for the bug at the level (genus or species)
+        For species the genus is used if there are not any pathways for the species
+        Return None if the bug is not restricted (ie all or no pathways known)
+        """
+        
+        genus, species=taxon_names(bug)
+        
+        pathways=None
+        if level == "species" and species:
+            pathways=self.__pathways_by_species.get(species)
+        if pathways is None and genus:
+            pathways=self.__pathways_by_genus.get(genus)
+            
+        return pathways
+        
+    def allowed(self, pathway, pathways):
+        """
+        Check if the pathway is allowed given the set of pathways for the bug
+        Pathways not included in the file are always allowed
+        """
+        
+        return pathways is None or pathway in pathways or not pathway in self.__pathways
+    
 class Reads:
     """
     Holds all of the reads data to create a fasta file
@@ -1255,6 +1633,9 @@ class Reads:
         sequence
         """
         
+        if not self.id_present(id):
+            self.__duplicate_reads_count+=self.get_read_count(id)-1
+        
         if self.__minimize_memory_use:
             self.__ids.add(id)
         else:
@@ -1311,6 +1692,8 @@ class Reads:
         self.__reads={}
         self.__ids=set()
         self.__initial_read_count=0
+        self.__read_counts={}
+        self.__duplicate_reads_count=0
         self.__file=file
         
         if minimize_memory_use:
@@ -1332,10 +1715,38 @@ class Reads:
         
         self.__file=file
 
+    def set_read_counts(self, read_counts):
+        """
+        Set the number of reads each id represents for reads collapsed as 
+        exact duplicates, ids not included represent a single read
+        """
+        
+        self.__read_counts=read_counts
+        self.__duplicate_reads_count=0
+        for id in self.id_list():
+            self.__duplicate_reads_count+=self.get_read_count(id)-1
+            
+    def get_read_count(self, id):
+        """
+        Return the number of reads the id represents
+        """
+        
+        return self.__read_counts.get(id,1)
+    
+    def id_present(self, id):
+        """
+        Check if the id is stored
+        """
+        
+        return id in self.__reads or id in self.__ids
+
     def remove_id(self, id):
         """
         Remove the id and sequence from the read structure
         """
+        if self.id_present(id):
+            self.__duplicate_reads_count-=self.get_read_count(id)-1
+            
         if id in self.__reads:
             del self.__reads[id]
         elif id in self.__ids:
@@ -1373,12 +1784,13 @@ class Reads:
     def count_reads(self):
         """
         Return the total number of reads stored
+        Include the duplicate reads represented by each id
         """
         
         if self.__reads:
-            return len(self.__reads.keys())
+            return len(self.__reads.keys())+self.__duplicate_reads_count
         else:
-            return len(self.__ids)
+            return len(self.__ids)+self.__duplicate_reads_count
     
     def clear(self):
         """
@@ -1387,6 +1799,8 @@ class Reads:
         
         self.__reads.clear()
         self.__ids.clear()
+        self.__read_counts={}
+        self.__duplicate_reads_count=0
         
     def set_initial_read_count(self,total):
         """
@@ -1405,14 +1819,99 @@ class Reads:
 class Names:
     """ 
     Holds all of the names that map to ids from a given file 
+    The names are looked up in an index of the file (built once and stored 
+    in the cache directory) so only the names for the ids requested are read
     """
     
+    def _read_file(self, file):
+        """
+        Yield the ids and names from the file
+        """
+        
+        # Test if this is a gzipped file
+        if file.endswith(".gz"):
+            file_handle = gzip.open(file, "rt")
+        elif file.endswith(".bz2"):
+            # read the file in binary and then decode for python2/3 compatibility
+            file_handle = bz2.BZ2File(file, "r")
+        else:
+            file_handle = open(file,"rt")
+            
+        for line in file_handle:
+            if isinstance(line, bytes):
+                line=line.decode('utf-8')
+            try:
+                data = line.rstrip().split(config.name_mapping_file_delimiter)
+                id = data[0]
+                name = data[1]
+            except IndexError:
+                id = ""
+            
+            if id:
+                yield id, name
+            
+        file_handle.close()
+        
+    def _build_index(self, file, key):
+        """
+        Write the index of the ids and names from the file
+        Return the index file (or None if it can not be written)
+        """
+        
+        index_file=database_cache_file(file, "names", config.name_mapping_index_extension)
+        
+        # check if the index is current
+        if os.path.isfile(index_file):
+            try:
+                connection=sqlite3.connect(index_file)
+                current=connection.execute("SELECT value FROM info WHERE name='key'").fetchone()
+                connection.close()
+                if current and current[0] == repr(key):
+                    return index_file
+            except sqlite3.Error:
+                pass
+        
+        logger.info("Build names index: " + index_file)
+        new_file=None
+        try:
+            index_folder=os.path.dirname(index_file)
+            if not os.path.isdir(index_folder):
+                os.makedirs(index_folder)
+            # write to a temp file and then rename so other processes never read a partial index
+            file_out, new_file=tempfile.mkstemp(dir=index_folder)
+            os.close(file_out)
+            connection=sqlite3.connect(new_file)
+            try:
+                connection.execute("CREATE TABLE info (name TEXT PRIMARY KEY, value TEXT)")
+                connection.execute("CREATE TABLE names (id TEXT PRIMARY KEY, name TEXT)")
+                # if an id is included more than once the last name is used
+                connection.executemany("INSERT OR REPLACE INTO names VALUES (?,?)", self._read_file(file))
+                connection.execute("INSERT INTO info VALUES ('key',?)", (repr(key),))
+                connection.commit()
+            finally:
+                connection.close()
+            os.rename(new_file, index_file)
+        except (EnvironmentError, sqlite3.Error):
+            logger.warning("Unable to write names index: " + index_file)
+            # remove the partial index
+            if new_file and os.path.isfile(new_file):
+                os.unlink(new_file)
+            return None
+        
+        return index_file
+    
     def __init__(self,file=None):
         """
-        Read in the names and store
+        Index the names file (or read in all names if an index can not be used)
         """
         
         self.__names={}
+        self.__file=file
+        self.__index_file=None
+        self.__index_key=None
+        self.__connection=None
+        self.__connection_pid=None
+        self.__lock=threading.Lock()
         
         # Check the file exists and is readable
         unreadable_file=False
@@ -1425,36 +1924,104 @@ class Names:
                 unreadable_file=True
                 logger.debug("Unable to read Names file: " + file)
             
-                       
-        # Test if this is a gzipped file
         if not unreadable_file:
-            if file.endswith(".gz"):
-                file_handle = gzip.open(file, "rt")
-                readlines = file_handle.readlines()
-            elif file.endswith(".bz2"):
-                # read the file in binary and then decode for python2/3 compatibility
-                file_handle = bz2.BZ2File(file, "r")
-                readlines = [line.decode('utf-8') for line in file_handle.readlines()]
-            else:
-                file_handle = open(file,"rt")
-                readlines = file_handle.readlines()
-                
-            for line in readlines:
-                try:
-                    data = line.rstrip().split(config.name_mapping_file_delimiter)
-                    id = data[0]
-                    name = data[1]
-                except IndexError:
-                    id = ""
+            if not sqlite3 is None and config.database_cache_toggle == "on":
+                self.__index_key=database_cache_key(file, config.name_mapping_file_delimiter)
+                self.__index_file=self._build_index(file, self.__index_key)
                 
-                if id:
+            if self.__index_file is None:
+                for id, name in self._read_file(file):
                     self.__names[id]=name
-                
-            file_handle.close()
+                    
+    def __getstate__(self):
+        """
+        Remove the connection to the index when pickled
+        """
+        
+        state=self.__dict__.copy()
+        state["_Names__connection"]=None
+        state["_Names__connection_pid"]=None
+        del state["_Names__lock"]
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock=threading.Lock()
+                    
+    def _connect(self):
+        """
+        Connect to the index, return False if the index is missing or is not for the names file
+        (the index could have been removed or replaced since it was built)
+        """
+        
+        # check the file exists as sqlite creates an empty database if it does not
+        if not os.path.isfile(self.__index_file):
+            return False
+        
+        try:
+            connection=sqlite3.connect(self.__index_file, check_same_thread=False)
+            current=connection.execute("SELECT value FROM info WHERE name='key'").fetchone()
+        except sqlite3.Error:
+            current=None
+            connection=None
             
-    def get_name(self,id):
+        if not current or current[0] != repr(self.__index_key):
+            if connection:
+                connection.close()
+            # remove the empty database if the index was removed while connecting
+            try:
+                if os.path.getsize(self.__index_file) == 0:
+                    os.unlink(self.__index_file)
+            except EnvironmentError:
+                pass
+            return False
+        
+        self.__connection=connection
+        self.__connection_pid=os.getpid()
+        return True
+    
+    def _read_names_without_index(self):
         """
-        Return the name for the given id
+        Read all of the names from the file if the index can not be used
+        """
+        
+        logger.warning("Unable to read from names index, reading all names from file: " + self.__file)
+        self.__index_file=None
+        self.__connection=None
+        for id, name in self._read_file(self.__file):
+            self.__names[id]=name
+                    
+    def _lookup(self, ids):
+        """
+        Read the names for the ids from the index
+        Names found (and ids not found) are stored so they are only read once
+        """
+        
+        ids=[id for id in set(ids) if not id in self.__names]
+        if not ids or self.__index_file is None:
+            return
+        
+        with self.__lock:
+            # connections can not be shared with forked processes
+            if self.__connection is None or self.__connection_pid != os.getpid():
+                if not self._connect():
+                    self._read_names_without_index()
+                    return
+            
+            try:
+                for start in range(0, len(ids), config.name_mapping_lookup_size):
+                    subset=ids[start:start+config.name_mapping_lookup_size]
+                    for id in subset:
+                        self.__names[id]=""
+                    query="SELECT id, name FROM names WHERE id IN ("+",".join(["?"]*len(subset))+")"
+                    for id, name in self.__connection.execute(query, subset):
+                        self.__names[id]=name
+            except sqlite3.Error:
+                self._read_names_without_index()
+                    
+    def _format_name(self, id):
+        """
+        Return the id joined with the name
         """
         
         name = self.__names.get(id,"")
@@ -1466,4 +2033,22 @@ class Names:
             name = id
         
         return name
+            
+    def get_name(self,id):
+        """
+        Return the name for the given id
+        """
+        
+        self._lookup([id])
+        
+        return self._format_name(id)
+    
+    def get_names(self,ids):
+        """
+        Return a dictionary of the names for the ids, reading all from the index at once
+        """
+        
+        self._lookup(ids)
+        
+        return dict((id, self._format_name(id)) for id in ids)
     
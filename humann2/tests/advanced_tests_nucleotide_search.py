@@ -154,6 +154,32 @@ class TestAdvancedHumann2NucleotideSearchFunctions(unittest.TestCase):
         # check the unaligned reads count
         self.assertEqual(unaligned_reads_store.count_reads(),cfg.sam_file_unaligned_reads_total_unaligned)
         
+    def test_nucleotide_search_unaligned_reads_read_count_duplicate_reads(self):
+        """
+        Test the unaligned reads and the store alignments
+        Test with a bowtie2/sam output file
+        Test the read counts include the duplicate reads collapsed
+        """
+        
+        # create a set of alignments
+        alignments=store.Alignments()
+        unaligned_reads_store=store.Reads()
+        unaligned_reads_store.set_read_counts({"r1|640753008.fna|4636351|4636502|_from_":3,
+            "r2|637000026.fna|5753889|5754040|_from_":2})
+        
+        # read in the aligned and unaligned reads
+        [unaligned_reads_file_fasta, reduced_aligned_reads_file] = nucleotide.unaligned_reads(
+            cfg.sam_file_unaligned_reads, alignments, unaligned_reads_store, keep_sam=True) 
+        
+        # remove temp files
+        utils.remove_temp_file(unaligned_reads_file_fasta)
+        utils.remove_temp_file(reduced_aligned_reads_file)
+        
+        # check the read counts
+        self.assertEqual(unaligned_reads_store.count_reads(),cfg.sam_file_unaligned_reads_total_unaligned+2)
+        self.assertEqual(unaligned_reads_store.get_initial_read_count(),
+            cfg.sam_file_unaligned_reads_total_unaligned+cfg.sam_file_unaligned_reads_total_aligned+3)
+        
     def test_nucleotide_search_unaligned_reads_read_count_unaligned_minimize_memory_use(self):
         """
         Test the unaligned reads and the store alignments
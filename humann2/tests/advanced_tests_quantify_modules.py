@@ -47,6 +47,31 @@ class TestHumann2QuantifyModulesFunctions(unittest.TestCase):
         
         self.assertEqual(abundance, expected_abundance)
         
+    def test_compute_pathway_program_abundance_or_coverage_embedded(self):
+        """
+        Test the compute_pathway_program_abundance_or_coverage function with an embedded OR
+        Test the program compiled by PathwaysDatabase gives the same result as the structure
+        """
+        
+        # Create the database structure
+        pathways_database_store=store.PathwaysDatabase()
+        structure_string=" A ( B , C ) -D ( E + -F ) "
+        pathways_database_store.add_pathway_structure("pathway1",structure_string)
+        
+        reaction_scores={ "A": 1, "B": 2, "C": 3, "D": 5, "E": 4, "F": 0.5}
+        structure=pathways_database_store.get_structure_for_pathway("pathway1")
+        key_reactions=pathways_database_store.get_key_reactions_for_pathway("pathway1")
+        program=pathways_database_store.get_program_for_pathway("pathway1")
+        
+        # Check the program is in post-order with the full pathway last
+        self.assertEqual(program,((",",("B","C"),()), ("+",("E",),("F",)), (" ",("A",0,1),("D",))))
+        
+        for coverage in [False, True]:
+            self.assertEqual(modules.compute_pathway_program_abundance_or_coverage(program,
+                reaction_scores, coverage, 2), 
+                modules.compute_structured_pathway_abundance_or_coverage(structure, key_reactions, 
+                reaction_scores, coverage, 2))
+        
     def test_compute_structured_pathway_abundance_or_coverage_test_abundance_with_OR(self):
         """
         Test the compute_structured_pathway_abundance_or_coverage function for abundance
@@ -565,6 +590,45 @@ class TestHumann2QuantifyModulesFunctions(unittest.TestCase):
         self.assertEqual(pathways_abundance_store_result.get_score_for_bug(bug,"pathway1"), coverage_pathway1)
         self.assertEqual(pathways_abundance_store_result.get_score_for_bug(bug,"pathway2"), coverage_pathway2)
         
+    def test_compute_pathways_abundance_and_coverage_processes(self):
+        """
+        Test the compute_pathways_abundance and compute_pathways_coverage functions
+        Test the results are the same with the bugs computed in a pool of processes
+        Test with structured pathways
+        """
+        
+        # Set xipe to off
+        config.xipe_toggle = "off"
+        
+        pathways_database_store=store.PathwaysDatabase()
+        pathways_database_store.add_pathway_structure("pathway1"," A B ( C , D ) ")
+        pathways_database_store.add_pathway_structure("pathway2"," A B C D E F ")
+        
+        pathways_and_reactions_store=store.PathwaysAndReactions()
+        for i, bug in enumerate(["all","bug1","bug2","bug3"]):
+            for j, reaction in enumerate(["A","B","C","D","E","F"]):
+                pathways_and_reactions_store.add(bug, reaction, "pathway2", i+j*3+1)
+                if reaction in ["A","B","C"]:
+                    pathways_and_reactions_store.add(bug, reaction, "pathway1", i*2+j+5)
+        
+        results={}
+        threads=config.threads
+        try:
+            for processes in [1,2]:
+                config.threads=processes
+                abundance, reactions=modules.compute_pathways_abundance(pathways_and_reactions_store, 
+                    pathways_database_store)
+                coverage=modules.compute_pathways_coverage(pathways_and_reactions_store, 
+                    pathways_database_store)
+                results[processes]=(abundance.get_pathways_and_bugs_nonzero_sorted(), reactions,
+                    [[coverage.get_score_for_bug(bug, pathway) for bug in ["all","bug1","bug2","bug3"]]
+                        for pathway in ["pathway1","pathway2"]])
+        finally:
+            config.threads=threads
+            
+        self.assertEqual(results[1], results[2])
+        self.assertEqual(len(results[1][0]), 2)
+        
     def test_pathways_coverage_with_names(self):
         """
         Test the pathways coverage computation (xipe and minpath are off)
@@ -754,6 +818,60 @@ class TestHumann2QuantifyModulesFunctions(unittest.TestCase):
         self.assertEqual(remaining_gene_abundance["bug1"], 4)
         self.assertAlmostEqual(remaining_gene_abundance["bug2"], 7.2)
         
+    def test_compute_reaction_scores(self):
+        """
+        Test the compute reaction scores function
+        Test the ReactionsDatabase add function
+        Test with genes mapping to multiple reactions and reactions without scores
+        """
+        
+        gene_scores=store.GeneScores()
+        gene_scores.add_single_score("bug1", "gene1", 1)
+        gene_scores.add_single_score("bug1", "gene2", 2)
+        gene_scores.add_single_score("bug1", "gene9", 9)
+        gene_scores.add_single_score("bug2", "gene1", 1.1)
+        gene_scores.add_single_score("bug2", "gene7", 7)
+        
+        reactions_database=store.ReactionsDatabase()
+        reactions={"reaction1":["gene1","gene6"], "reaction2":["gene1","gene2"],
+                   "reaction3":["gene4","gene7"],"reaction4":["gene8"]}
+        reactions_database.add_reactions(reactions)
+        
+        reaction_scores=modules.compute_reaction_scores(gene_scores, reactions_database)
+        
+        self.assertEqual(sorted(reaction_scores.keys()),["bug1","bug2"])
+        self.assertEqual(reaction_scores["bug1"],{"reaction1":1,"reaction2":3})
+        self.assertEqual(reaction_scores["bug2"],{"reaction1":1.1,"reaction2":1.1,"reaction3":7})
+        
+    def test_compute_reaction_scores_all_is_sum_of_bugs(self):
+        """
+        Test the compute reaction scores function
+        Test the all reaction scores are the sum of the bugs if the all gene scores are the sum
+        Test the all reaction scores are computed from the all gene scores otherwise
+        """
+        
+        reactions_database=store.ReactionsDatabase()
+        reactions={"reaction1":["gene1","gene6"], "reaction2":["gene1","gene2"],
+                   "reaction3":["gene4","gene7"],"reaction4":["gene8"]}
+        reactions_database.add_reactions(reactions)
+        
+        gene_scores=store.GeneScores()
+        gene_scores.add({"gene1": 1, "gene2": 2, "gene9": 9}, "bug1")
+        gene_scores.add({"gene1": 1.5, "gene7": 7}, "bug2")
+        gene_scores.add({"gene1": 2.5, "gene2": 2, "gene7": 7, "gene9": 9}, "all", all_is_sum_of_bugs=True)
+        
+        self.assertTrue(gene_scores.all_is_sum_of_bugs())
+        reaction_scores=modules.compute_reaction_scores(gene_scores, reactions_database)
+        self.assertEqual(reaction_scores["all"],{"reaction1":2.5,"reaction2":4.5,"reaction3":7})
+        self.assertEqual(list(reaction_scores["all"].keys()),["reaction1","reaction2","reaction3"])
+        
+        # the all gene scores read from a gene table are not always the sum of the bugs
+        gene_scores.add({"gene8": 8}, "all")
+        
+        self.assertFalse(gene_scores.all_is_sum_of_bugs())
+        reaction_scores=modules.compute_reaction_scores(gene_scores, reactions_database)
+        self.assertEqual(reaction_scores["all"],{"reaction1":2.5,"reaction2":4.5,"reaction3":7,"reaction4":8})
+        
     def test_compute_unmapped_and_unintegrated(self):
         """
         Test the unmapped and unintegrated function
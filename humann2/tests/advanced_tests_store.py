@@ -60,6 +60,38 @@ class TestAdvancedHumann2StoreFunctions(unittest.TestCase):
 
         self.assertEqual(gene_scores_store.get_score("bug1","gene3"),gene_score)
 
+    def test_Alignments_compute_gene_scores_weighted_query(self):
+        """
+        Test the compute_gene_scores function
+        Test a query with a weight has the same scores as duplicate queries
+        """
+        
+        for minimize_memory_use in [False, True]:
+            # add the duplicate reads as separate queries
+            alignments_store=store.Alignments(minimize_memory_use=minimize_memory_use)
+            gene_scores_store=store.GeneScores()
+            for query in ["Q1","Q2","Q3"]:
+                alignments_store.add("gene1", 2, query, 41.0, "bug1")
+                alignments_store.add("gene2", 3, query, 57.1, "bug2")
+            alignments_store.add("gene2", 3, "Q4", 61.0, "bug2")
+            alignments_store.convert_alignments_to_gene_scores(gene_scores_store)
+            
+            # add the duplicate reads as a single weighted query
+            weighted_alignments_store=store.Alignments(minimize_memory_use=minimize_memory_use)
+            weighted_gene_scores_store=store.GeneScores()
+            weighted_alignments_store.add("gene1", 2, "Q1", 41.0, "bug1", weight=3)
+            weighted_alignments_store.add("gene2", 3, "Q1", 57.1, "bug2", weight=3)
+            weighted_alignments_store.add("gene2", 3, "Q4", 61.0, "bug2")
+            weighted_alignments_store.convert_alignments_to_gene_scores(weighted_gene_scores_store)
+            
+            if minimize_memory_use:
+                alignments_store.delete_temp_alignments_file()
+                weighted_alignments_store.delete_temp_alignments_file()
+            
+            for bug, gene in [("bug1","gene1"),("bug2","gene2"),("all","gene1"),("all","gene2")]:
+                self.assertAlmostEqual(weighted_gene_scores_store.get_score(bug,gene),
+                    gene_scores_store.get_score(bug,gene))
+
     def test_Alignments_compute_gene_scores_single_gene_double_query(self):
         """
         Test the compute_gene_scores function
@@ -0,0 +1,150 @@
+import unittest
+import logging
+import tempfile
+import shutil
+import os
+
+import cfg
+import utils
+
+from humann2 import alignment_store
+from humann2 import store
+from humann2 import config
+from humann2.search import nucleotide
+from humann2.search import translated
+
+class TestHumann2AlignmentStoreFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.alignment_store
+    """
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.unnamed_temp_dir=config.unnamed_temp_dir
+        self.temp_dir=config.temp_dir
+        config.unnamed_temp_dir=self.tempdir
+        config.temp_dir=self.tempdir
+        self.thresholds=[config.identity_threshold, config.evalue_threshold,
+            config.translated_query_coverage_threshold, config.translated_subject_coverage_threshold]
+
+        # set up nullhandler for logger
+        logging.getLogger('humann2.search.translated').addHandler(logging.NullHandler())
+        logging.getLogger('humann2.search.blastx_coverage').addHandler(logging.NullHandler())
+
+    def tearDown(self):
+        config.unnamed_temp_dir=self.unnamed_temp_dir
+        config.temp_dir=self.temp_dir
+        [config.identity_threshold, config.evalue_threshold, config.translated_query_coverage_threshold,
+            config.translated_subject_coverage_threshold]=self.thresholds
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def store_and_quantify(self, alignments_function, nucleotide_stage):
+        """
+        Return the alignments store and the unaligned reads count from the post-processing function
+        and from the alignment store written and read
+        """
+
+        stored_alignments=alignment_store.AlignmentStore(nucleotide_stage=nucleotide_stage)
+        alignments_function(store.Alignments(), store.Reads(), stored_alignments)
+
+        file=os.path.join(self.tempdir,"demo"+alignment_store.FILE_EXTENSION)
+        stored_alignments.write(file)
+        self.assertTrue(alignment_store.is_alignment_store(file))
+
+        alignments=store.Alignments()
+        unaligned_reads_store=store.Reads()
+        alignment_store.AlignmentStore.read(file).quantify(alignments, unaligned_reads_store)
+
+        expected_alignments=store.Alignments()
+        expected_unaligned_reads_store=store.Reads()
+        alignments_function(expected_alignments, expected_unaligned_reads_store, None)
+
+        self.assertEqual(sorted(alignments.get_hit_list()), sorted(expected_alignments.get_hit_list()))
+        self.assertEqual(unaligned_reads_store.count_reads(), expected_unaligned_reads_store.count_reads())
+
+    def test_AlignmentStore_write_read(self):
+        """
+        Test the alignments and the settings are the same after the store is written and read
+        """
+
+        stored_alignments=alignment_store.AlignmentStore()
+        stored_alignments.add_unmapped("read1", 2)
+        stored_alignments.add_nucleotide("read2", "gene1|100", 98.5, 90.0)
+        stored_alignments.add_translated("read1", "gene2|300", 55.5, 30.0, 1e-10, 1, 90, 100, 5, 35, 2)
+
+        file=os.path.join(self.tempdir,"store"+alignment_store.FILE_EXTENSION)
+        stored_alignments.write(file)
+        loaded=alignment_store.AlignmentStore.read(file)
+
+        self.assertEqual(loaded.queries, ["read1","read2"])
+        self.assertEqual(loaded.references, ["gene1|100","gene2|300"])
+        self.assertEqual(list(loaded.query_columns["weight"]), [2,1])
+        self.assertEqual(list(loaded.query_columns["unmapped"]), [1,0])
+        self.assertEqual(list(loaded.nucleotide["identity"]), [98.5])
+        self.assertEqual(list(loaded.translated["evalue"]), [1e-10])
+        self.assertEqual(list(loaded.translated["subject_end"]), [35])
+        self.assertEqual(loaded.metadata["identity_threshold"], config.identity_threshold)
+        self.assertTrue(loaded.nucleotide_stage)
+
+    def test_AlignmentStore_read_not_store(self):
+        """
+        Test an error is raised for a file which is not an alignment store
+        """
+
+        self.assertFalse(alignment_store.is_alignment_store(cfg.demo_m8))
+        self.assertRaises(ValueError, alignment_store.AlignmentStore.read, cfg.demo_m8)
+
+    def test_AlignmentStore_allowed_proteins_without_range(self):
+        """
+        Test the proteins with only alignments without a subject range are not allowed
+        (as for the blastx coverage) even with a coverage threshold of zero
+        """
+
+        stored_alignments=alignment_store.AlignmentStore(nucleotide_stage=False)
+        stored_alignments.add_translated("read1", "gene1|300", 90.0, 30.0, 1e-10, 1, 90, 100, 10, 10)
+        stored_alignments.add_translated("read2", "gene2|300", 90.0, 30.0, 1e-10, 1, 90, 100, 5, 35)
+
+        config.translated_subject_coverage_threshold=0.0
+        allowed=stored_alignments.allowed_proteins([0,1], {0: ("gene1", 300, "unclassified"),
+            1: ("gene2", 300, "unclassified")})
+
+        self.assertEqual(allowed, set(["gene2"]))
+
+    def test_AlignmentStore_quantify_translated_thresholds(self):
+        """
+        Test the alignments from the store are the same as those from the translated
+        post-processing with the same thresholds (default and changed)
+        """
+
+        def alignments_function(alignments, unaligned_reads_store, stored_alignments):
+            unaligned_file_fasta=translated.unaligned_reads(unaligned_reads_store, cfg.demo_m8,
+                alignments, alignment_store=stored_alignments)
+            utils.remove_temp_file(unaligned_file_fasta)
+
+        self.store_and_quantify(alignments_function, False)
+
+        stored_alignments=alignment_store.AlignmentStore(nucleotide_stage=False)
+        alignments_function(store.Alignments(), store.Reads(), stored_alignments)
+        for setting, value in [("identity_threshold", 30.0), ("evalue_threshold", 1e-20),
+            ("translated_query_coverage_threshold", 50.0), ("translated_subject_coverage_threshold", 20.0)]:
+            setattr(config, setting, value)
+            alignments=store.Alignments()
+            stored_alignments.quantify(alignments, store.Reads())
+            expected_alignments=store.Alignments()
+            alignments_function(expected_alignments, store.Reads(), None)
+            self.assertEqual(sorted(alignments.get_hit_list()), sorted(expected_alignments.get_hit_list()))
+
+    def test_AlignmentStore_quantify_nucleotide_thresholds(self):
+        """
+        Test the alignments and unaligned reads from the store are the same as those
+        from the nucleotide post-processing with the same thresholds (default and changed)
+        """
+
+        def alignments_function(alignments, unaligned_reads_store, stored_alignments):
+            nucleotide.unaligned_reads(cfg.demo_sam, alignments, unaligned_reads_store,
+                keep_sam=True, alignment_store=stored_alignments)
+
+        self.store_and_quantify(alignments_function, True)
+
+        config.identity_threshold=99.0
+        self.store_and_quantify(alignments_function, True)
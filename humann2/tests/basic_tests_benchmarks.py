@@ -0,0 +1,92 @@
+import unittest
+import tempfile
+import shutil
+import os
+
+from humann2 import store
+from humann2 import config
+from humann2.search import nucleotide
+from humann2.tests import benchmarks
+from humann2.tests import synthetic
+
+class TestHumann2BenchmarksFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.tests.benchmarks and humann2.tests.synthetic
+    """
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_write_sam_alignments(self):
+        """
+        Test the synthetic sam file is read with the reads, genes, and bugs generated
+        """
+
+        with benchmarks.benchmark_config() as folder:
+            sam_file=os.path.join(folder,"synthetic.sam")
+            lines=synthetic.write_sam(sam_file, reads=200, genes=50, bugs=5, multi_hit_rate=0.5,
+                unaligned_rate=0.0)
+            alignments=store.Alignments()
+            unaligned_reads_store=store.Reads()
+            nucleotide.unaligned_reads(sam_file, alignments, unaligned_reads_store, keep_sam=True)
+
+            self.assertTrue(lines > 200)
+            self.assertEqual(unaligned_reads_store.get_initial_read_count(), 200)
+            self.assertEqual(alignments.count_bugs(), 5)
+            self.assertTrue(alignments.count_alignments() > 0)
+
+    def test_write_gene_table_stratified(self):
+        """
+        Test the synthetic gene table includes the rows for each gene and each bug of the gene
+        """
+
+        gene_table=os.path.join(self.tempdir,"genefamilies.tsv")
+        rows=synthetic.write_gene_table(gene_table, genes=20, bugs=2, samples=3, genes_per_bug=5)
+
+        with open(gene_table) as file_handle:
+            lines=[line.rstrip("\n").split("\t") for line in file_handle]
+
+        self.assertEqual(len(lines), rows+1)
+        self.assertEqual(len(lines[0]), 4)
+        self.assertEqual(len([line for line in lines if "|" in line[0]]), 10)
+
+    def test_benchmark_config_restored(self):
+        """
+        Test the config settings are restored after the benchmarks are run
+        """
+
+        temp_dir=config.temp_dir
+        minpath_toggle=config.minpath_toggle
+        results=benchmarks.run_benchmarks(genes=50, bugs=2, repeats=1, selected=["split_stratified_table"])
+
+        self.assertEqual([result["name"] for result in results], ["split_stratified_table"])
+        self.assertEqual(config.temp_dir, temp_dir)
+        self.assertEqual(config.minpath_toggle, minpath_toggle)
+
+    def test_compare_to_baseline(self):
+        """
+        Test the benchmarks slower than the baseline by more than the threshold are reported
+        """
+
+        results=[{"name": "fast", "seconds": 1.0}, {"name": "slow", "seconds": 3.0},
+            {"name": "new", "seconds": 1.0}]
+        baseline={"results": [{"name": "fast", "seconds": 1.0}, {"name": "slow", "seconds": 2.0}]}
+
+        self.assertEqual(benchmarks.compare_to_baseline(results, baseline, threshold=1.25), ["slow"])
+        self.assertEqual([result["baseline_ratio"] for result in results], [1.0, 1.5, None])
+
+    def test_compare_to_baseline_different_settings(self):
+        """
+        Test the results are not compared to a baseline run with different settings
+        """
+
+        results=[{"name": "fast", "seconds": 1.0}]
+        baseline={"settings": {"reads": 1000, "repeats": 3}, "results": [{"name": "fast", "seconds": 1.0}]}
+
+        self.assertEqual(benchmarks.compare_to_baseline(results, baseline,
+            settings={"reads": 1000, "repeats": 1}), [])
+        self.assertRaises(SystemExit, benchmarks.compare_to_baseline, results, baseline,
+            settings={"reads": 20000, "repeats": 3})
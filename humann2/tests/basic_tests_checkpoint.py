@@ -0,0 +1,214 @@
+import unittest
+import tempfile
+import shutil
+import os
+import pickle
+
+import cfg
+import utils
+
+from humann2 import checkpoint
+from humann2 import store
+from humann2 import config
+
+class TestHumann2CheckpointFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.checkpoint
+    """
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.folder=os.path.join(self.tempdir,"checkpoints")
+        self.input_file=os.path.join(self.tempdir,"input.sam")
+        with open(self.input_file,"w") as file_handle:
+            file_handle.write("read1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def checkpoints(self, fingerprint="fingerprint"):
+        return checkpoint.Checkpoints(self.folder, inputs=[self.input_file, None],
+            fingerprint=fingerprint)
+
+    def test_atomic_write_error(self):
+        """
+        Test the file is not changed and the temp file is removed if an error occurs while writing
+        """
+
+        file=os.path.join(self.tempdir,"file.txt")
+        with checkpoint.atomic_write(file) as file_handle:
+            file_handle.write(b"complete")
+
+        try:
+            with checkpoint.atomic_write(file) as file_handle:
+                file_handle.write(b"partial")
+                raise IOError("disk full")
+        except IOError:
+            pass
+
+        with open(file) as file_handle:
+            self.assertEqual(file_handle.read(),"complete")
+        self.assertEqual(sorted(os.listdir(self.tempdir)),["file.txt","input.sam"])
+
+    def test_Checkpoints_resume_last_stage(self):
+        """
+        Test the stores from the last stage saved are returned when resuming
+        Test the stages completed include those prior to the last stage
+        """
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(), {})
+        checkpoints.save("nucleotide", {"unaligned_reads_count": 1})
+        checkpoints.save("translated", {"unaligned_reads_count": 2})
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(resume=True), {"unaligned_reads_count": 2})
+        self.assertTrue(checkpoints.completed("nucleotide"))
+        self.assertTrue(checkpoints.completed("translated"))
+        self.assertFalse(checkpoints.completed("gene_families"))
+
+    def test_Checkpoints_resume_invalid_checkpoint(self):
+        """
+        Test the prior stage is resumed if the last checkpoint is changed
+        """
+
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("nucleotide", {"unaligned_reads_count": 1})
+        checkpoints.save("translated", {"unaligned_reads_count": 2})
+
+        with open(checkpoints.checkpoint_file("translated"),"ab") as file_handle:
+            file_handle.write(b"0")
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(resume=True), {"unaligned_reads_count": 1})
+        self.assertFalse(checkpoints.completed("translated"))
+
+    def test_Checkpoints_resume_missing_file(self):
+        """
+        Test the stage is not resumed if a file created by the stage is missing
+        """
+
+        output_file=os.path.join(self.tempdir,"genefamilies.tsv")
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("gene_families", {"unaligned_reads_count": 1}, files=[output_file])
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(resume=True), {})
+        self.assertFalse(checkpoints.completed("nucleotide"))
+
+    def test_Checkpoints_resume_fingerprint_changed(self):
+        """
+        Test the checkpoints are removed if the config settings change
+        """
+
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("nucleotide", {"unaligned_reads_count": 1})
+
+        checkpoints=self.checkpoints(fingerprint="new fingerprint")
+        self.assertEqual(checkpoints.start(resume=True), {})
+        self.assertFalse(os.path.isfile(checkpoints.manifest_file()))
+        self.assertFalse(os.path.isfile(checkpoints.checkpoint_file("nucleotide")))
+
+    def test_Checkpoints_resume_input_changed(self):
+        """
+        Test the checkpoints are not resumed if the input file changes
+        """
+
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("nucleotide", {"unaligned_reads_count": 1})
+
+        with open(self.input_file,"a") as file_handle:
+            file_handle.write("read2\n")
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(resume=True), {})
+
+    def test_Checkpoints_resume_input_modified(self):
+        """
+        Test the checkpoints are not resumed if the input file is modified (same size)
+        """
+
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("nucleotide", {"unaligned_reads_count": 1})
+
+        os.utime(self.input_file,(0,0))
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(resume=True), {})
+
+    def test_Checkpoints_start_without_resume(self):
+        """
+        Test the checkpoints from a prior run are removed when not resuming
+        """
+
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("nucleotide", {"unaligned_reads_count": 1})
+
+        checkpoints=self.checkpoints()
+        self.assertEqual(checkpoints.start(), {})
+        self.assertFalse(os.path.isfile(checkpoints.checkpoint_file("nucleotide")))
+
+    def test_Alignments_pickle_temp_alignments_file(self):
+        """
+        Test the alignments stored in the temp alignments file are included when pickled
+        """
+
+        unnamed_temp_dir=config.unnamed_temp_dir
+        config.unnamed_temp_dir=self.tempdir
+
+        alignments_store=store.Alignments(minimize_memory_use=True)
+        alignments_store.add("gene2", 1, "Q3", 0.01, "bug1",1)
+        alignments_store.add("gene1", 1, "Q1", 0.01, "bug2",1)
+        alignments_store.add("gene3", 1, "Q2", 0.01, "bug3",1)
+        alignments_store.add("gene1", 1, "Q1", 0.01, "bug1",1)
+
+        loaded_alignments_store=pickle.loads(pickle.dumps(alignments_store, pickle.HIGHEST_PROTOCOL))
+
+        gene_scores=store.GeneScores()
+        alignments_store.convert_alignments_to_gene_scores(gene_scores)
+        loaded_gene_scores=store.GeneScores()
+        loaded_alignments_store.convert_alignments_to_gene_scores(loaded_gene_scores)
+
+        config.unnamed_temp_dir=unnamed_temp_dir
+
+        for bug in ["all","bug1","bug2","bug3"]:
+            self.assertEqual(loaded_gene_scores.scores_for_bug(bug), gene_scores.scores_for_bug(bug))
+        self.assertEqual(loaded_gene_scores.get_score("bug1","gene1"), 500)
+
+    def test_Checkpoints_resume_temp_alignments_file(self):
+        """
+        Test the temp alignments file is copied to the checkpoints folder (not pickled)
+        and the alignments are restored when resuming
+        """
+
+        unnamed_temp_dir=config.unnamed_temp_dir
+        config.unnamed_temp_dir=self.tempdir
+
+        alignments_store=store.Alignments(minimize_memory_use=True)
+        alignments_store.add("gene1", 1, "Q1", 0.01, "bug1",1)
+        alignments_store.add("gene2", 1, "Q2", 0.01, "bug2",1)
+
+        checkpoints=self.checkpoints()
+        checkpoints.start()
+        checkpoints.save("nucleotide", {"alignments": alignments_store})
+        saved_file=os.path.join(self.folder,"nucleotide_alignments.temp_alignments")
+        self.assertTrue(os.path.isfile(saved_file))
+
+        loaded_alignments_store=self.checkpoints().start(resume=True)["alignments"]
+        gene_scores=store.GeneScores()
+        alignments_store.convert_alignments_to_gene_scores(gene_scores)
+        loaded_gene_scores=store.GeneScores()
+        loaded_alignments_store.convert_alignments_to_gene_scores(loaded_gene_scores)
+
+        # the saved file is removed with the checkpoints when not resuming
+        self.checkpoints().start()
+        config.unnamed_temp_dir=unnamed_temp_dir
+
+        self.assertEqual(loaded_gene_scores.scores_for_bug("all"), gene_scores.scores_for_bug("all"))
+        self.assertFalse(os.path.isfile(saved_file))
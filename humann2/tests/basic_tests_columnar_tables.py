@@ -0,0 +1,105 @@
+import unittest
+import logging
+import tempfile
+import shutil
+import os
+import filecmp
+
+import cfg
+import utils
+
+from humann2 import columnar_tables
+from humann2 import store
+from humann2 import config
+
+class TestHumann2ColumnarTablesFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.columnar_tables
+    """
+    
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+        
+    def test_write_table_read_rows(self):
+        """
+        Test the rows written are read with the features and strata dictionary encoded
+        """
+        
+        file=os.path.join(self.tempdir,"table.columnar")
+        rows=[("UNMAPPED",None,[1.5,2]),("gene1",None,[3,0]),("gene1","g__A.s__B",[3,0]),
+              ("gene2","g__A.s__B",[0.25,1])]
+        columnar_tables.write_table(file, "# Gene Family", ["sample1","sample2"], rows)
+        
+        table=columnar_tables.ColumnarTable(file)
+        self.assertEqual(table.anchor,"# Gene Family")
+        self.assertEqual(table.columns,["sample1","sample2"])
+        self.assertEqual(table.features,["UNMAPPED","gene1","gene2"])
+        self.assertEqual(table.strata,["","g__A.s__B"])
+        self.assertEqual(list(table.stratum_ids()),[0,0,1,1])
+        self.assertEqual(list(table.column(1)),[2,0,0,1])
+        self.assertEqual(list(table.rows()),rows)
+        table.close()
+        
+    def test_write_table_float32(self):
+        """
+        Test the values are written as float32 and read back as the nearest float32
+        """
+        
+        file=os.path.join(self.tempdir,"table.columnar")
+        columnar_tables.write_table(file, "# Pathway", ["sample"], [("pathway1",None,[0.1])], 
+            value_type="float32")
+        
+        table=columnar_tables.ColumnarTable(file)
+        self.assertEqual(table.typecode,"f")
+        self.assertAlmostEqual(list(table.rows())[0][2][0],0.1,places=6)
+        self.assertEqual(list(table.lines())[1],"pathway1\t0.100000001")
+        table.close()
+        
+    def test_tsv_to_columnar_to_tsv(self):
+        """
+        Test the conversion of a tsv table to columnar and back is lossless at the decimals
+        """
+        
+        file=os.path.join(self.tempdir,"table.columnar")
+        new_tsv=os.path.join(self.tempdir,"table.tsv")
+        columnar_tables.tsv_to_columnar(cfg.genetable_file, file, 10)
+        columnar_tables.columnar_to_tsv(file, new_tsv)
+        
+        expected=[line.rstrip("\n").split("\t") for line in open(cfg.genetable_file) if line.strip()]
+        found=[line.split("\t") for line in open(new_tsv).read().split("\n")]
+        
+        self.assertEqual(expected[0],found[0])
+        self.assertEqual([row[0] for row in expected[1:]],[row[0] for row in found[1:]])
+        self.assertEqual(["{:.10f}".format(float(row[1])) for row in expected[1:]],
+            [row[1] for row in found[1:]])
+        
+    def test_is_columnar_table(self):
+        """
+        Test columnar tables are recognized by the header
+        """
+        
+        file=os.path.join(self.tempdir,"table.columnar")
+        columnar_tables.write_table(file, "# Pathway", ["sample"], [])
+        
+        self.assertTrue(columnar_tables.is_columnar_table(file))
+        self.assertFalse(columnar_tables.is_columnar_table(cfg.genetable_file))
+        self.assertRaises(ValueError, columnar_tables.ColumnarTable, cfg.genetable_file)
+        
+    def test_GeneScores_add_from_file_columnar(self):
+        """
+        Test the gene scores are read from a columnar table
+        """
+        
+        file=os.path.join(self.tempdir,"genefamilies.columnar")
+        columnar_tables.write_table(file, "# Gene Family", ["sample"], [("UNMAPPED",None,[1.5]),
+            ("gene1: name",None,[2]),("gene1: name","g__A.s__B",[2])], 10)
+        
+        gene_scores=store.GeneScores()
+        unaligned_reads_count=gene_scores.add_from_file(file)
+        
+        self.assertEqual(unaligned_reads_count, 1.5)
+        self.assertEqual(gene_scores.scores_for_bug("all"), {"gene1": 2})
+        self.assertEqual(gene_scores.scores_for_bug("g__A.s__B"), {"gene1": 2})
@@ -0,0 +1,156 @@
+import unittest
+import tempfile
+import shutil
+import json
+import os
+
+from humann2 import metrics
+from humann2 import store
+from humann2 import utilities
+
+class TestHumann2MetricsFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.metrics
+    """
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_Metrics_stage_completed(self):
+        """
+        Test the metrics are recorded for each stage with the counts
+        """
+
+        run_metrics=metrics.Metrics()
+        run_metrics.start()
+        run_metrics.stage_completed("nucleotide alignment post-processing", {"reads": 10, "alignments": 5})
+        run_metrics.stage_completed("computing pathways")
+
+        stages=run_metrics.stages()
+        self.assertEqual([stage["stage"] for stage in stages],
+            ["nucleotide alignment post-processing","computing pathways"])
+        self.assertEqual(stages[0]["counts"], {"reads": 10, "alignments": 5})
+        self.assertEqual(stages[1]["counts"], {})
+        for stage in stages:
+            self.assertTrue(stage["wall_time"] >= 0)
+            self.assertTrue(stage["cpu_time"] >= 0)
+
+    def test_Metrics_child_peak_rss(self):
+        """
+        Test the peak rss of the child processes is recorded for the stage they finished in
+        """
+
+        run_metrics=metrics.Metrics()
+        run_metrics.start()
+        utilities.record_process_usage(0.5, 2048)
+        run_metrics.stage_completed("translated alignment")
+        run_metrics.stage_completed("translated alignment post-processing")
+
+        stages=run_metrics.stages()
+        self.assertEqual(stages[0]["child_peak_rss"], 2048)
+        self.assertEqual(stages[1]["child_peak_rss"], 0)
+        self.assertEqual(stages[0]["child_cpu_time"], 0.5)
+
+    def test_Metrics_child_processes_for_run(self):
+        """
+        Test the child processes from a prior run are not included in the totals
+        """
+
+        first_run=metrics.Metrics()
+        first_run.start()
+        utilities.record_process_usage(0.5, 4096)
+        first_run.stage_completed("translated alignment")
+
+        run_metrics=metrics.Metrics()
+        run_metrics.start()
+        utilities.record_process_usage(0.5, 1024)
+        run_metrics.stage_completed("translated alignment")
+
+        totals=run_metrics.report()["totals"]
+        self.assertEqual(totals["child_peak_rss"], 1024)
+        self.assertEqual(totals["child_processes"], 1)
+        self.assertEqual(run_metrics.stages()[0]["child_processes"], 1)
+
+    def test_Metrics_disabled(self):
+        """
+        Test no metrics are recorded or written if not enabled
+        """
+
+        file=os.path.join(self.tempdir,"demo_metrics.json")
+        run_metrics=metrics.Metrics(enabled=False)
+        run_metrics.start()
+        run_metrics.stage_completed("computing pathways")
+        run_metrics.write(file)
+
+        self.assertEqual(run_metrics.stages(), [])
+        self.assertFalse(os.path.isfile(file))
+
+    def test_Metrics_write(self):
+        """
+        Test the metrics report is written as json with the run info and output file sizes
+        """
+
+        output_file=os.path.join(self.tempdir,"demo_genefamilies.tsv")
+        with open(output_file,"w") as file_handle:
+            file_handle.write("gene\t1.0\n")
+
+        file=os.path.join(self.tempdir,"demo_metrics.json")
+        run_metrics=metrics.Metrics()
+        run_metrics.start()
+        run_metrics.stage_completed("computing gene families", {"genes": 3})
+        run_metrics.write(file, {"sample": "demo"}, [output_file])
+
+        with open(file) as file_handle:
+            report=json.load(file_handle)
+
+        self.assertEqual(report["sample"], "demo")
+        self.assertEqual(report["stages"][0]["counts"], {"genes": 3})
+        self.assertEqual(report["output_files"], {"demo_genefamilies.tsv": 9})
+        self.assertTrue(report["totals"]["wall_time"] >= 0)
+
+    def test_Metrics_startup_time(self):
+        """
+        Test the startup time is included in the report and the process start time is found
+        """
+
+        run_metrics=metrics.Metrics(startup_time=0.25)
+        run_metrics.start()
+        self.assertEqual(run_metrics.report()["startup_time"], 0.25)
+
+        start_time=metrics.process_start_time()
+        self.assertTrue(start_time <= metrics.module_load_time)
+        self.assertTrue(start_time > 0)
+
+    def test_start_run_startup_end(self):
+        """
+        Test the startup time for the first run ends at the time provided
+        """
+
+        first_run=metrics.first_run
+        try:
+            metrics.first_run=True
+            startup_end=metrics.process_start_time()+2.5
+            run_metrics=metrics.start_run(True, startup_end)
+            self.assertTrue(abs(run_metrics.report()["startup_time"]-2.5) < 0.1)
+
+            # the startup time is only recorded for the first run
+            run_metrics=metrics.start_run(True, startup_end)
+            self.assertEqual(run_metrics.report()["startup_time"], None)
+        finally:
+            metrics.start_run(False)
+            metrics.first_run=first_run
+
+    def test_Alignments_count_alignments(self):
+        """
+        Test the alignments are counted with the duplicate reads each represents
+        """
+
+        alignments_store=store.Alignments()
+        alignments_store.add("gene1", 1, "Q1", 0.01, "bug1", 1)
+        alignments_store.add("gene2", 1, "Q3", 0.01, "bug2", 1, weight=3)
+        alignments_store.add("gene1", 1, "Q2", 0.01, "bug1", 1)
+
+        self.assertEqual(alignments_store.count_alignments(), 5)
@@ -0,0 +1,130 @@
+import unittest
+import logging
+import tempfile
+import shutil
+import pstats
+import os
+
+from humann2 import profiling
+from humann2 import config
+from humann2 import store
+
+class TestHumann2ProfilingFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.profiling
+    """
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+        self.temp_dir=config.temp_dir
+        self.file_basename=config.file_basename
+        self.profile_stages=config.profile_stages
+        config.temp_dir=self.tempdir
+        config.file_basename="demo"
+
+    def tearDown(self):
+        profiling.stop_run()
+        config.temp_dir=self.temp_dir
+        config.file_basename=self.file_basename
+        config.profile_stages=self.profile_stages
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_stage_name(self):
+        """
+        Test the stage names from the tasks completed are those that can be selected
+        """
+
+        self.assertEqual(profiling.stage_name("nucleotide alignment post-processing"),
+            "nucleotide_alignment_post-processing")
+        self.assertTrue(profiling.stage_name("computing gene families") in profiling.STAGES)
+
+    def test_StageProfiler_selected_stages(self):
+        """
+        Test the profile stats are only written for the stages selected
+        """
+
+        config.profile_stages=["computing_gene_families"]
+        profiling.start_run(config.profile_stages, False)
+        sum(range(1000))
+        profiling.stage_completed("alignment post-processing")
+        sorted(range(1000))
+        profiling.stage_completed("computing gene families")
+        profiling.stop_run()
+
+        self.assertEqual(os.listdir(profiling.profile_folder()),
+            ["demo_computing_gene_families"+profiling.PROFILE_EXTENSION])
+        stats=pstats.Stats(profiling.profile_file("computing_gene_families"))
+        functions=[function[2] for function in stats.stats]
+        self.assertTrue("<built-in method builtins.sorted>" in functions)
+        self.assertFalse("<built-in method builtins.sum>" in functions)
+
+    def test_StageProfiler_only_stages_which_can_be_selected(self):
+        """
+        Test the profiler only runs for the stages which can be one of those selected
+        """
+
+        config.profile_stages=["computing_pathways"]
+        profiling.start_run(config.profile_stages, False)
+        self.assertTrue(profiling.run_profiler.active())
+        profiling.stage_completed("nucleotide alignment")
+        self.assertFalse(profiling.run_profiler.active())
+        profiling.stage_completed("nucleotide alignment post-processing")
+        self.assertFalse(profiling.run_profiler.active())
+        profiling.stage_completed("computing gene families")
+        self.assertTrue(profiling.run_profiler.active())
+        profiling.stage_completed("computing pathways")
+        self.assertFalse(profiling.run_profiler.active())
+
+        self.assertEqual(os.listdir(profiling.profile_folder()),
+            ["demo_computing_pathways"+profiling.PROFILE_EXTENSION])
+
+    def test_profile_call_by_bug(self):
+        """
+        Test the per-bug function is profiled to its own file if the pathways stage is selected
+        """
+
+        config.profile_stages=[]
+        self.assertEqual(profiling.profile_call("sum_bug1", sum, [1,2]), 3)
+        self.assertFalse(os.path.isdir(profiling.profile_folder()))
+
+        config.profile_stages=[profiling.ALL_STAGES]
+        self.assertEqual(profiling.profile_call("sum_g__Bacteroides|s__dorei", sum, [1,2]), 3)
+        self.assertEqual(os.listdir(profiling.profile_folder()),
+            ["demo_sum_g__Bacteroides_s__dorei"+profiling.PROFILE_EXTENSION])
+
+    @unittest.skipIf(profiling.tracemalloc is None, "tracemalloc is not available")
+    def test_StageProfiler_trace_memory(self):
+        """
+        Test the memory report for each stage includes the sizes of the stores tracked
+        """
+
+        messages=[]
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                messages.append(record.getMessage())
+        handler=ListHandler()
+        logger=logging.getLogger("humann2.profiling")
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+        gene_scores=store.GeneScores()
+        gene_scores.add_single_score("all","gene1",1.0)
+        profiling.start_run([], True)
+        profiling.track_store("GeneScores", gene_scores)
+        profiling.stage_completed("computing gene families")
+        profiling.stop_run()
+        logger.removeHandler(handler)
+
+        store_messages=[message for message in messages if "store GeneScores" in message]
+        self.assertEqual(len(store_messages), 1)
+        self.assertTrue(store_messages[0].startswith("MEMORY: \tcomputing_gene_families"))
+        self.assertFalse(profiling.tracemalloc.is_tracing())
+
+    def test_object_size(self):
+        """
+        Test the size of an object includes the objects it contains
+        """
+
+        values=["a"*1000, "b"*1000]
+        self.assertTrue(profiling.object_size({"values": values}) > 2000)
+        self.assertTrue(profiling.object_size(values) > profiling.object_size(["a", "b"]))
@@ -0,0 +1,176 @@
+import unittest
+import logging
+import tempfile
+import shutil
+
+import cfg
+import utils
+
+from humann2.quantify import minpath_engine
+from humann2 import config
+
+class TestHumann2QuantifyMinpathEngineFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.quantify.minpath_engine
+    """
+    
+    def setUp(self):
+        # set up nullhandler for logger
+        logging.getLogger('humann2.quantify.minpath_engine').addHandler(logging.NullHandler())
+        
+        # store the cache in a temp folder
+        self.cache_directory=config.cache_directory
+        self.minpath_cache_toggle=config.minpath_cache_toggle
+        config.cache_directory=tempfile.mkdtemp()
+        config.minpath_cache_toggle="on"
+        
+    def tearDown(self):
+        shutil.rmtree(config.cache_directory, ignore_errors=True)
+        config.cache_directory=self.cache_directory
+        config.minpath_cache_toggle=self.minpath_cache_toggle
+        
+    def test_PathwayMap_indexes(self):
+        """
+        Test the PathwayMap class indexes the pathways and reactions in both directions
+        Test duplicate reactions in a pathway are only included once
+        """
+        
+        pathway_map=minpath_engine.PathwayMap("# comment\nP1\tA\tB\tA\nP2\tB\tC\nP3")
+        
+        self.assertEqual(pathway_map.pathways,["P1","P2"])
+        self.assertEqual(pathway_map.pathway_reactions,[["A","B"],["B","C"]])
+        self.assertEqual(pathway_map.find_pathways("B"),[0,1])
+        self.assertEqual(pathway_map.find_pathways("D"),[])
+        
+    def test_minimum_set_cover(self):
+        """
+        Test the minimum set cover is found when the greedy selection is not minimal
+        """
+        
+        sets={"P1": set(["A","B","C","D"]),
+              "P2": set(["A","B","E"]),
+              "P3": set(["C","D","F"])}
+        
+        self.assertEqual(minpath_engine.minimum_set_cover(sets),["P2","P3"])
+        
+    def test_minimum_set_cover_ties(self):
+        """
+        Test the minimum set cover resolves ties in the order of the keys
+        """
+        
+        sets={"P3": set(["A","B"]), "P1": set(["A","B"]), "P2": set(["C"])}
+        
+        self.assertEqual(minpath_engine.minimum_set_cover(sets),["P1","P2"])
+        
+    def test_minimum_set_cover_branch_and_bound(self):
+        """
+        Test the minimum set cover for sets without essential or dominated sets
+        """
+        
+        # each item is in two sets (a cycle of six items and six sets)
+        sets={}
+        for i in range(6):
+            sets[i]=set([i,(i+1)%6])
+        
+        selected=minpath_engine.minimum_set_cover(sets)
+        
+        self.assertEqual(len(selected),3)
+        self.assertEqual(set().union(*[sets[key] for key in selected]),set(range(6)))
+        
+    def test_identify_pathways(self):
+        """
+        Test the pathways are identified as with MinPath, including the pathways
+        added back with at least half of their reactions found
+        """
+        
+        pathway_map=minpath_engine.PathwayMap("P1\tA\tB\tC\nP2\tA\tD\tE\tF\nP3\tC\tG\nP4\tH\tI")
+        reaction_scores={"A": 1, "B": 2, "C": 3, "Z": 4}
+        
+        pathways=minpath_engine.identify_pathways(pathway_map, reaction_scores)
+        
+        self.assertEqual(pathways,{"A": ["P1"], "B": ["P1"], "C": ["P1","P3"]})
+        
+    def test_identify_pathways_by_bug(self):
+        """
+        Test the pathways are identified for each bug
+        """
+        
+        pathway_map=minpath_engine.PathwayMap("P1\tA\tB\nP2\tC\tD")
+        reaction_scores={"bug1": {"A": 1, "B": 1}, "bug2": {"C": 1}}
+        
+        pathways=minpath_engine.identify_pathways_by_bug(pathway_map, reaction_scores, 1)
+        
+        self.assertEqual(pathways,{"bug1": {"A": ["P1"], "B": ["P1"]}, "bug2": {"C": ["P2"]}})
+        
+    def test_identify_pathways_allowed_pathways(self):
+        """
+        Test only the allowed pathways are candidates for the reactions found
+        """
+        
+        pathway_map=minpath_engine.PathwayMap("P1\tA\tB\tC\nP2\tA\tD\tE\tF\nP3\tC\tG\nP4\tH\tI")
+        reaction_scores={"A": 1, "B": 2, "C": 3, "Z": 4}
+        
+        pathways=minpath_engine.identify_pathways(pathway_map, reaction_scores, set(["P2","P3"]))
+        
+        self.assertEqual(pathways,{"A": ["P2"], "C": ["P3"]})
+        
+    def test_MinPathCache_allowed_pathways(self):
+        """
+        Test the MinPathCache class stores the results for the allowed pathways separately
+        """
+        
+        cache=minpath_engine.MinPathCache("P1\tA\tB", "internal")
+        reactions={"bug1": {"A": 1, "B": 2}}
+        
+        cache.add(reactions, {"bug1": {"A": ["P1"], "B": ["P1"]}})
+        cache.add(reactions, {"bug1": {}}, {"bug1": set()})
+        
+        self.assertEqual(cache.get(reactions),{"bug1": {"A": ["P1"], "B": ["P1"]}})
+        self.assertEqual(cache.get(reactions, {"bug1": set()}),{"bug1": {}})
+        
+    def test_MinPathCache_get_and_add(self):
+        """
+        Test the MinPathCache class returns the results stored for the same set of reactions
+        Test the results do not depend on the reaction abundances
+        """
+        
+        cache=minpath_engine.MinPathCache("P1\tA\tB", "internal")
+        reactions={"bug1": {"A": 1, "B": 2}, "bug2": {"A": 1}}
+        
+        self.assertEqual(cache.get(reactions),{})
+        cache.add(reactions, {"bug1": {"A": ["P1"], "B": ["P1"]}})
+        
+        cache=minpath_engine.MinPathCache("P1\tA\tB", "internal")
+        results=cache.get({"bug3": {"A": 5, "B": 6}, "bug2": {"A": 1}})
+        
+        self.assertEqual(results,{"bug3": {"A": ["P1"], "B": ["P1"]}})
+        self.assertEqual([cache.hits, cache.misses],[1,1])
+        
+    def test_MinPathCache_database_changed(self):
+        """
+        Test the MinPathCache class does not return results for a different database or engine
+        """
+        
+        reactions={"bug1": {"A": 1, "B": 2}}
+        minpath_engine.MinPathCache("P1\tA\tB", "internal").add(reactions, {"bug1": {"A": ["P1"]}})
+        
+        self.assertEqual(minpath_engine.MinPathCache("P1\tA\tB\tC", "internal").get(reactions),{})
+        self.assertEqual(minpath_engine.MinPathCache("P1\tA\tB", "external").get(reactions),{})
+        
+    def test_MinPathCache_max_entries(self):
+        """
+        Test the MinPathCache class removes the least recently used results when full
+        """
+        
+        max_entries=config.minpath_cache_max_entries
+        config.minpath_cache_max_entries=2
+        try:
+            cache=minpath_engine.MinPathCache("P1\tA\tB", "internal")
+            for reaction in ["A","B","C"]:
+                cache.add({"bug": {reaction: 1}}, {"bug": {reaction: ["P1"]}})
+        finally:
+            config.minpath_cache_max_entries=max_entries
+            
+        results=cache.get({"bug1": {"A": 1}, "bug2": {"B": 1}, "bug3": {"C": 1}})
+        
+        self.assertEqual(sorted(results),["bug2","bug3"])
@@ -5,6 +5,7 @@ import cfg
 import utils
 
 from humann2.quantify import modules
+from humann2.quantify import chi2cdf
 from humann2 import config
 
 class TestHumann2QuantifyModulesFunctions(unittest.TestCase):
@@ -185,3 +186,28 @@ class TestHumann2QuantifyModulesFunctions(unittest.TestCase):
         
         self.assertEqual(result, expect_result)
         
+        
+    def test_chi2cdf_batch(self):
+        """
+        Test the chi2cdf batch function matches the chi2cdf function
+        Test with zero and repeated values
+        """
+        
+        for median in [0.5, 3, 12.25, 400]:
+            values=[0, 0.1, 1, median, median, 2.5*median, 20*median]
+            expected=[chi2cdf.chi2cdf(value, median) for value in values]
+            
+            for result, expect_result in zip(chi2cdf.chi2cdf_batch(values, median), expected):
+                self.assertAlmostEqual(result, expect_result, places=12)
+                
+    def test_chi2cdf_batch_memoized(self):
+        """
+        Test the chi2cdf batch function returns the same values when memoized
+        """
+        
+        values=[0.3, 4, 9]
+        first=chi2cdf.chi2cdf_batch(values, 5)
+        second=chi2cdf.chi2cdf_batch(values, 5)
+        
+        self.assertEqual(first, second)
+        self.assertTrue((4, 5) in chi2cdf._cache)
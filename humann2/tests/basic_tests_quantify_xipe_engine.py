@@ -0,0 +1,73 @@
+import unittest
+import logging
+
+import cfg
+import utils
+
+from humann2.quantify import xipe_engine
+from humann2 import config
+
+class TestHumann2QuantifyXipeEngineFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.quantify.xipe_engine
+    """
+    
+    def test_remove_lowest(self):
+        """
+        Test the lowest percent of the values are removed
+        """
+        
+        sample=[("A",0.5),("B",0.1),("C",0.9),("D",0.2),("E",0.3)]
+        
+        remaining, removed=xipe_engine.remove_lowest(sample, 0.4)
+        
+        self.assertEqual(removed,["B","D"])
+        self.assertEqual(remaining,[("E",0.3),("A",0.5),("C",0.9)])
+        
+    def test_median(self):
+        """
+        Test the median is computed as with xipe for an odd and even number of values
+        """
+        
+        self.assertEqual(xipe_engine.median([5,4,3,2,1]),3)
+        self.assertEqual(xipe_engine.median([6,5,4,3,2,1]),2.5)
+        
+    def test_classify(self):
+        """
+        Test the confidence and bin for a median larger and smaller than all of the mixed deltas
+        """
+        
+        space_deltas=list(range(50,-50,-1))
+        
+        self.assertEqual(xipe_engine.classify(100, space_deltas),(99,1))
+        self.assertEqual(xipe_engine.classify(-100, space_deltas),(99,2))
+        self.assertEqual(xipe_engine.classify(0, space_deltas),(0,0))
+        
+    def test_xipe_seed(self):
+        """
+        Test the results are the same for the same seed
+        Test the keys with values of zero are not included
+        """
+        
+        values=dict(("P"+str(i), (i+1)/10.0) for i in range(20))
+        values["Z"]=0
+        
+        results1=xipe_engine.xipe(values, 0.1, 100, 100, True, xipe_engine.random_generator(1, "bug"))
+        results2=xipe_engine.xipe(values, 0.1, 100, 100, True, xipe_engine.random_generator(1, "bug"))
+        
+        self.assertEqual(results1, results2)
+        self.assertEqual(results1[1],["P0","P1"])
+        self.assertEqual(sorted(results1[0]),sorted(key for key in values if key != "Z"))
+        
+    def test_xipe_removed_keys(self):
+        """
+        Test the keys removed are found to be more abundant in the first sample
+        """
+        
+        values=dict(("P"+str(i), 1.0) for i in range(9))
+        values["LOW"]=0.5
+        
+        results, removed=xipe_engine.xipe(values, 0.1, 1000, 100, False, xipe_engine.random_generator(1))
+        
+        self.assertEqual(removed,["LOW"])
+        self.assertEqual(results["LOW"],(99,1))
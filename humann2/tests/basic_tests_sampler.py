@@ -0,0 +1,73 @@
+import unittest
+import tempfile
+import shutil
+import subprocess
+import time
+import csv
+import os
+
+from humann2 import sampler
+
+class TestHumann2SamplerFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.sampler
+    """
+
+    def setUp(self):
+        self.tempdir=tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    @unittest.skipIf(not sampler.available(), "unable to sample processes on this system")
+    def test_processes_includes_children(self):
+        """
+        Test the child processes are included with the current process
+        """
+
+        process=subprocess.Popen(["sleep","5"])
+        try:
+            processes=sampler.processes(os.getpid())
+        finally:
+            process.kill()
+            process.wait()
+
+        pids=[row[0] for row in processes]
+        self.assertEqual(pids[0], os.getpid())
+        self.assertTrue(process.pid in pids)
+        child=processes[pids.index(process.pid)]
+        self.assertEqual(child[1], os.getpid())
+        self.assertTrue(child[4] > 0)
+
+    @unittest.skipIf(not sampler.available(), "unable to sample processes on this system")
+    def test_ResourceSampler_stage_tags(self):
+        """
+        Test the samples are tagged with the stage in progress and the stages completed are written
+        """
+
+        file=os.path.join(self.tempdir,"demo_resources.csv")
+        resource_sampler=sampler.ResourceSampler(file, interval=0.05)
+        resource_sampler.start()
+        time.sleep(0.2)
+        resource_sampler.stage_completed("nucleotide alignment")
+        time.sleep(0.2)
+        resource_sampler.stop()
+
+        with open(file) as file_handle:
+            rows=list(csv.DictReader(file_handle))
+
+        stage_rows=[row for row in rows if row["event"] == "stage"]
+        self.assertEqual([(row["stage"], row["command"]) for row in stage_rows], [("1","nucleotide alignment")])
+        sample_stages=set(row["stage"] for row in rows if row["event"] == "sample")
+        self.assertEqual(sample_stages, set(["1","2"]))
+        self.assertTrue(all(int(row["rss"]) > 0 for row in rows if row["event"] == "sample"))
+
+    def test_start_run_disabled(self):
+        """
+        Test the sampler is not started and no file is written if not enabled
+        """
+
+        file=os.path.join(self.tempdir,"demo_resources.csv")
+        self.assertEqual(sampler.start_run(False, file, 1.0), None)
+        sampler.stage_completed("nucleotide alignment")
+        self.assertFalse(os.path.isfile(file))
@@ -0,0 +1,132 @@
+import unittest
+import logging
+import tempfile
+import threading
+import os
+import sys
+
+import cfg
+import utils
+
+from humann2 import scheduler
+from humann2 import config
+
+class TestHumann2SchedulerFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.scheduler
+    """
+
+    def setUp(self):
+        config.unnamed_temp_dir=tempfile.gettempdir()
+
+        # set up nullhandler for logger
+        logging.getLogger('humann2.scheduler').addHandler(logging.NullHandler())
+        logging.getLogger('humann2.utilities').addHandler(logging.NullHandler())
+
+    def test_Scheduler_run_largest_first(self):
+        """
+        Scheduler class: Test the tasks are run largest first
+        Test tasks of the same size are run in the order provided
+        """
+
+        order=[]
+        tasks=[scheduler.Task("small",order.append,["small"],memory=1),
+               scheduler.Task("large",order.append,["large"],memory=100),
+               scheduler.Task("medium1",order.append,["medium1"],memory=10),
+               scheduler.Task("medium2",order.append,["medium2"],memory=10)]
+
+        scheduler.Scheduler(threads=1).run(tasks)
+
+        self.assertEqual(order,["large","medium1","medium2","small"])
+        self.assertEqual([task.status for task in tasks],["completed"]*4)
+
+    def test_Scheduler_run_memory_budget(self):
+        """
+        Scheduler class: Test tasks are not run at the same time if they
+        would use more than the max memory
+        """
+
+        lock=threading.Lock()
+        running=[0]
+        max_running=[0]
+
+        def task_function():
+            with lock:
+                running[0]+=1
+                max_running[0]=max(max_running[0],running[0])
+            threading.Event().wait(0.05)
+            with lock:
+                running[0]-=1
+
+        tasks=[scheduler.Task("task"+str(i),task_function,memory=6) for i in range(3)]
+        scheduler.Scheduler(threads=3,max_memory=10).run(tasks)
+
+        self.assertEqual(max_running[0],1)
+
+    def test_Scheduler_run_cancel_on_failure(self):
+        """
+        Scheduler class: Test the queued tasks are cancelled on the first failure
+        """
+
+        def fail():
+            raise EnvironmentError("task failed")
+
+        order=[]
+        tasks=[scheduler.Task("fail",fail,memory=10),
+               scheduler.Task("task1",order.append,["task1"]),
+               scheduler.Task("task2",order.append,["task2"])]
+
+        scheduler.Scheduler(threads=1).run(tasks)
+
+        self.assertEqual(order,[])
+        self.assertEqual([task.status for task in tasks],["failed","cancelled","cancelled"])
+        self.assertEqual(tasks[0].error,"task failed")
+
+    def test_run_tasks_exit_on_failure(self):
+        """
+        Test the run_tasks function exits if a task fails
+        """
+
+        def fail():
+            sys.exit("task failed")
+
+        with self.assertRaises(SystemExit):
+            scheduler.run_tasks([scheduler.Task("fail",fail)],threads=1,max_memory=0)
+
+    def test_command_task_resources(self):
+        """
+        Test the command_task function records the resources of the process
+        """
+
+        if not hasattr(os, "wait4"):
+            return
+
+        task=scheduler.command_task("sh",["sh",["-c","exit 0"],[],[],None,None,True,None])
+        scheduler.run_tasks([task],threads=1,max_memory=0)
+
+        self.assertEqual(task.status,"completed")
+        self.assertTrue(task.peak_rss > 0)
+        self.assertTrue(task.wall_time > 0)
+
+    def test_process_map(self):
+        """
+        Test the process_map function returns the results in the order of the items
+        Test the initializer is run in each process
+        """
+
+        results=scheduler.process_map(abs,[-3,2,-1],processes=2)
+        self.assertEqual(results,[3,2,1])
+
+        results=scheduler.process_map(add_offset,[1,2,3],processes=2,
+            initializer=set_offset,initargs=(10,))
+        self.assertEqual(results,[11,12,13])
+
+# the value set by the process map initializer
+offset=0
+
+def set_offset(value):
+    global offset
+    offset=value
+
+def add_offset(value):
+    return value+offset
@@ -0,0 +1,146 @@
+import unittest
+import logging
+import tempfile
+import threading
+import shutil
+import time
+import os
+import sys
+
+import cfg
+import utils
+
+from humann2 import server
+
+def job_function(request):
+    """
+    A job which prints the arguments and returns them as the output files
+    """
+    
+    print("Running job")
+    if "sleep" in request["args"]:
+        time.sleep(2)
+    if "fail" in request["args"]:
+        sys.exit("CRITICAL ERROR: job failed")
+    return request["args"]
+
+class TestHumann2ServerFunctions(unittest.TestCase):
+    """
+    Test the functions found in humann2.server
+    """
+
+    def setUp(self):
+        # set up nullhandler for logger
+        logging.getLogger('humann2.server').addHandler(logging.NullHandler())
+        
+        if not hasattr(os, "fork"):
+            self.skipTest("fork is not available")
+        
+        # start the server in a thread
+        self.tempdir=tempfile.mkdtemp()
+        self.socket_path=os.path.join(self.tempdir,"humann2.sock")
+        self.stdout=sys.stdout
+        sys.stdout=open(os.devnull,"w")
+        self.server_thread=threading.Thread(target=server.serve,
+            args=(self.socket_path, job_function, 2))
+        self.server_thread.start()
+        for i in range(50):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.1)
+        
+    def tearDown(self):
+        list(server.send_request(self.socket_path, {"command": "shutdown"}))
+        self.server_thread.join()
+        sys.stdout.close()
+        sys.stdout=self.stdout
+        shutil.rmtree(self.tempdir)
+
+    def test_serve_run_job(self):
+        """
+        Test the events are returned for a job run by the server
+        """
+        
+        events=list(server.send_request(self.socket_path, 
+            {"command": "run", "args": ["file1","file2"]}))
+        
+        self.assertEqual([event["event"] for event in events],
+            ["accepted","output","output","completed"])
+        self.assertEqual("".join(event["text"] for event in events if event["event"] == "output"),
+            "Running job\n")
+        self.assertEqual(events[-1]["output_files"],["file1","file2"])
+        
+    def test_serve_run_job_failed(self):
+        """
+        Test the error is returned for a job that exits
+        """
+        
+        events=list(server.send_request(self.socket_path, 
+            {"command": "run", "args": ["fail"]}))
+        
+        self.assertEqual(events[-1]["event"],"failed")
+        self.assertEqual(events[-1]["error"],"CRITICAL ERROR: job failed")
+        
+    def test_serve_socket_mode(self):
+        """
+        Test only the user running the server can connect to the socket
+        """
+        
+        self.assertEqual(os.stat(self.socket_path).st_mode & 0o777, 0o600)
+        
+    def test_serve_ping(self):
+        """
+        Test the server replies to a ping
+        """
+        
+        events=list(server.send_request(self.socket_path, {"command": "ping"}))
+        
+        self.assertEqual(events[0]["event"],"ready")
+        
+    def test_serve_queue_jobs(self):
+        """
+        Test the jobs are queued if the max number are running and the server still replies
+        """
+        
+        results=[]
+        def run(name):
+            results.append(list(server.send_request(self.socket_path, 
+                {"command": "run", "args": [name, "sleep"]})))
+        threads=[threading.Thread(target=run, args=("file"+str(i),)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        
+        # the server replies to a ping while the third job is queued
+        ping=None
+        for i in range(20):
+            start=time.time()
+            ping=list(server.send_request(self.socket_path, {"command": "ping"}))[0]
+            self.assertTrue(time.time()-start < 1)
+            if ping["queued"]:
+                break
+            time.sleep(0.05)
+        self.assertEqual((ping["jobs"], ping["queued"]), (2, 1))
+        
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(sorted(events[0]["event"] for events in results),
+            ["accepted","accepted","queued"])
+        self.assertEqual([events[-1]["event"] for events in results],["completed"]*3)
+        
+    def test_submit(self):
+        """
+        Test the submit function returns the output files
+        """
+        
+        output_files=server.submit(self.socket_path, ["file1"])
+        
+        self.assertEqual(output_files,["file1"])
+        
+    def test_submit_failed(self):
+        """
+        Test the submit function exits if the job fails
+        """
+        
+        with self.assertRaises(SystemExit):
+            server.submit(self.socket_path, ["fail"])
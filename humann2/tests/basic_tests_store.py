@@ -4,12 +4,15 @@ import re
 import tempfile
 import os
 import logging
+import pickle
 
 import cfg
 import utils
 
 from humann2 import store
 from humann2 import config
+from humann2 import utilities
+from humann2 import biom_tables
 
 class TestHumann2StoreFunctions(unittest.TestCase):
     """
@@ -51,6 +54,42 @@ class TestHumann2StoreFunctions(unittest.TestCase):
         
         self.assertEqual(reads_store.count_reads(), 2)
 
+    def test_Read_set_read_counts_count_reads(self):
+        """
+        Read class: Test the count includes the duplicate reads each id represents
+        Test the count is updated when ids are removed
+        """
+        
+        reads_store=store.Reads()
+        reads_store.set_read_counts({"id1":3,"id3":2})
+        
+        reads_store.add("id1","ATCG")
+        reads_store.add("id2","ATTG")
+        reads_store.add("id1","ATCG")
+        
+        self.assertEqual(reads_store.count_reads(), 4)
+        
+        reads_store.remove_id("id1")
+        reads_store.remove_id("id1")
+        
+        self.assertEqual(reads_store.count_reads(), 1)
+        
+    def test_Read_set_read_counts_count_reads_minimize_memory_use(self):
+        """
+        Read class: Test the count includes the duplicate reads each id represents
+        Test setting the counts after the reads are added
+        Test with minimize memory use
+        """
+        
+        reads_store=store.Reads(minimize_memory_use=True)
+        
+        reads_store.add("id1","ATCG")
+        reads_store.add("id2","ATTG")
+        reads_store.set_read_counts({"id1":3,"id3":2})
+        
+        self.assertEqual(reads_store.count_reads(), 4)
+        self.assertEqual(reads_store.get_read_count("id2"), 1)
+
     def test_Read_print_fasta_id_count(self):
         """
         Read class: Test the loading of a full fasta file
@@ -299,6 +338,165 @@ class TestHumann2StoreFunctions(unittest.TestCase):
             
         self.assertEqual(reads_store.id_list(), [keep_id])
         
+    def test_ReactionsDatabase_compiled_cache(self):
+        """
+        Reactions database class: Test the compiled database is written to the cache
+        Test the database loaded from the cache is the same as the source
+        """
+        
+        cache_directory=config.cache_directory
+        config.cache_directory=tempfile.mkdtemp()
+        
+        reactions_database_store=store.ReactionsDatabase(cfg.reactions_file)
+        cache_file=store.database_cache_file(cfg.reactions_file, "reactions")
+        cache_exists=os.path.isfile(cache_file)
+        reactions_database_cached=store.ReactionsDatabase(cfg.reactions_file)
+        
+        utils.remove_temp_folder(config.cache_directory)
+        config.cache_directory=cache_directory
+        
+        self.assertTrue(cache_exists)
+        self.assertEqual(sorted(reactions_database_store.gene_list()),
+            sorted(reactions_database_cached.gene_list()))
+        for gene in reactions_database_store.gene_list():
+            self.assertEqual(reactions_database_store.find_reactions(gene),
+                reactions_database_cached.find_reactions(gene))
+            
+    def test_write_database_cache_error(self):
+        """
+        Test the temp file is removed if the compiled database can not be written
+        """
+        
+        class Unpicklable(object):
+            def __reduce__(self):
+                raise pickle.PicklingError("unable to pickle")
+        
+        cache_directory=config.cache_directory
+        config.cache_directory=tempfile.mkdtemp()
+        
+        store.write_database_cache(cfg.reactions_file, "reactions", "key", Unpicklable())
+        cache_folder=os.path.dirname(store.database_cache_file(cfg.reactions_file, "reactions"))
+        files=os.listdir(cache_folder)
+        
+        utils.remove_temp_folder(config.cache_directory)
+        config.cache_directory=cache_directory
+        
+        self.assertEqual(files, [])
+            
+    def test_PathwaysDatabase_compiled_cache_stale(self):
+        """
+        Pathways database class: Test the compiled database is rebuilt
+        if the source file has changed
+        """
+        
+        cache_directory=config.cache_directory
+        config.cache_directory=tempfile.mkdtemp()
+        
+        pathways_file=os.path.join(config.cache_directory,"pathways.tsv")
+        with open(pathways_file,"w") as file_handle:
+            file_handle.write(open(cfg.pathways_flat_file).read())
+        pathways_database_store=store.PathwaysDatabase(pathways_file)
+        
+        # add a pathway and change the modification time
+        with open(pathways_file,"a") as file_handle:
+            file_handle.write("\nNEW-PWY\tRXN1\tRXN2\n")
+        os.utime(pathways_file,(0,0))
+        pathways_database_updated=store.PathwaysDatabase(pathways_file)
+        
+        utils.remove_temp_folder(config.cache_directory)
+        config.cache_directory=cache_directory
+        
+        self.assertEqual(sorted(pathways_database_updated.pathway_list()),
+            sorted(pathways_database_store.pathway_list()+["NEW-PWY"]))
+        self.assertEqual(pathways_database_updated.find_reactions("NEW-PWY"),["RXN1","RXN2"])
+            
+    def test_Names_index_error(self):
+        """
+        Names class: Test the partial index is removed if the index can not be written
+        """
+        
+        cache_directory=config.cache_directory
+        config.cache_directory=tempfile.mkdtemp()
+        
+        # a file which is not compressed with the gzip extension can not be read
+        names_file=os.path.join(config.cache_directory,"names.txt.gz")
+        with open(names_file,"w") as file_handle:
+            file_handle.write("UniRef50_Q6GZX4\tname\n")
+        
+        index_file=store.Names()._build_index(names_file, "key")
+        index_folder=os.path.dirname(store.database_cache_file(names_file, "names",
+            config.name_mapping_index_extension))
+        files=os.listdir(index_folder)
+        
+        utils.remove_temp_folder(config.cache_directory)
+        config.cache_directory=cache_directory
+        
+        self.assertEqual(index_file, None)
+        self.assertEqual(files, [])
+        
+    def test_Names_index_removed(self):
+        """
+        Names class: Test the names are read from the file if the index is removed
+        before a new connection is made (as for a forked process)
+        """
+        
+        cache_directory=config.cache_directory
+        database_cache_toggle=config.database_cache_toggle
+        config.cache_directory=tempfile.mkdtemp()
+        config.database_cache_toggle="on"
+        
+        names_index_store=store.Names(cfg.gene_families_to_names_file)
+        index_file=store.database_cache_file(cfg.gene_families_to_names_file,
+            "names", config.name_mapping_index_extension)
+        os.remove(index_file)
+        
+        # the connection is not included when pickled so a new connection is made
+        names_pickled=pickle.loads(pickle.dumps(names_index_store))
+        name=names_pickled.get_name("UniRef50_Q6GZX4")
+        index_exists=os.path.isfile(index_file)
+        
+        utils.remove_temp_folder(config.cache_directory)
+        config.cache_directory=cache_directory
+        config.database_cache_toggle=database_cache_toggle
+        
+        self.assertEqual(name,"UniRef50_Q6GZX4: Putative transcription factor 001R")
+        self.assertFalse(index_exists)
+        
+    def test_Names_index(self):
+        """
+        Names class: Test the names read from the index are the same as
+        those read from the file
+        """
+        
+        cache_directory=config.cache_directory
+        database_cache_toggle=config.database_cache_toggle
+        config.cache_directory=tempfile.mkdtemp()
+        
+        ids=["UniRef50_Q6GZX4","UniRef50_Q6GZW6","UniRef50_unknown"]
+        
+        config.database_cache_toggle="off"
+        names_store=store.Names(cfg.gene_families_to_names_file)
+        expected_names=[names_store.get_name(id) for id in ids]
+        
+        config.database_cache_toggle="on"
+        names_index_store=store.Names(cfg.gene_families_to_names_file)
+        names=names_index_store.get_names(ids)
+        index_exists=os.path.isfile(store.database_cache_file(cfg.gene_families_to_names_file,
+            "names", config.name_mapping_index_extension))
+        
+        # check the index can be used after pickling
+        names_pickled=pickle.loads(pickle.dumps(names_index_store))
+        
+        utils.remove_temp_folder(config.cache_directory)
+        config.cache_directory=cache_directory
+        config.database_cache_toggle=database_cache_toggle
+        
+        self.assertTrue(index_exists)
+        self.assertEqual(expected_names[0],"UniRef50_Q6GZX4: Putative transcription factor 001R")
+        self.assertEqual(expected_names[2],"UniRef50_unknown")
+        self.assertEqual([names[id] for id in ids],expected_names)
+        self.assertEqual([names_pickled.get_name(id) for id in ids],expected_names)
+        
     def test_PathwaysDatabase_read_pathways_count(self):
         """
         Pathways database class: Test the storing of a structured set of pathways
@@ -1192,5 +1390,96 @@ class TestHumann2StoreFunctions(unittest.TestCase):
         # Test the scores for all bugs and genes
         for bug in cfg.genetable_file_bug_scores:
             self.assertDictEqual(cfg.genetable_file_bug_scores[bug],gene_scores.scores_for_bug(bug))
-            
+
+    @unittest.skipIf(not biom_tables.biom_installed(), "biom is not installed")
+    def test_GeneScores_add_from_file_biom(self):
+        """
+        GeneScores class: Test add_from_file with a biom file written in process
+        Test the stratification is stored in the observation metadata
+        """
+        
+        output_format=config.output_format
+        config.output_format="biom"
+        
+        tempdir=tempfile.mkdtemp()
+        new_file=os.path.join(tempdir,"genefamilies.biom")
+        utilities.write_table(new_file, "# Gene Family", "sample", 
+            [("UNMAPPED", None, 1.5), ("gene1: name", None, 2), ("gene1: name", "g__A.s__B", 2)], "Gene")
+        config.output_format=output_format
+        
+        gene_scores=store.GeneScores()
+        unaligned_reads_count=gene_scores.add_from_file(new_file)
+        
+        import biom
+        metadata=biom.load_table(new_file).metadata(axis="observation")
+        utils.remove_temp_folder(tempdir)
+        
+        self.assertEqual(unaligned_reads_count, 1.5)
+        self.assertEqual(gene_scores.scores_for_bug("all"), {"gene1": 2})
+        self.assertEqual(gene_scores.scores_for_bug("g__A.s__B"), {"gene1": 2})
+        self.assertEqual([(item["feature"],item["stratum"]) for item in metadata],
+            [("UNMAPPED","all"),("gene1: name","all"),("gene1: name","g__A.s__B")])
+        
+    @unittest.skipIf(not biom_tables.biom_installed(), "biom is not installed")
+    def test_GeneScores_add_from_file_biom_without_extension(self):
+        """
+        GeneScores class: Test add_from_file with a biom file without the biom extension
+        """
+        
+        tempdir=tempfile.mkdtemp()
+        new_file=os.path.join(tempdir,"genefamilies_table.h5")
+        biom_tables.write_table(new_file, [("UNMAPPED", None, 1.5), ("gene1", None, 2), 
+            ("gene1", "g__A.s__B", 2)], "sample", "Gene")
+        
+        gene_scores=store.GeneScores()
+        unaligned_reads_count=gene_scores.add_from_file(new_file)
+        utils.remove_temp_folder(tempdir)
+        
+        self.assertEqual(unaligned_reads_count, 1.5)
+        self.assertEqual(gene_scores.scores_for_bug("all"), {"gene1": 2})
+        self.assertEqual(gene_scores.scores_for_bug("g__A.s__B"), {"gene1": 2})
+        
+    def test_TaxonPathways_pathways_for_bug(self):
+        """
+        TaxonPathways class: Test the pathways are found for the genus and species
+        Test the genus is used if the species is not known
+        """
+        
+        taxon_pathways=store.TaxonPathways()
+        taxon_pathways.add("P1",["Bacteroides thetaiotaomicron VPI-5482","Escherichia coli"])
+        taxon_pathways.add("P2",["Bacteroides fragilis"])
+        taxon_pathways.add("P3",[])
+        
+        bug="g__Bacteroides.s__Bacteroides_thetaiotaomicron"
+        self.assertEqual(taxon_pathways.pathways_for_bug(bug,"species"),set(["P1"]))
+        self.assertEqual(taxon_pathways.pathways_for_bug(bug,"genus"),set(["P1","P2"]))
+        self.assertEqual(taxon_pathways.pathways_for_bug("g__Bacteroides.s__Bacteroides_ovatus","species"),
+            set(["P1","P2"]))
+        self.assertEqual(taxon_pathways.pathways_for_bug("unclassified","species"),None)
+        self.assertEqual(taxon_pathways.pathways_for_bug("g__Unknown.s__Unknown_bug","genus"),None)
+        
+    def test_TaxonPathways_allowed(self):
+        """
+        TaxonPathways class: Test the pathways not included in the file are allowed
+        """
+        
+        taxon_pathways=store.TaxonPathways()
+        taxon_pathways.add("P1",["Escherichia coli"])
+        taxon_pathways.add("P2",["Bacteroides fragilis"])
+        
+        known_pathways=taxon_pathways.pathways_for_bug("g__Escherichia.s__Escherichia_coli","species")
+        self.assertTrue(taxon_pathways.allowed("P1",known_pathways))
+        self.assertFalse(taxon_pathways.allowed("P2",known_pathways))
+        self.assertTrue(taxon_pathways.allowed("UNIPATHWAY1",known_pathways))
+        self.assertTrue(taxon_pathways.allowed("P2",None))
+        
+    def test_TaxonPathways_add_from_file(self):
+        """
+        TaxonPathways class: Test the pathways to organisms file is read
+        """
+        
+        taxon_pathways=store.TaxonPathways(config.metacyc_pathways_to_organisms)
         
+        self.assertTrue(taxon_pathways.is_listed("1CMET2-PWY"))
+        self.assertTrue("1CMET2-PWY" in taxon_pathways.pathways_for_bug(
+            "g__Pseudomonas.s__Pseudomonas_putida","species"))
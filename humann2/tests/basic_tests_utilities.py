@@ -7,12 +7,15 @@ import logging
 import gzip
 import tempfile
 import shutil
+import subprocess
+import argparse
 
 import cfg
 import utils
 
 from humann2 import utilities
 from humann2 import config
+from humann2 import humann2
 
 class TestHumann2UtilitiesFunctions(unittest.TestCase):
     """
@@ -430,3 +433,174 @@ class TestHumann2UtilitiesFunctions(unittest.TestCase):
         self.assertEqual(result[1],expected_result[1])         
     
         
+
+    def test_collapse_duplicate_reads_fastq(self):
+        """
+        Test the collapse_duplicate_reads function with a fastq file
+        Test the first read of each sequence is kept with its quality scores
+        """
+        
+        config.temp_dir=utils.create_temp_folder("dedup")
+        config.file_basename="test"
+        
+        new_file, read_counts=utilities.collapse_duplicate_reads(cfg.duplicate_reads_fastq_file)
+        
+        records=list(utilities.read_fasta_or_fastq_records(new_file))
+        utils.remove_temp_folder(config.temp_dir)
+        
+        self.assertEqual([record[0] for record in records],["@read1 sample","@read2","@read4"])
+        self.assertEqual(records[0][2],"IIIIIIIIIIIIIIIIIII")
+        self.assertEqual(read_counts,{"read1":3,"read2":2})
+        
+    def test_collapse_duplicate_reads_fasta_multiline(self):
+        """
+        Test the collapse_duplicate_reads function with a fasta file
+        Test sequences split over multiple lines are identified as duplicates
+        """
+        
+        config.temp_dir=utils.create_temp_folder("dedup")
+        config.file_basename="test"
+        
+        new_file, read_counts=utilities.collapse_duplicate_reads(cfg.duplicate_reads_fasta_file)
+        
+        records=list(utilities.read_fasta_or_fastq_records(new_file))
+        utils.remove_temp_folder(config.temp_dir)
+        
+        self.assertEqual([record[0] for record in records],[">read1",">read2",">read4"])
+        self.assertEqual(records[0][1],"ATCGATCGATCGGATTACA")
+        self.assertEqual(read_counts,{"read1":2})
+        
+    def test_write_table_tsv(self):
+        """
+        Test the write_table function with the tsv output format
+        Test the stratified rows include the bug
+        """
+        
+        output_format=config.output_format
+        config.output_format="tsv"
+        
+        file_handle, new_file=tempfile.mkstemp()
+        os.close(file_handle)
+        utilities.write_table(new_file, "# Gene Family", "sample", 
+            [("UNMAPPED", None, 1.5), ("gene1", None, 2), ("gene1", "g__A.s__B", 2)], "Gene")
+        config.output_format=output_format
+        
+        lines=open(new_file).read().split("\n")
+        utils.remove_temp_file(new_file)
+        
+        self.assertEqual(lines,["# Gene Family\tsample","UNMAPPED\t"+utilities.format_float_to_string(1.5),
+            "gene1\t"+utilities.format_float_to_string(2),"gene1|g__A.s__B\t"+utilities.format_float_to_string(2)])
+        
+    def test_write_table_gzip(self):
+        """
+        Test the write_table function writes a compressed file
+        Test the rows can be generated as they are written
+        """
+        
+        output_format=config.output_format
+        config.output_format="tsv"
+        
+        tempdir=tempfile.mkdtemp()
+        new_file=os.path.join(tempdir,"table.tsv.gz")
+        rows=(("gene"+str(i), None, i) for i in range(3))
+        utilities.write_table(new_file, "# Gene Family", "sample", rows, "Gene")
+        config.output_format=output_format
+        
+        file_handle=gzip.open(new_file,"rt")
+        lines=file_handle.read().split("\n")
+        file_handle.close()
+        utils.remove_temp_folder(tempdir)
+        
+        self.assertEqual(lines,["# Gene Family\tsample"]+["gene"+str(i)+"\t"+
+            utilities.format_float_to_string(i) for i in range(3)])
+        
+    def test_nonzero_threshold(self):
+        """
+        Test the nonzero_threshold function returns the smallest value not formatted as zero
+        """
+        
+        for decimals in [0,1,3,10]:
+            threshold=utilities.nonzero_threshold(decimals)
+            self.assertTrue(float("{:.{digits}f}".format(threshold, digits=decimals)) > 0)
+            self.assertEqual(float("{:.{digits}f}".format(threshold*(1-1e-15), digits=decimals)), 0)
+            
+    def test_get_software_version_output_cache(self):
+        """
+        Test the version output is reused from the cache until the executable is changed
+        """
+        
+        tempdir=tempfile.mkdtemp(dir=config.unnamed_temp_dir)
+        calls_file=os.path.join(tempdir,"calls")
+        exe=os.path.join(tempdir,"humann2_fake_tool")
+        def write_exe(version):
+            with open(exe,"w") as file_handle:
+                file_handle.write("#!/bin/sh\necho call >> "+calls_file+"\necho humann2_fake_tool v"+version+"\n")
+            os.chmod(exe,0o755)
+        
+        cache_directory=config.cache_directory
+        cache_toggle=config.tool_version_cache_toggle
+        path=os.environ["PATH"]
+        config.cache_directory=os.path.join(tempdir,"cache")
+        config.tool_version_cache_toggle="on"
+        os.environ["PATH"]=tempdir+os.pathsep+path
+        try:
+            write_exe("1.2.3")
+            outputs=[utilities.get_software_version_output("humann2_fake_tool","--version") for i in range(2)]
+            
+            # change the executable (with a new time) so the version is called again
+            write_exe("1.2.40")
+            os.utime(exe,(0,0))
+            outputs.append(utilities.get_software_version_output("humann2_fake_tool","--version"))
+            
+            with open(calls_file) as file_handle:
+                calls=len(file_handle.readlines())
+        finally:
+            config.cache_directory=cache_directory
+            config.tool_version_cache_toggle=cache_toggle
+            os.environ["PATH"]=path
+            utils.remove_temp_folder(tempdir)
+        
+        self.assertEqual(outputs,["humann2_fake_tool v1.2.3\n"]*2+["humann2_fake_tool v1.2.40\n"])
+        self.assertEqual(calls,2)
+        
+    def test_config_user_edit_settings_deferred(self):
+        """
+        Test the user edit config file is only read on the first access to one of its settings
+        """
+        
+        if sys.version_info < (3,7):
+            return
+        
+        code=("from humann2 import config; loaded=lambda: 'threads' in vars(config); "+
+            "before=loaded(); threads=config.threads; print(before, loaded(), threads == config.threads)")
+        output=subprocess.check_output([sys.executable,"-c",code],universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(utilities.__file__))))
+        
+        self.assertEqual(output.split(),["False","True","True"])
+        
+    def test_parse_arguments_user_edit_settings_deferred(self):
+        """
+        Test the user edit config file is not read to parse the options (only to print the help)
+        """
+        
+        if sys.version_info < (3,7):
+            return
+        
+        code=("from humann2 import config, humann2; loaded=lambda: 'threads' in vars(config); "+
+            "args=humann2.parse_arguments(['humann2','--submit','humann2.sock','-i','in.fastq','-o','out']); "+
+            "print(loaded(), args.threads, args.evalue)")
+        output=subprocess.check_output([sys.executable,"-c",code],universal_newlines=True,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(utilities.__file__))))
+        
+        self.assertEqual(output.split(),["False","None","None"])
+        
+    def test_HelpFormatter_user_edit_defaults(self):
+        """
+        Test the help includes the defaults from the user edit config file
+        """
+        
+        parser=argparse.ArgumentParser(formatter_class=humann2.HelpFormatter)
+        parser.add_argument("--threads", help="number of threads\n[DEFAULT: %(default)s]", type=int)
+        
+        self.assertTrue("[DEFAULT: " + str(config.threads) + "]" in parser.format_help())
+        self.assertEqual(parser.parse_args([]).threads, None)
@@ -0,0 +1,426 @@
+"""
+HUMAnN2: benchmarks module
+Benchmarks of the computations run for each sample and of the table tools
+
+The benchmarks are run on synthetic data (see humann2.tests.synthetic) so they do not
+require the alignment software or the full databases. For each benchmark the best time
+of the repeats is reported with the throughput and the peak memory allocated (traced
+with tracemalloc in an additional run). The results can be saved to a json file and
+compared to a baseline saved from a prior run.
+
+Run with: python -m humann2.tests.benchmarks (or humann2_test --benchmark)
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from humann2 import config
+from humann2 import store
+from humann2.search import nucleotide
+from humann2.search import translated
+from humann2.search import blastx_coverage
+from humann2.quantify import chi2cdf
+from humann2.quantify import modules
+from humann2.tools import util
+from humann2.tools import join_tables
+from humann2.tools import renorm_table
+from humann2.tools import regroup_table
+from humann2.tools import split_stratified_table
+from humann2.tests import synthetic
+
+BASELINE_VERSION=1
+DEFAULT_REGRESSION_THRESHOLD=1.25
+STRUCTURED_PATHWAYS_DATABASE=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "data","pathways","metacyc_pathways_structured")
+
+# the config settings changed to run the benchmarks
+BENCHMARK_SETTINGS=["temp_dir","unnamed_temp_dir","file_basename","minpath_toggle","xipe_toggle",
+    "threads"]
+
+def time_function(function, setup, repeats):
+    """
+    Return the best time (in seconds) to run the function
+    The setup returns the arguments for each run and is not included in the time
+    """
+
+    best=None
+    for i in range(repeats):
+        args=setup()
+        start=time.time()
+        function(*args)
+        elapsed=time.time()-start
+        if best is None or elapsed < best:
+            best=elapsed
+
+    return best
+
+def peak_memory(function, setup):
+    """
+    Return the peak memory (in bytes) allocated while running the function
+    """
+
+    if not tracemalloc:
+        return None
+
+    args=setup()
+    tracemalloc.start()
+    try:
+        function(*args)
+        current, peak=tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak
+
+def benchmark(name, function, setup, items, unit, repeats):
+    """
+    Return the results of the benchmark of the function
+    """
+
+    seconds=time_function(function, setup, repeats)
+    return {"name": name, "seconds": seconds, "items": items, "unit": unit,
+        "throughput": items/seconds if seconds > 0 else None,
+        "peak_memory": peak_memory(function, setup)}
+
+@contextlib.contextmanager
+def benchmark_config(threads=1):
+    """
+    Set the config for the benchmarks (restoring the settings when complete)
+    and yield a temp folder for the files
+    """
+
+    settings=dict((name, getattr(config, name)) for name in BENCHMARK_SETTINGS)
+    stdout, stderr=sys.stdout, sys.stderr
+    folder=tempfile.mkdtemp(prefix="humann2_benchmarks_")
+    config.temp_dir=folder
+    config.unnamed_temp_dir=folder
+    config.file_basename="benchmark"
+    config.minpath_toggle="off"
+    config.xipe_toggle="off"
+    config.threads=threads
+    try:
+        # hide the messages printed by the functions benchmarked
+        sys.stdout=sys.stderr=StringIO()
+        yield folder
+    finally:
+        sys.stdout, sys.stderr=stdout, stderr
+        for name, value in settings.items():
+            setattr(config, name, value)
+        shutil.rmtree(folder, ignore_errors=True)
+
+def benchmark_chi2cdf(count=10000, repeats=3):
+    """
+    Compare the time to compute the chi2cdf one value at a time and in a batch
+    The values include repeats as found for the reaction scores of a bug
+    """
+
+    random.seed(1)
+    median=7.5
+    unique_values=[random.random()*median*3 for i in range(int(count/10))]
+    values=[random.choice(unique_values+[0]) for i in range(count)]
+
+    def chi2cdf_single(values, median):
+        return [chi2cdf.chi2cdf(value, median) for value in values]
+
+    def chi2cdf_batch(values, median):
+        # without the memoized values
+        chi2cdf._cache.clear()
+        return chi2cdf.chi2cdf_batch(values, median)
+
+    return [benchmark("chi2cdf single", chi2cdf_single, lambda: [values, median], count, "values", repeats),
+        benchmark("chi2cdf batch", chi2cdf_batch, lambda: [values, median], count, "values", repeats)]
+
+def benchmark_nucleotide(folder, reads, genes, bugs, multi_hit_rate, repeats):
+    """
+    Benchmark the nucleotide alignment post-processing of a sam file
+    """
+
+    sam_file=os.path.join(folder,"benchmark.sam")
+    lines=synthetic.write_sam(sam_file, reads, genes, bugs, multi_hit_rate)
+
+    def setup():
+        return [sam_file, store.Alignments(), store.Reads(), True]
+
+    return [benchmark("nucleotide.unaligned_reads", nucleotide.unaligned_reads, setup, lines,
+        "alignments", repeats)]
+
+def benchmark_translated(folder, reads, genes, multi_hit_rate, repeats):
+    """
+    Benchmark the translated alignment post-processing and the coverage filter of a blastm8 file
+    """
+
+    blastm8_file=os.path.join(folder,"benchmark.m8")
+    lines=synthetic.write_blastm8(blastm8_file, reads, genes, multi_hit_rate)
+
+    def setup():
+        return [store.Reads(), blastm8_file, store.Alignments()]
+
+    def coverage(blastm8_file):
+        return blastx_coverage.blastx_coverage(blastm8_file,
+            config.translated_subject_coverage_threshold, log_messages=True, apply_filter=True)
+
+    return [benchmark("translated.unaligned_reads", translated.unaligned_reads, setup, lines,
+            "alignments", repeats),
+        benchmark("blastx_coverage", coverage, lambda: [blastm8_file], lines, "alignments", repeats)]
+
+def benchmark_gene_scores(reads, genes, bugs, multi_hit_rate, repeats):
+    """
+    Benchmark computing the gene scores from the alignments
+    """
+
+    generator=random.Random(1)
+    names=synthetic.gene_names(genes)
+    lengths=synthetic.gene_lengths(genes)
+    bug_list=synthetic.bug_names(bugs)
+    hits=[]
+    for read in range(reads):
+        for hit in range(synthetic.hits_per_read(generator, multi_hit_rate)):
+            gene=synthetic.pick_gene(generator, genes)
+            hits.append((names[gene], lengths[gene], "read"+str(read), generator.uniform(80,100),
+                bug_list[gene % bugs]))
+
+    def setup():
+        alignments=store.Alignments()
+        for reference, length, query, matches, bug in hits:
+            alignments.add(reference, length, query, matches, bug)
+        return [alignments, store.GeneScores()]
+
+    def convert(alignments, gene_scores):
+        alignments.convert_alignments_to_gene_scores(gene_scores)
+
+    return [benchmark("Alignments.convert_alignments_to_gene_scores", convert, setup, len(hits),
+        "alignments", repeats)]
+
+def benchmark_pathways(genes, bugs, repeats):
+    """
+    Benchmark computing the reaction scores, identifying the pathways, and computing the
+    abundance and coverage of the structured pathways
+    """
+
+    reactions=synthetic.pathway_reactions(STRUCTURED_PATHWAYS_DATABASE)
+    reactions_database=synthetic.reactions_database(reactions, genes)
+    pathways_database=store.PathwaysDatabase(STRUCTURED_PATHWAYS_DATABASE, reactions_database)
+    gene_scores=synthetic.gene_scores(genes, bugs)
+    pathways_and_reactions_store=modules.identify_reactions_and_pathways(gene_scores,
+        reactions_database, pathways_database)
+    bug_pathways=sum(pathways_and_reactions_store.count_pathways(bug)
+        for bug in pathways_and_reactions_store.bug_list())
+
+    def structured_pathways(pathways_and_reactions_store, pathways_database):
+        modules.compute_pathways_abundance(pathways_and_reactions_store, pathways_database)
+        modules.compute_pathways_coverage(pathways_and_reactions_store, pathways_database)
+
+    # the "all" reaction scores are computed from the "all" gene scores for gene tables
+    # and derived from the reaction scores of the bugs for alignments
+    results=[]
+    for name, all_is_sum_of_bugs in [("all computed", False), ("all derived", True)]:
+        results.append(benchmark("compute_reaction_scores "+name, modules.compute_reaction_scores,
+            lambda: [synthetic.gene_scores(genes, bugs, all_is_sum_of_bugs=all_is_sum_of_bugs),
+            reactions_database], len(reactions)*(bugs+1), "bug reactions", repeats))
+
+    return results+[benchmark("identify_reactions_and_pathways", modules.identify_reactions_and_pathways,
+            lambda: [gene_scores, reactions_database, pathways_database], len(reactions)*(bugs+1),
+            "bug reactions", repeats),
+        benchmark("structured pathways abundance and coverage", structured_pathways,
+            lambda: [pathways_and_reactions_store, pathways_database], bug_pathways, "bug pathways",
+            repeats)]
+
+def benchmark_tools(folder, genes, bugs, repeats, samples=4):
+    """
+    Benchmark the main table tools on a stratified gene table
+    """
+
+    gene_tables=[]
+    for sample in range(samples):
+        gene_tables.append(os.path.join(folder,"sample"+str(sample)+"_genefamilies.tsv"))
+        rows=synthetic.write_gene_table(gene_tables[-1], genes, bugs, seed=sample+1)
+    gene_table=os.path.join(folder,"benchmark_genefamilies.tsv")
+    multi_sample_rows=synthetic.write_gene_table(gene_table, genes, bugs, samples=samples)
+    output_file=os.path.join(folder,"benchmark_output.tsv")
+    groups=synthetic.group_mapping(genes)
+
+    def renorm(gene_table, output_file):
+        table=util.Table(gene_table)
+        renorm_table.normalize(table)
+        table.write(output_file)
+
+    def regroup(gene_table, output_file):
+        table=util.Table(gene_table)
+        regroup_table.regroup(table, groups, "sum", 3, ungrouped=True)
+        table.write(output_file)
+
+    return [benchmark("join_tables", join_tables.join_gene_tables, lambda: [gene_tables, output_file],
+            rows*samples, "rows", repeats),
+        benchmark("renorm_table", renorm, lambda: [gene_table, output_file], multi_sample_rows,
+            "rows", repeats),
+        benchmark("regroup_table", regroup, lambda: [gene_table, output_file], multi_sample_rows,
+            "rows", repeats),
+        benchmark("split_stratified_table", split_stratified_table.split_table,
+            lambda: [gene_table, folder], multi_sample_rows, "rows", repeats)]
+
+def run_benchmarks(reads=20000, genes=5000, bugs=10, multi_hit_rate=0.3, repeats=3, threads=1,
+    selected=None):
+    """
+    Run the benchmarks (or those with names including the selected text)
+    Return the results
+    """
+
+    def run(*names):
+        return not selected or any(text in name for text in selected for name in names)
+
+    results=[]
+    with benchmark_config(threads) as folder:
+        if run("chi2cdf single","chi2cdf batch"):
+            results+=benchmark_chi2cdf(repeats=repeats)
+        if run("nucleotide.unaligned_reads"):
+            results+=benchmark_nucleotide(folder, reads, genes, bugs, multi_hit_rate, repeats)
+        if run("translated.unaligned_reads","blastx_coverage"):
+            results+=benchmark_translated(folder, reads, genes, multi_hit_rate, repeats)
+        if run("Alignments.convert_alignments_to_gene_scores"):
+            results+=benchmark_gene_scores(reads, genes, bugs, multi_hit_rate, repeats)
+        if run("compute_reaction_scores","identify_reactions_and_pathways","structured pathways"):
+            results+=benchmark_pathways(genes, bugs, repeats)
+        if run("join_tables","renorm_table","regroup_table","split_stratified_table"):
+            results+=benchmark_tools(folder, genes, bugs, repeats)
+
+    return [result for result in results if run(result["name"])]
+
+def check_baseline_settings(baseline, settings):
+    """
+    Check the baseline was run with the same settings (other than the repeats)
+    """
+
+    baseline_settings=baseline.get("settings",{})
+    different=sorted(name for name in settings if name != "repeats" 
+        and name in baseline_settings and baseline_settings[name] != settings[name])
+    if different:
+        sys.exit("CRITICAL ERROR: The baseline was run with different settings ( " +
+            ", ".join(name + " = " + str(baseline_settings[name]) for name in different) +
+            " ). Please run the benchmarks with the same settings as the baseline.")
+
+def compare_to_baseline(results, baseline, threshold=DEFAULT_REGRESSION_THRESHOLD, settings=None):
+    """
+    Add the ratio of the time to the baseline time to each result
+    Return the names of the benchmarks slower than the baseline by more than the threshold
+    """
+
+    if settings:
+        check_baseline_settings(baseline, settings)
+
+    baseline_seconds=dict((result["name"], result["seconds"]) for result in baseline.get("results",[]))
+    regressions=[]
+    for result in results:
+        prior=baseline_seconds.get(result["name"])
+        result["baseline_ratio"]=result["seconds"]/prior if prior else None
+        if result["baseline_ratio"] and result["baseline_ratio"] > threshold:
+            regressions.append(result["name"])
+
+    return regressions
+
+def format_results(results):
+    """
+    Return the lines of a table of the results
+    """
+
+    lines=["\t".join(["benchmark","time (ms)","throughput","peak memory (MB)","vs baseline"])]
+    for result in results:
+        throughput=""
+        if result["throughput"]:
+            throughput=str(int(round(result["throughput"])))+" "+result["unit"]+"/s"
+        memory=""
+        if result["peak_memory"] is not None:
+            memory=str(round(result["peak_memory"]/(1024.0*1024.0),2))
+        ratio=""
+        if result.get("baseline_ratio"):
+            ratio=str(round(result["baseline_ratio"],2))+"x"
+        lines.append("\t".join([result["name"],str(round(result["seconds"]*1000,3)),throughput,memory,ratio]))
+
+    return lines
+
+def parse_arguments(args):
+    """
+    Parse the arguments from the user
+    """
+
+    parser = argparse.ArgumentParser(
+        description= "HUMAnN2 Benchmarks\n",
+        formatter_class=argparse.RawTextHelpFormatter,
+        prog="humann2_benchmarks")
+    parser.add_argument("--reads", help="number of reads\n[DEFAULT: 20000]", type=int, default=20000)
+    parser.add_argument("--genes", help="number of genes\n[DEFAULT: 5000]", type=int, default=5000)
+    parser.add_argument("--bugs", help="number of bugs\n[DEFAULT: 10]", type=int, default=10)
+    parser.add_argument("--multi-hit-rate", help="rate of reads with more than one alignment\n[DEFAULT: 0.3]",
+        type=float, default=0.3)
+    parser.add_argument("--repeats", help="number of times to run each benchmark\n[DEFAULT: 3]",
+        type=int, default=3)
+    parser.add_argument("--threads", help="number of threads/processes\n[DEFAULT: 1]", type=int, default=1)
+    parser.add_argument("--benchmark", help="run the benchmarks with names including the text\n" +
+        "(can be provided multiple times)\n[DEFAULT: all benchmarks]", action="append")
+    parser.add_argument("--baseline", help="compare the results to the baseline json file")
+    parser.add_argument("--regression-threshold", help="the ratio of the time to the baseline time\n" +
+        "reported as a regression\n[DEFAULT: " + str(DEFAULT_REGRESSION_THRESHOLD) + "]",
+        type=float, default=DEFAULT_REGRESSION_THRESHOLD)
+    parser.add_argument("--output", help="write the results to the json file (to use as a baseline)")
+
+    return parser.parse_args(args)
+
+def main(args=None):
+    """
+    Run the benchmarks and print the results
+    Return 1 if any benchmark is slower than the baseline, otherwise 0
+    """
+
+    args=parse_arguments(sys.argv[1:] if args is None else args)
+    settings={"reads": args.reads, "genes": args.genes, "bugs": args.bugs,
+        "multi_hit_rate": args.multi_hit_rate, "repeats": args.repeats, "threads": args.threads}
+
+    # check the baseline before running the benchmarks
+    baseline=None
+    if args.baseline:
+        try:
+            with open(args.baseline) as file_handle:
+                baseline=json.load(file_handle)
+        except (EnvironmentError, ValueError):
+            sys.exit("CRITICAL ERROR: Unable to read baseline file: " + args.baseline)
+        check_baseline_settings(baseline, settings)
+
+    results=run_benchmarks(args.reads, args.genes, args.bugs, args.multi_hit_rate, args.repeats,
+        args.threads, args.benchmark)
+
+    regressions=[]
+    if baseline:
+        regressions=compare_to_baseline(results, baseline, args.regression_threshold, settings)
+
+    print("\n".join(format_results(results)))
+
+    if args.output:
+        with open(args.output,"w") as file_handle:
+            json.dump({"version": BASELINE_VERSION, "settings": settings, "results": results},
+                file_handle, indent=2, sort_keys=True)
+
+    if regressions:
+        print("\nBenchmarks slower than the baseline by more than " + str(args.regression_threshold) +
+            "x: " + ", ".join(regressions))
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
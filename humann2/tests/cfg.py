@@ -19,6 +19,8 @@ small_fasta_file=os.path.join(data_folder,"file.fasta")
 small_fasta_file_total_sequences=3
 small_fastq_file=os.path.join(data_folder,"file.fastq")
 small_fastq_file_total_sequences=2
+duplicate_reads_fastq_file=os.path.join(data_folder,"duplicate_reads.fastq")
+duplicate_reads_fasta_file=os.path.join(data_folder,"duplicate_reads.fasta")
 
 convert_fastq_file=os.path.join(data_folder,"convert_file.fastq")
 convert_fastq_at_character_file=os.path.join(data_folder,"convert_file_at_character.fastq")
@@ -249,4 +249,40 @@ class TestFunctionalHumann2EndtoEnd(unittest.TestCase):
             self.assertTrue(expression,message)
 
         # remove the temp directory
-        utils.remove_temp_folder(tempdir)
\ No newline at end of file
+        utils.remove_temp_folder(tempdir)
+
+    def test_humann2_input_list(self):
+        """
+        Test the standard humann2 flow on a list of input files
+        Test the samples are processed in batch with two processes
+        """
+        
+        # create a temp directory for output
+        tempdir = utils.create_temp_folder("input_list")
+        
+        # write the list of input files
+        input_list=os.path.join(tempdir,"samples.txt")
+        with open(input_list,"w") as file_handle:
+            file_handle.write("\n".join([cfg.demo_sam,cfg.demo_gene_families])+"\n")
+        
+        # run humann2 test
+        command = ["humann2","--input-list",input_list,"--output",tempdir,"--batch-processes","2"]
+        utils.run_humann2(command)
+        
+        # check the output files are as expected for each sample
+        for expression, message in utils.check_output(cfg.expected_demo_output_files+
+            cfg.expected_demo_output_files_genefamilies_input, tempdir):
+            self.assertTrue(expression,message)
+
+        # check the output files are the same as those from running each sample on its own
+        for input_file, output_files in [(cfg.demo_sam, cfg.expected_demo_output_files),
+            (cfg.demo_gene_families, cfg.expected_demo_output_files_genefamilies_input)]:
+            sample_tempdir=os.path.join(tempdir,"single_"+utils.file_basename(input_file))
+            utils.run_humann2(["humann2","--input",input_file,"--output",sample_tempdir])
+            for file in output_files:
+                self.assertTrue(filecmp.cmp(os.path.join(tempdir,file),
+                    os.path.join(sample_tempdir,file),shallow=False),
+                    "Batch output differs from single sample output: " + file)
+
+        # remove the temp directory
+        utils.remove_temp_folder(tempdir)
@@ -66,8 +66,26 @@ def parse_arguments(args):
         help="run all tests\n", 
         action="store_true",
         default=False)
+    parser.add_argument(
+        "--benchmark", 
+        help="run the benchmarks on synthetic data (instead of the tests)\n" +
+        "(other options, ie --reads/--genes/--bugs/--multi-hit-rate/--repeats,\n" +
+        "are passed to the benchmarks, see python -m humann2.tests.benchmarks --help)\n", 
+        action="store_true",
+        default=False)
+    parser.add_argument(
+        "--benchmark-baseline", 
+        help="compare the benchmark results to the baseline json file\n")
+    parser.add_argument(
+        "--benchmark-output", 
+        help="write the benchmark results to the json file (to use as a baseline)\n")
+    
+    # the other options are passed to the benchmarks
+    args, args.benchmark_options=parser.parse_known_args()
+    if args.benchmark_options and not args.benchmark:
+        parser.error("unrecognized arguments: " + " ".join(args.benchmark_options))
     
-    return parser.parse_args()
+    return args
 
 def get_testdirectory():
     """ Return the location of all of the tests """
@@ -119,6 +137,16 @@ def main():
     # Parse arguments from command line
     args=parse_arguments(sys.argv)
     
+    # Run the benchmarks if requested
+    if args.benchmark:
+        from humann2.tests import benchmarks
+        benchmark_args=list(args.benchmark_options)
+        if args.benchmark_baseline:
+            benchmark_args+=["--baseline",args.benchmark_baseline]
+        if args.benchmark_output:
+            benchmark_args+=["--output",args.benchmark_output]
+        sys.exit(benchmarks.main(benchmark_args))
+    
     # Get the unittests
     test_suites=[]
     if not args.bypass_unit_tests:
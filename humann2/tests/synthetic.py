@@ -0,0 +1,212 @@
+"""
+HUMAnN2: synthetic module
+Generate synthetic alignments, gene tables, and databases at a configurable scale
+
+The reads are assigned to genes and bugs at random (with a fixed seed) so the files
+and stores generated are the same for each run with the same settings.
+"""
+
+import random
+
+from humann2 import store
+
+READ_LENGTH=100
+NUCLEOTIDES="ACGT"
+
+def bug_names(bugs):
+    """ Return the names of the bugs """
+
+    return ["g__Genus"+str(i)+".s__Genus"+str(i)+"_species"+str(i) for i in range(bugs)]
+
+def gene_names(genes):
+    """ Return the names of the gene families """
+
+    return ["UniRef90_G"+str(i).zfill(7) for i in range(genes)]
+
+def gene_lengths(genes, seed=1):
+    """ Return the length (in nucleotides) of each gene """
+
+    generator=random.Random(seed)
+    return [generator.randint(100,1000)*3 for i in range(genes)]
+
+def hits_per_read(generator, multi_hit_rate):
+    """ Return the number of alignments for a read """
+
+    hits=1
+    while generator.random() < multi_hit_rate and hits < 10:
+        hits+=1
+    return hits
+
+def pick_gene(generator, genes):
+    """ Return a gene for a read (with a few genes abundant as found in a community) """
+
+    return int(genes*generator.random()**3)
+
+def md_field(generator, identity):
+    """ Return a md field for a read with mismatches for the identity """
+
+    mismatches=int(round(READ_LENGTH*(100.0-identity)/100.0))
+    positions=sorted(generator.sample(range(1,READ_LENGTH-1),mismatches))
+    md=""
+    prior=0
+    for position in positions:
+        md+=str(position-prior)+generator.choice(NUCLEOTIDES)
+        prior=position+1
+    return "MD:Z:"+md+str(READ_LENGTH-prior)
+
+def write_sam(file, reads=10000, genes=2000, bugs=10, multi_hit_rate=0.3, unaligned_rate=0.1, seed=1):
+    """
+    Write a sam file of nucleotide alignments of the reads to the genes of the bugs
+    Return the total number of alignments (including the unaligned reads)
+    """
+
+    generator=random.Random(seed)
+    names=gene_names(genes)
+    lengths=gene_lengths(genes, seed)
+    bug_list=bug_names(bugs)
+    sequence="".join(generator.choice(NUCLEOTIDES) for i in range(READ_LENGTH))
+    quality="I"*READ_LENGTH
+
+    lines=0
+    with open(file,"w") as file_handle:
+        file_handle.write("@HD\tVN:1.0\tSO:unsorted\n")
+        for read in range(reads):
+            query="read"+str(read)
+            if generator.random() < unaligned_rate:
+                file_handle.write("\t".join([query,"4","*","0","0","*","*","0","0",sequence,quality])+"\n")
+                lines+=1
+                continue
+            for hit in range(hits_per_read(generator, multi_hit_rate)):
+                gene=pick_gene(generator, genes)
+                bug=bug_list[gene % bugs]
+                reference="|".join(["gi|"+str(gene)+"|ref|NZ_"+str(gene)+"|:1-"+str(lengths[gene]),
+                    str(gene % bugs),bug,names[gene],names[gene].replace("UniRef90","UniRef50"),
+                    str(lengths[gene])])
+                identity=generator.choice([100.0,99.0,98.0,95.0,90.0])
+                file_handle.write("\t".join([query,"0" if hit == 0 else "256",reference,"1","42",
+                    str(READ_LENGTH)+"M","*","0","0",sequence,quality,"AS:i:0",
+                    md_field(generator, identity)])+"\n")
+                lines+=1
+
+    return lines
+
+def write_blastm8(file, reads=10000, genes=2000, multi_hit_rate=0.3, seed=1):
+    """
+    Write a blastm8 file of translated alignments of the reads to the genes
+    The query positions are in nucleotides and the subject positions are in amino acids
+    Return the total number of alignments
+    """
+
+    generator=random.Random(seed)
+    names=gene_names(genes)
+    lengths=gene_lengths(genes, seed)
+    protein_read_length=int(READ_LENGTH/3)
+
+    lines=0
+    with open(file,"w") as file_handle:
+        for read in range(reads):
+            query="read"+str(read)+"|"+str(READ_LENGTH)
+            for hit in range(hits_per_read(generator, multi_hit_rate)):
+                gene=pick_gene(generator, genes)
+                protein_length=int(lengths[gene]/3)
+                subject_start=generator.randint(1,protein_length-protein_read_length)
+                identity=round(generator.uniform(40.0,100.0),1)
+                evalue="%.1e" % (10**generator.uniform(-30,0))
+                file_handle.write("\t".join([query,names[gene]+"|"+str(lengths[gene]),str(identity),
+                    str(protein_read_length),"0","0","1",str(protein_read_length*3),str(subject_start),
+                    str(subject_start+protein_read_length-1),evalue,"50.0"])+"\n")
+                lines+=1
+
+    return lines
+
+def gene_scores(genes=2000, bugs=10, genes_per_bug=None, all_is_sum_of_bugs=True, seed=1):
+    """
+    Return a gene scores store with the scores for each bug and for all bugs
+    """
+
+    generator=random.Random(seed)
+    names=gene_names(genes)
+    if genes_per_bug is None:
+        genes_per_bug=max(1,int(genes/bugs))
+
+    scores=store.GeneScores()
+    all_scores={}
+    for bug in bug_names(bugs):
+        bug_scores=dict((gene, generator.random()*100) for gene in generator.sample(names, genes_per_bug))
+        scores.add(bug_scores, bug)
+        for gene, score in bug_scores.items():
+            all_scores[gene]=all_scores.get(gene,0)+score
+    scores.add(all_scores, "all", all_is_sum_of_bugs=all_is_sum_of_bugs)
+
+    return scores
+
+def write_gene_table(file, genes=2000, bugs=10, samples=1, genes_per_bug=None, seed=1):
+    """
+    Write a stratified gene table with a column for each sample
+    Return the total number of rows
+    """
+
+    generator=random.Random(seed)
+    names=gene_names(genes)
+    bug_list=bug_names(bugs)
+    if genes_per_bug is None:
+        genes_per_bug=max(1,int(genes/bugs))
+    genes_for_bugs=[generator.sample(range(genes), genes_per_bug) for bug in bug_list]
+    bugs_for_genes={}
+    for bug, gene_list in zip(bug_list, genes_for_bugs):
+        for gene in gene_list:
+            bugs_for_genes.setdefault(gene,[]).append(bug)
+
+    def values(count=1):
+        return [str(round(generator.random()*100*count,4)) for sample in range(samples)]
+
+    lines=0
+    with open(file,"w") as file_handle:
+        file_handle.write("\t".join(["# Gene Family"]+["sample"+str(i)+"_Abundance-RPKs"
+            for i in range(samples)])+"\n")
+        file_handle.write("\t".join(["UNMAPPED"]+values())+"\n")
+        lines+=1
+        for gene in sorted(bugs_for_genes):
+            file_handle.write("\t".join([names[gene]]+values(len(bugs_for_genes[gene])))+"\n")
+            lines+=1
+            for bug in bugs_for_genes[gene]:
+                file_handle.write("\t".join([names[gene]+"|"+bug]+values())+"\n")
+                lines+=1
+
+    return lines
+
+def pathway_reactions(pathways_file):
+    """
+    Return the names of the reactions in a (structured) pathways file
+    """
+
+    reactions=set()
+    with open(pathways_file) as file_handle:
+        for line in file_handle:
+            for item in line.rstrip().split("\t")[1:]:
+                for reaction in item.replace("(", " ").replace(")", " ").replace(",", " ").split():
+                    reactions.add(reaction.lstrip("-"))
+    reactions.discard("")
+
+    return sorted(reactions)
+
+def reactions_database(reactions, genes=2000, genes_per_reaction=5, seed=1):
+    """
+    Return a reactions database with the reactions each mapped to genes at random
+    """
+
+    generator=random.Random(seed)
+    names=gene_names(genes)
+    database=store.ReactionsDatabase()
+    database.add_reactions(dict((reaction, generator.sample(names, genes_per_reaction))
+        for reaction in reactions))
+
+    return database
+
+def group_mapping(genes=2000, groups=500, seed=1):
+    """
+    Return a mapping of each gene to a group (as used to regroup tables)
+    """
+
+    generator=random.Random(seed)
+    return dict((gene, {"GROUP"+str(generator.randrange(groups)): 1}) for gene in gene_names(genes))
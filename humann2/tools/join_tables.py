@@ -8,7 +8,7 @@ This module will join gene and pathway tables output by HUMAnN2.
 Dependencies: Biom (only required if running with .biom files)
 
 To Run: 
-$ ./join_tables.py -i <input_dir> -o <gene_table.{tsv,biom}>
+$ ./join_tables.py -i <input_dir> -o <gene_table.{tsv,biom,columnar}>
 
 """
 
@@ -20,6 +20,7 @@ import shutil
 import re
 
 from humann2.tools import util
+from humann2 import columnar_tables
 
 GENE_TABLE_DELIMITER="\t"
         
@@ -234,6 +235,13 @@ def main():
             os.close(file_out)
             join_gene_tables(gene_tables,new_file)
             util.tsv_to_biom(new_file, args.output)
+        elif args.output.endswith(util.COLUMNAR_FILE_EXTENSION):
+            # join to a temp tsv file and then convert to columnar
+            file_out, new_file=tempfile.mkstemp(dir=output_dir)
+            os.close(file_out)
+            join_gene_tables(gene_tables,new_file,verbose=args.verbose)
+            columnar_tables.tsv_to_columnar(new_file, args.output)
+            os.remove(new_file)
         else:
             join_gene_tables(gene_tables,args.output,verbose=args.verbose)
                 
@@ -82,7 +82,7 @@ def get_args ():
     parser.add_argument( 
         "-i", "--input", 
         default=None,
-        help="Original output table (tsv or biom format); default=[TSV/STDIN]",
+        help="Original output table (tsv, biom, or columnar format); default=[TSV/STDIN]",
         )
     parser.add_argument( 
         "-n", "--names", 
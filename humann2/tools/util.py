@@ -7,6 +7,8 @@ import csv
 import gzip
 import bz2
 
+from humann2 import columnar_tables
+
 # ---------------------------------------------------------------
 # utilities used by the split and join tables scripts
 # ---------------------------------------------------------------
@@ -18,6 +20,9 @@ GENE_TABLE_COMMENT_LINE="#"
 # the extension used for biom files
 BIOM_FILE_EXTENSION=".biom"
 
+# the extension used for columnar files
+COLUMNAR_FILE_EXTENSION=columnar_tables.FILE_EXTENSION
+
 def find_exe_in_path(exe):
     """
     Check that an executable exists in $PATH
@@ -181,6 +186,8 @@ class Table ( ):
         
         if path.endswith(BIOM_FILE_EXTENSION):
             self.write_biom(path, rows)
+        elif path.endswith(COLUMNAR_FILE_EXTENSION):
+            self.write_columnar(path)
         else:
             self.write_tsv(path, rows)
         
@@ -237,6 +244,18 @@ class Table ( ):
             table.to_hdf5(file_handle, "humann2 utility script")
         
 
+    def write_columnar ( self, path ):
+        """ Write the file in columnar format (the values are not rounded) """
+        
+        rows = ( columnar_tables.split_id( self.rowheads[i] ) + ( [float( value ) for value in self.data[i]], )
+            for i in range( len( self.rowheads ) ) )
+        try:
+            columnar_tables.write_table( path, self.anchor, self.colheads, rows )
+        except ValueError:
+            sys.exit( "ERROR: Unable to write columnar file, all values must be numbers: " + path )
+        except EnvironmentError:
+            sys.exit( "Problem writing file: " + path )
+
 class Ticker( ):
     def __init__( self, iterable, step=100, pad="  " ):
         self.count = 0        
@@ -303,15 +322,32 @@ def read_biom_table( path ):
         
     return tsv_table
 
+def read_columnar_table( path ):
+    """
+    return the lines in the columnar file
+    """
+    
+    try:
+        table = columnar_tables.ColumnarTable( path )
+    except (EnvironmentError, ValueError):
+        sys.exit("ERROR: Unable to read columnar input file.")
+    
+    for line in table.lines():
+        yield line
+    table.close()
+
 def gzip_bzip2_biom_open_readlines( path ):
     """
-    return the lines in the opened file for tab delimited text, gzip, bzip2 and biom files
+    return the lines in the opened file for tab delimited text, gzip, bzip2, biom, and columnar files
     """
 
     # if the file is biom, convert to text and return lines
     if path.endswith(BIOM_FILE_EXTENSION):
         for line in read_biom_table(path):
             yield line
+    elif path.endswith(COLUMNAR_FILE_EXTENSION):
+        for line in read_columnar_table(path):
+            yield line
     else:
         with try_zip_open( path ) as file_handle:
             for line in file_handle:
@@ -30,12 +30,6 @@ import re
 import shutil
 import tempfile
 
-# try to import urllib.request.urlretrieve for python3
-try:
-    from urllib.request import urlretrieve
-except ImportError:
-    from urllib import urlretrieve
-
 import tarfile
 import logging
 import traceback
@@ -43,16 +37,12 @@ import gzip
 import shutil
 import threading
 
-# try to import the python2 module Queue
-# if unable to import, try to import the python3 module queue
-try:
-    import Queue as queue
-except ImportError:
-    import queue
-
 import datetime
 import time
 import math
+import decimal
+import struct
+import json
 
 from . import config
 from .search import pick_frames
@@ -86,7 +76,7 @@ def determine_file_format(file):
     Qname    Sname    id    len    mismatched    gap    Qstart    Qend    Sstart \
     Send    e-value    bit_score
     
-    Bam, biom, and gzipped files are recognized based on their extensions
+    Bam, biom, columnar, alignment store, and gzipped files are recognized based on their extensions
     
     Error is return if the file is not of a known format
     """
@@ -123,6 +113,10 @@ def determine_file_format(file):
         format="bam"
     elif file.endswith(".biom"):
         format="biom"
+    elif file.endswith(config.columnar_table_extension):
+        format="columnar"
+    elif file.endswith(config.alignment_store_extension):
+        format="alignmentstore"
     # check that second line is only nucleotides or amino acids
     elif re.search("^[A-Z|a-z]+$", second_line):
         # check first line to determine fasta or fastq format
@@ -361,6 +355,86 @@ def return_module_path(module):
                 return path
     return ""
 
+def tool_version_cache_file():
+    """
+    Return the file storing the versions of the software
+    """
+    
+    return os.path.join(config.cache_directory, config.tool_version_cache_file)
+
+def read_tool_version_cache():
+    """
+    Return the versions of the software stored in the cache
+    """
+    
+    try:
+        with open(tool_version_cache_file()) as file_handle:
+            cache=json.load(file_handle)
+    except (EnvironmentError, ValueError):
+        cache={}
+        
+    return cache if isinstance(cache, dict) else {}
+
+def write_tool_version_cache(cache):
+    """
+    Write the versions of the software to the cache
+    """
+    
+    # import here as the checkpoint module imports this module
+    from . import checkpoint
+    
+    cache_file=tool_version_cache_file()
+    cache_folder=os.path.dirname(cache_file)
+    try:
+        if not os.path.isdir(cache_folder):
+            os.makedirs(cache_folder)
+        # write to a temp file and then rename so other processes never read a partial file
+        with checkpoint.atomic_write(cache_file) as file_handle:
+            file_handle.write(json.dumps(cache, indent=2, sort_keys=True).encode("utf-8"))
+    except EnvironmentError:
+        logger.warning("Unable to write the software versions cache: " + cache_file)
+
+def get_software_version_output(exe, flag):
+    """
+    Return the output of the software for the version flag
+    The output is reused from the cache until the executable is changed
+    """
+    
+    key=None
+    if config.tool_version_cache_toggle == "on":
+        try:
+            path=os.path.realpath(os.path.join(return_exe_path(exe),exe))
+            stats=os.stat(path)
+            key=path+"\t"+flag
+            executable={"mtime": stats.st_mtime, "size": stats.st_size}
+        except EnvironmentError:
+            key=None
+            
+    if key:
+        cached=read_tool_version_cache().get(key,{})
+        if (cached.get("mtime") == executable["mtime"] and cached.get("size") == executable["size"]
+            and cached.get("output")):
+            logger.debug("Using the cached version output for software: " + exe)
+            return cached["output"]
+    
+    try:
+        process = subprocess.Popen([exe,flag],stderr=subprocess.STDOUT,
+            stdout=subprocess.PIPE, universal_newlines=True)
+        process_out=process.communicate()[0]
+    except EnvironmentError:
+        message="Error trying to call software version"
+        logger.debug(message)
+        return None
+    
+    # only store the output if found as the call could fail for a reason other than the version
+    if key and process_out:
+        cache=read_tool_version_cache()
+        executable["output"]=process_out
+        cache[key]=executable
+        write_tool_version_cache(cache)
+        
+    return process_out
+
 def check_software_version(exe,version):
     """
     Determine if the software is of the correct version
@@ -377,13 +451,7 @@ def check_software_version(exe,version):
         logger.critical(message)
         sys.exit("CRITICAL ERROR: " + message)
 
-    try:
-        process = subprocess.Popen([exe,version["flag"]],stderr=subprocess.STDOUT,
-            stdout=subprocess.PIPE, universal_newlines=True)
-        process_out=process.communicate()[0]
-    except EnvironmentError:
-        message="Error trying to call software version"
-        logger.debug(message)
+    process_out=get_software_version_output(exe,version["flag"])
         
     try:
         # find the version string and remove a "v" and ":" if present
@@ -395,7 +463,7 @@ def check_software_version(exe,version):
         current_minor_version=int(current_version[1])
         if "second minor" in version:
             current_second_minor_version=int(current_version[2])
-    except (NameError,KeyError,ValueError,IndexError):
+    except (AttributeError,KeyError,ValueError,IndexError):
         message="Can not call software version for " + exe
         logger.critical(message)
         sys.exit("CRITICAL ERROR: " + message + "\n")       
@@ -463,6 +531,13 @@ def download_tar_and_extract_with_progress_messages(url, filename, folder):
     
     print("Download URL: " + url) 
 
+    # import when needed as the url modules are slow to load
+    # try to import urllib.request.urlretrieve for python3
+    try:
+        from urllib.request import urlretrieve
+    except ImportError:
+        from urllib import urlretrieve
+
     try:
         url_handle = urlretrieve(url, filename, reporthook=ReportHook().report)
             
@@ -507,79 +582,99 @@ def check_outfiles(outfiles):
     else:
         return True
     
-class Worker(threading.Thread):
+# the resources used by the processes run from each thread
+process_usage=threading.local()
+
+# the resources used by all of the processes run
+process_usage_totals={"cpu_time":0.0,"peak_rss":0,"processes":0,"recent_peak_rss":0}
+process_usage_totals_lock=threading.Lock()
+
+def reset_process_usage():
+    """
+    Reset the record of the resources used by processes run from this thread
+    """
+    
+    process_usage.cpu_time=0.0
+    process_usage.peak_rss=0
+    
+def get_process_usage():
     """
-    Create a worker class for threads with a work queue
-    Threads also record exit codes to a locked dictionary
+    Return the cpu time (in seconds) and peak resident set size (in bytes)
+    of the processes run from this thread since the last reset
     """
+    
+    return getattr(process_usage,"cpu_time",0.0), getattr(process_usage,"peak_rss",0)
 
-    exit_codes_lock = threading.Lock()
+def record_process_usage(cpu_time, peak_rss):
+    """
+    Record the resources used by a process that has finished
+    """
+    
+    process_usage.cpu_time=getattr(process_usage,"cpu_time",0.0)+cpu_time
+    process_usage.peak_rss=max(getattr(process_usage,"peak_rss",0),peak_rss)
+    
+    with process_usage_totals_lock:
+        process_usage_totals["cpu_time"]+=cpu_time
+        process_usage_totals["peak_rss"]=max(process_usage_totals["peak_rss"],peak_rss)
+        process_usage_totals["recent_peak_rss"]=max(process_usage_totals["recent_peak_rss"],peak_rss)
+        process_usage_totals["processes"]+=1
 
-    def __init__(self, work_queue, exit_codes):
-        super(Worker, self).__init__()
-        self.work_queue = work_queue
-        self.exit_codes = exit_codes
-        
-    def run(self):
-        """
-        Get work from the queue and process
-        """
-        while True:
-            try:
-                id,command = self.work_queue.get()
-                self.process(id,command)
-            finally:
-                self.work_queue.task_done()
-                
-    def process(self, id, command):
-        """
-        Execute the command for the task id
-        Record the exit code
-        """
-        try:
-            execute_command_args_convert(command)
-            with self.exit_codes_lock:
-                self.exit_codes[id]=0
-        # Record the error in the exit codes              
-        except (EnvironmentError, subprocess.CalledProcessError):
-            with self.exit_codes_lock:
-                self.exit_codes[id]=-1
-        
-def command_threading(threads,commands):
-    """
-    Process a set of commands using a set of worker threads
-    """
-    
-    # Create a queue to hold work
-    work_queue = queue.Queue()
-    
-    # Create a set of worker threads
-    exit_codes={}
-    for number in range(threads):
-        worker = Worker(work_queue, exit_codes)
-        worker.daemon = True
-        worker.start()
-    
-    # Add the work to the queue and start the queue
-    commands_by_id={}
-    for id,command in enumerate(commands):
-        work_queue.put((id,command))
-        command=" ".join([command[0]]+[str(i) for i in command[1]])
-        commands_by_id[id]=command
-    work_queue.join()
-    
-    # Check for any errors in the threads
-    error_commands=[]
-    for id in exit_codes:
-        if exit_codes[id] != 0:
-            error_commands.append("Error message returned from command for thread task " 
-                + str(id) + ": " + commands_by_id[id]+"\n")
-            
-    if error_commands:
-        message="\nCRITICAL ERROR: Unable to process all thread commands.\n\n"
-        message+="\n".join(error_commands)
-        logger.critical(message)
-        sys.exit(message)
+def pop_recent_process_peak_rss():
+    """
+    Return the peak resident set size (in bytes) of the processes 
+    finished since the last call (from all threads)
+    """
+    
+    with process_usage_totals_lock:
+        peak_rss=process_usage_totals["recent_peak_rss"]
+        process_usage_totals["recent_peak_rss"]=0
+    
+    return peak_rss
+
+def wait_for_process(process):
+    """
+    Wait for the process to finish and return the exit code
+    Record the cpu time and peak memory of the process if available
+    """
+    
+    try:
+        pid, status, rusage = os.wait4(process.pid, 0)
+    except (AttributeError, OSError):
+        # wait4 is not available on all platforms
+        return process.wait()
+    
+    if os.WIFSIGNALED(status):
+        process.returncode=-os.WTERMSIG(status)
+    else:
+        process.returncode=os.WEXITSTATUS(status)
+    
+    # the max rss is reported in kilobytes on linux and bytes on mac os
+    peak_rss=rusage.ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss=peak_rss*1024
+    record_process_usage(rusage.ru_utime+rusage.ru_stime, peak_rss)
+    
+    return process.returncode
+
+def run_process(cmd, stdin=None, stdout=None, stderr=None, capture_output=None):
+    """
+    Run the command, raise CalledProcessError if return code is non-zero
+    If set, capture and return the output (with stderr) of the command
+    """
+    
+    output=None
+    if capture_output:
+        process=subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output=process.stdout.read()
+        process.stdout.close()
+    else:
+        process=subprocess.Popen(cmd, stdin=stdin, stdout=stdout, stderr=stderr)
+    
+    returncode=wait_for_process(process)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd, output=output)
+    
+    return output
 
 def execute_command_args_convert(args):
     """
@@ -693,9 +788,9 @@ def execute_command(exe, args, infiles, outfiles, stdout_file=None,
         try:
             if stdin_file or stdout_file or stderr_file:
                 # run command, raise CalledProcessError if return code is non-zero
-                p = subprocess.check_call(cmd, stdin=stdin, stdout=stdout, stderr=stderr)
+                run_process(cmd, stdin=stdin, stdout=stdout, stderr=stderr)
             else:
-                p_out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+                p_out = run_process(cmd, capture_output=True)
                 logger.debug(p_out)            
         except (EnvironmentError, subprocess.CalledProcessError) as e:
             message="Error executing: " + " ".join(cmd) + "\n"
@@ -1032,11 +1127,101 @@ def length_annotate_fasta(file):
         file_out.write(sequence_id+"\n")
         file_out.write(sequence+"\n")
         
-    file_out.close()    
+    file_out.close()
     file_handle_read.close()
 
-    return new_file      
-    
+    return new_file
+
+def read_fasta_or_fastq_records(file):
+    """
+    Yield the id line, sequence, and quality (empty for fasta) for each read
+    Sequences and qualities can span multiple lines
+    """
+
+    # check file exists
+    file_exists_readable(file)
+
+    file_format=fasta_or_fastq(file)
+    file_handle_read = open(file, "rt")
+
+    if file_format == "fastq":
+        line=file_handle_read.readline()
+        while line:
+            id_line=line.rstrip()
+            sequence=""
+            line=file_handle_read.readline()
+            while line and not line.startswith("+"):
+                sequence+=line.rstrip()
+                line=file_handle_read.readline()
+            # read in the quality which is the same length as the sequence
+            quality=""
+            line=file_handle_read.readline()
+            while line and len(quality) < len(sequence):
+                quality+=line.rstrip()
+                line=file_handle_read.readline()
+            if id_line:
+                yield (id_line, sequence, quality)
+    else:
+        id_line=""
+        sequence=""
+        for line in file_handle_read:
+            if line.startswith(">"):
+                if id_line:
+                    yield (id_line, sequence, "")
+                id_line=line.rstrip()
+                sequence=""
+            else:
+                sequence+=line.rstrip()
+        if id_line:
+            yield (id_line, sequence, "")
+
+    file_handle_read.close()
+
+def collapse_duplicate_reads(file):
+    """
+    Write a file with a single representative read for each set of reads
+    with exactly the same sequence, keeping the format of the input file
+    Return the new file and the multiplicity of each representative read id
+    Only reads with duplicates are included in the multiplicities (all others are one)
+    """
+
+    file_format=fasta_or_fastq(file)
+    if file_format == "fastq":
+        new_file=name_temp_file(config.dedup_reads_name_no_ext + ".fastq")
+    else:
+        new_file=name_temp_file(config.dedup_reads_name_no_ext + config.fasta_extension)
+
+    try:
+        file_out=open(new_file,"w")
+    except EnvironmentError:
+        sys.exit("CRITICAL ERROR: Unable to write file: " + new_file)
+
+    representative_ids={}
+    read_counts={}
+    total_reads=0
+    for id_line, sequence, quality in read_fasta_or_fastq_records(file):
+        total_reads+=1
+        id=id_line[1:].split(" ")[0]
+        representative_id=representative_ids.get(sequence)
+        if representative_id is None:
+            representative_ids[sequence]=id
+            if file_format == "fastq":
+                file_out.write("\n".join([id_line,sequence,"+",quality])+"\n")
+            else:
+                file_out.write(id_line+"\n"+sequence+"\n")
+        else:
+            read_counts[representative_id]=read_counts.get(representative_id,1)+1
+
+    file_out.close()
+
+    message=("Total reads: " + str(total_reads) + " ( " + str(len(representative_ids)) +
+        " unique sequences )")
+    logger.info(message)
+    if config.verbose:
+        print(message)
+
+    return new_file, read_counts
+
 def tsv_to_biom(tsv_file, biom_file, table_type):
     """
     Convert from a tsv to biom file
@@ -1069,6 +1254,63 @@ def biom_to_tsv(biom_file):
     
     return new_tsv_file
     
+def format_row(name, bug, value):
+    """
+    Return the output file line for the row (the bug is None if not stratified)
+    """
+    
+    if not bug is None:
+        name+=config.output_file_category_delimiter+bug
+    return name+config.output_file_column_delimiter+format_float_to_string(value)
+
+def open_output_file(file):
+    """
+    Return a buffered handle to write the output file (compressed if it ends with .gz)
+    """
+    
+    if file.endswith(".gz"):
+        return gzip.open(file, "wt")
+    return open(file, "w", config.output_write_buffer_size)
+
+def write_tsv_table(file, header, rows):
+    """
+    Write the header and rows (name, bug, value) to the tsv file
+    The rows are formatted and written one at a time so they can be generated as written
+    """
+    
+    file_handle=open_output_file(file)
+    file_handle.write(header)
+    for name, bug, value in rows:
+        file_handle.write("\n"+format_row(name, bug, value))
+    file_handle.close()
+
+def write_table(file, header, column_name, rows, table_type):
+    """
+    Write the rows (name, bug, value) to the output file in the output format
+    The bug is None for the rows which are not stratified
+    Biom files are written in process if the biom package is installed
+    """
+    
+    from . import biom_tables
+    from . import columnar_tables
+    
+    header+=config.output_file_column_delimiter+column_name
+    if config.output_format == "biom" and biom_tables.biom_installed():
+        # round the values as written to tsv files
+        biom_tables.write_table(file, [(name, bug, float(format_float_to_string(value))) 
+            for name, bug, value in rows], column_name, table_type)
+    elif config.output_format == "columnar":
+        columnar_tables.write_table(file, header.split(config.output_file_column_delimiter)[0], 
+            [column_name], ((name, bug, [value]) for name, bug, value in rows), 
+            config.output_max_decimals, config.columnar_value_type)
+    elif config.output_format == "biom":
+        # Write a temp file if a conversion to biom is selected
+        tmpfile=unnamed_temp_file()
+        write_tsv_table(tmpfile, header, rows)
+        tsv_to_biom(tmpfile,file,table_type)
+    else:
+        write_tsv_table(file, header, rows)
+
 def format_float_to_string(number):
     """
     Format a float to a string using the config max number of decimals
@@ -1076,6 +1318,29 @@ def format_float_to_string(number):
     
     return "{:.{digits}f}".format(number, digits=config.output_max_decimals)
 
+# the smallest value not formatted as zero for each number of decimals
+_nonzero_thresholds={}
+
+def nonzero_threshold(decimals=None):
+    """
+    Return the smallest value which is not zero when formatted with the 
+    number of decimals (the config max number of decimals if not set)
+    """
+    
+    if decimals is None:
+        decimals=config.output_max_decimals
+        
+    if not decimals in _nonzero_thresholds:
+        # values are rounded to zero up to half of the last decimal
+        half=decimal.Decimal(5)/decimal.Decimal(10)**(decimals+1)
+        threshold=float(half)
+        if decimal.Decimal(threshold) <= half:
+            # use the next float as the float nearest to half is rounded to zero
+            threshold=struct.unpack("<d",struct.pack("<q",struct.unpack("<q",struct.pack("<d",threshold))[0]+1))[0]
+        _nonzero_thresholds[decimals]=threshold
+        
+    return _nonzero_thresholds[decimals]
+
 def byte_to_gigabyte(byte):
     """
     Convert byte value to gigabyte
@@ -1187,11 +1452,12 @@ def get_length_annotation(id):
     return new_id, length    
     
 def get_filtered_translated_alignments(alignment_file_tsv, alignments, apply_filter=None,
-                            log_filter=None, unaligned_reads_store=None):
+                            log_filter=None, unaligned_reads_store=None, alignment_store=None):
     """
     Read through the alignment file, yielding filtered alignments
     Filter based on identity threshold, evalue, and coverage threshold
     Remove from unaligned reads store if set
+    Add all of the alignments (before filtering) to the alignment store if set
     """
 
     # read through the alignment file to identify ids
@@ -1275,6 +1541,12 @@ def get_filtered_translated_alignments(alignment_file_tsv, alignments, apply_fil
             # compute the number of matches
             matches=identity/100.0*alignment_length
             
+            if alignment_store:
+                alignment_store.add_translated(queryid, alignment_info[config.blast_reference_index],
+                    identity, alignment_length, evalue, query_start_index, query_stop_index, query_length,
+                    subject_start_index, subject_stop_index, 
+                    unaligned_reads_store.get_read_count(queryid) if unaligned_reads_store else 1)
+            
             # get the protein alignment information
             protein_name, gene_length, bug = alignments.process_reference_annotation(
                 alignment_info[config.blast_reference_index])